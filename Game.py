@@ -1,6 +1,31 @@
 import pygame
 import random
 import math
+import os
+import time
+import argparse
+import cProfile
+import json
+import xml.etree.ElementTree as ElementTree
+from collections import deque, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import atlas
+import level_cache
+from audio import AudioService
+from bullets import BulletArray, BulletPool, ENEMY_SHOT
+from controls import InputState
+from enemies import ENEMY_RANGE, ENEMY_SPEED, EnemySwarm
+from highscores import HighScoreStore
+from replay import InputRecorder, Replay
+from spatial import SpatialGroup
+
+# NumPy is only needed for the BulletArray bullet system and the enemy
+# swarm
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 # Global constants
 
@@ -15,6 +40,340 @@ BLUE = (0, 0, 255)
 SCREEN_WIDTH = 800
 SCREEN_HEIGHT = 600
 
+# The view scrolls when the player gets this close to the left or right
+SCROLL_LEFT = 120
+SCROLL_RIGHT = 500
+
+# Use BulletArray instead of bullet sprites when NumPy is installed
+USE_NUMPY_BULLETS = True
+
+# Points lost when an enemy shot hits the player
+PLAYER_HIT_PENALTY = 5
+
+# The game is simulated SIM_RATE ticks a second, however fast frames are
+# drawn. Speeds and gravity are per tick.
+SIM_RATE = 60
+SIM_DT = 1 / SIM_RATE
+
+# After a stall the simulation only catches up this many seconds, so a
+# slow frame can't make the next one slower still
+MAX_FRAME_TIME = 0.25
+
+# How many rendered strings the text cache keeps
+TEXT_CACHE_SIZE = 256
+
+# How many frames a profile covers
+PROFILE_FRAMES = 300
+
+# Only redraw the parts of the screen that changed while the view isn't
+# scrolling, instead of the whole frame
+DIRTY_RENDERING = False
+
+# How many levels are kept built at once, the one being played included
+RESIDENT_LEVELS = 2
+
+# Images used by the sprites, as (filename, colorkey) pairs
+PLAYER_IMAGE = ("aaa.png", BLUE)
+BLOCK_IMAGE = ("Enemy3.png", RED)
+PLATFORM_IMAGE = ("platform.png", BLACK)
+FLAG_IMAGE = ("flag2.png", BLACK)
+
+# The images packed into the sprite atlas, and the index atlas.py writes
+ATLAS_IMAGES = [PLAYER_IMAGE, BLOCK_IMAGE, PLATFORM_IMAGE, FLAG_IMAGE]
+ATLAS_FILE = "atlas.json"
+
+# The list of levels, in the order they are played. Each level is
+# described by its own file in the same folder.
+LEVEL_MANIFEST = "levels/manifest.json"
+
+# Images every level uses for its sprites
+LEVEL_IMAGES = [PLATFORM_IMAGE, BLOCK_IMAGE, FLAG_IMAGE]
+
+# Every image that has been loaded so far, keyed by filename, colorkey and
+# whether it has per-pixel alpha. Sprites share these surfaces.
+image_cache = {}
+
+# Images read from disk by decode_image() that haven't been converted for
+# the display yet, keyed by filename
+decoded_images = {}
+
+# Where the images in the sprite atlas are, keyed like image_cache, as
+# (atlas page, the atlas's colorkey, rect). None until read_atlas() reads
+# the index.
+atlas_index = None
+
+def atlas_stale():
+    """ Whether the atlas is missing or older than one of its images. """
+    try:
+        built = os.path.getmtime(ATLAS_FILE)
+        return any(os.path.getmtime(filename) > built for filename, colorkey in ATLAS_IMAGES)
+    except OSError:
+        return True
+
+def read_atlas():
+    """ The atlas index, read the first time. The atlas is built first if
+        it's stale. If it can't be written, images that have changed since
+        it was built are left out, so they are loaded from their own files,
+        and with no atlas at all every image is. """
+    global atlas_index
+    if atlas_index is None:
+        if atlas_stale():
+            try:
+                atlas.build(ATLAS_IMAGES, ATLAS_FILE)
+            except (OSError, pygame.error):
+                pass
+        index = {}
+        try:
+            with open(ATLAS_FILE) as file:
+                definition = json.load(file)
+            atlas_key = tuple(definition["colorkey"])
+            built = os.path.getmtime(ATLAS_FILE)
+            folder = os.path.dirname(ATLAS_FILE)
+            for sprite in definition["sprites"]:
+                if os.path.getmtime(sprite["file"]) > built:
+                    continue
+                colorkey = sprite["colorkey"]
+                if colorkey is not None:
+                    colorkey = tuple(colorkey)
+                index[(sprite["file"], colorkey, sprite["alpha"])] = (
+                    os.path.join(folder, sprite["page"]), atlas_key, pygame.Rect(sprite["rect"]))
+        except (OSError, ValueError, KeyError, TypeError):
+            index = {}
+        atlas_index = index
+    return atlas_index
+
+def decode_image(filename, colorkey=None, alpha=False):
+    """ Read and decode an image so that load_image() only has to convert
+        it. """
+    packed = read_atlas().get((filename, colorkey, alpha))
+    if packed is not None:
+        filename = packed[0]
+    if filename not in decoded_images and not (packed and packed[:2] + (False,) in image_cache):
+        decoded_images[filename] = pygame.image.load(filename)
+
+def load_image(filename, colorkey=None, alpha=False, copy=False):
+    """ Load an image, decoding and converting it only the first time.
+        Every later call with the same arguments gets the same surface
+        back, so don't draw on it unless you pass copy=True.
+
+        Images in the sprite atlas are pieces of the atlas, which has a
+        colorkey of its own in place of theirs. The atlas is built the
+        first time an image is loaded if it's missing or out of date. """
+    key = (filename, colorkey, alpha)
+    image = image_cache.get(key)
+    if image is None:
+        packed = read_atlas().get(key)
+        if packed is not None:
+            page, atlas_key, rect = packed
+            image = load_image(page, atlas_key).subsurface(rect)
+            image.set_colorkey(atlas_key)
+        else:
+            image = decoded_images.pop(filename, None)
+            if image is None:
+                image = pygame.image.load(filename)
+            if alpha:
+                image = image.convert_alpha()
+            else:
+                image = image.convert()
+            if colorkey is not None:
+                image.set_colorkey(colorkey)
+        image_cache[key] = image
+
+    if copy:
+        return image.copy()
+    return image
+
+# Parallax backgrounds that have been built, keyed by map file and the
+# scroll factors
+parallax_cache = {}
+
+# Parallax layers read by decode_parallax() that haven't been converted
+# for the display yet, with the same keys
+decoded_parallax = {}
+
+def decode_parallax(filename, factors):
+    """ Read, scale and merge the layers of a parallax background so that
+        load_parallax() only has to convert them. """
+    key = (filename, tuple(sorted(factors.items())))
+    if key not in parallax_cache and key not in decoded_parallax:
+        decoded_parallax[key] = ParallaxBackground.scale_layers(
+            ParallaxBackground.read_tmx(filename, factors))
+
+def load_parallax(filename, factors):
+    """ Build the parallax background for a map, only the first time. """
+    key = (filename, tuple(sorted(factors.items())))
+    parallax = parallax_cache.get(key)
+    if parallax is None:
+        depths = decoded_parallax.pop(key, None)
+        if depths is None:
+            depths = ParallaxBackground.scale_layers(
+                ParallaxBackground.read_tmx(filename, factors))
+        parallax = ParallaxBackground(depths)
+        parallax_cache[key] = parallax
+    return parallax
+
+def preload_images(images):
+    """ Load a list of (filename, colorkey) pairs into the image cache. """
+    for filename, colorkey in images:
+        load_image(filename, colorkey)
+
+class ParallaxBackground():
+    """ A background made of image layers that scroll at different
+        speeds, which makes far away things look far away.
+
+        The layers are loaded once and scaled to the height of the screen
+        in the display's pixel format. Layers next to each other with the
+        same scroll factor always line up, so they are merged into one
+        surface; drawing costs a couple of blits per distinct depth, no
+        matter how many layers there are. """
+
+    def __init__(self, depths):
+        """ Constructor. depths is a list of (surface, scroll factor),
+            back to front, from scale_layers(). A factor of 1 moves with
+            the world. """
+        # Put every depth in the display's format
+        self.depths = []
+        for i, (surface, factor) in enumerate(depths):
+            if i == 0:
+                surface = surface.convert()
+            else:
+                surface = surface.convert_alpha()
+            self.depths.append((surface, factor))
+
+    @staticmethod
+    def scale_layers(layers):
+        """ Load a list of (filename, scroll factor) layers, scale them to
+            the screen and merge the ones with the same factor. Returns the
+            depths for the constructor. """
+        depths = []
+        for filename, factor in layers:
+            image = pygame.image.load(filename)
+            if image.get_bitsize() < 24:
+                # smoothscale only works on 24 and 32 bit images. Blitting
+                # onto a new surface doesn't need the display, unlike
+                # convert().
+                converted = pygame.Surface(image.get_size(), pygame.SRCALPHA, 32)
+                converted.blit(image, (0, 0))
+                image = converted
+            width = image.get_width() * SCREEN_HEIGHT // image.get_height()
+            image = pygame.transform.smoothscale(image, (width, SCREEN_HEIGHT))
+
+            if depths and depths[-1][1] == factor:
+                depths[-1][0].blit(image, (0, 0))
+            else:
+                if not depths:
+                    # Nothing is drawn behind the back layer, so it can
+                    # be opaque, which is faster to blit
+                    surface = pygame.Surface(image.get_size())
+                    surface.fill(BLUE)
+                else:
+                    surface = pygame.Surface(image.get_size(), pygame.SRCALPHA)
+                surface.blit(image, (0, 0))
+                depths.append((surface, factor))
+        return depths
+
+    @staticmethod
+    def read_tmx(filename, factors):
+        """ The (filename, scroll factor) layers of a Tiled map, back to
+            front. A layer's image is the first tile in it that is bigger
+            than the map's tiles. """
+        folder = os.path.dirname(filename)
+        root = ElementTree.parse(filename).getroot()
+        tile_width = int(root.get("tilewidth"))
+
+        # First gid, tile width and image file of each tileset
+        tilesets = sorted((first_gid, int(tileset.get("tilewidth")), image_file)
+                          for first_gid, tileset, image_file
+                          in level_cache.read_tilesets(root, folder)
+                          if image_file is not None)
+
+        layers = []
+        for layer in root.iter("layer"):
+            if layer.get("name") not in factors:
+                continue
+            gids = [int(gid) for gid in layer.find("data").text.split(",") if gid.strip()]
+            for gid in gids:
+                if not gid:
+                    continue
+                tileset = None
+                for first_gid, width, image_file in tilesets:
+                    if first_gid <= gid:
+                        tileset = (width, image_file)
+                if tileset is not None and tileset[0] > tile_width:
+                    layers.append((tileset[1], factors[layer.get("name")]))
+                    break
+        return layers
+
+    def draw(self, screen, shift):
+        """ Draw the background for a camera shifted this far left/right. """
+        for surface, factor in self.depths:
+            width = surface.get_width()
+            x = int(shift * factor) % width
+            if x > 0:
+                x -= width
+            while x < SCREEN_WIDTH:
+                screen.blit(surface, (x, 0))
+                x += width
+
+def interpolate(start, end, alpha):
+    """ The whole number alpha of the way from start to end. """
+    return round(start + (end - start) * alpha)
+
+class Camera():
+    """ Keeps track of how far the view has scrolled. Sprites keep their
+        world positions, and are only moved onto the screen when they are
+        drawn. """
+
+    def __init__(self):
+        """ Constructor. The camera starts at the left of the world. """
+        # How far the world is shifted left/right on the screen
+        self.camera = pygame.Rect(0, 0, SCREEN_WIDTH, SCREEN_HEIGHT)
+
+        # The part of the world that is on the screen
+        self.view = pygame.Rect(0, 0, SCREEN_WIDTH, SCREEN_HEIGHT)
+
+        # Where the camera was before the last update, for drawing frames
+        # between ticks
+        self.previous = self.camera.topleft
+
+    def apply(self, entity):
+        """ Screen position of a sprite. """
+        return entity.rect.move(self.camera.topleft)
+
+    def apply_rect(self, rect):
+        """ Screen position of a rect. """
+        return rect.move(self.camera.topleft)
+
+    def update(self, target):
+        """ Scroll so the target stays between the scroll bands. """
+        self.previous = self.camera.topleft
+        x = self.camera.x
+
+        # If the target gets near the right side, shift the world left (-x)
+        if target.rect.right + x >= SCROLL_RIGHT:
+            x = SCROLL_RIGHT - target.rect.right
+
+        # If the target gets near the left side, shift the world right (+x)
+        if target.rect.left + x <= SCROLL_LEFT:
+            x = SCROLL_LEFT - target.rect.left
+
+        self.scroll_to(x)
+
+    def scroll_to(self, x):
+        """ Shift the world x pixels left/right. """
+        self.camera.x = x
+        self.view.x = -x
+
+    def draw(self, screen, group, rects=None):
+        """ Draw the sprites in a group that are on the screen. """
+        view = self.view
+        offset = self.camera.topleft
+        for sprite in group:
+            if view.colliderect(sprite.rect):
+                rect = screen.blit(sprite.image, sprite.rect.move(offset))
+                if rects is not None:
+                    rects.append(rect)
+
 class Player(pygame.sprite.Sprite):
     """
     This class represents the bar at the bottom that the player controls.
@@ -29,9 +388,7 @@ class Player(pygame.sprite.Sprite):
 
 
         # This could also be an image loaded from the disk.
-        player = pygame.image.load("aaa.png").convert()
-        player.set_colorkey(BLUE)
-        self.image = player
+        self.image = load_image(*PLAYER_IMAGE)
 
 
         # Set a referance to the image rect.
@@ -44,8 +401,14 @@ class Player(pygame.sprite.Sprite):
         # List of sprites we can bump against
         self.level = None
 
+        # Where the player was before the last update, for drawing frames
+        # between ticks
+        self.previous = self.rect.topleft
+
     def update(self):
         """ Move the player. """
+        self.previous = self.rect.topleft
+
         # Gravity
         self.calc_grav()
 
@@ -53,7 +416,7 @@ class Player(pygame.sprite.Sprite):
         self.rect.x += self.change_x
 
         # See if we hit anything
-        block_hit_list = pygame.sprite.spritecollide(self, self.level.platform_list, False)
+        block_hit_list = self.level.platform_list.spritecollide(self)
         for block in block_hit_list:
             # If we are moving right,
             # set our right side to the left side of the item we hit
@@ -67,7 +430,7 @@ class Player(pygame.sprite.Sprite):
         self.rect.y += self.change_y
 
         # Check and see if we hit anything
-        block_hit_list = pygame.sprite.spritecollide(self, self.level.platform_list, False)
+        block_hit_list = self.level.platform_list.spritecollide(self)
         for block in block_hit_list:
 
             # Reset our position based on the top/bottom of the object.
@@ -98,7 +461,7 @@ class Player(pygame.sprite.Sprite):
         # Move down 2 pixels because it doesn't work well if we only move down 1
         # when working with a platform moving down.
         self.rect.y += 2
-        platform_hit_list = pygame.sprite.spritecollide(self, self.level.platform_list, False)
+        platform_hit_list = self.level.platform_list.spritecollide(self)
         self.rect.y -= 2
 
         # If it is ok to jump, set our speed upwards
@@ -118,72 +481,13 @@ class Player(pygame.sprite.Sprite):
         """ Called when the user lets off the keyboard. """
         self.change_x = 0
 
-class Bullet(pygame.sprite.Sprite):
-    """ This class represents the bullet. """
-
-    def __init__(self, start_x, start_y, dest_x, dest_y):
-        """ Constructor.
-        It takes in the starting x and y location.
-        It also takes in the destination x and y position.
-        """
-
-        # Call the parent class (Sprite) constructor
-        super().__init__()
-
-        # Set up the image for the bullet
-        self.image = pygame.Surface([4, 10])
-        self.image.fill(WHITE)
-
-        self.rect = self.image.get_rect()
-
-        # Move the bullet to our starting location
-        self.rect.x = start_x
-        self.rect.y = start_y
-
-        # Because rect.x and rect.y are automatically converted
-        # to integers, we need to create different variables that
-        # store the location as floating point numbers. Integers
-        # are not accurate enough for aiming.
-        self.floating_point_x = start_x
-        self.floating_point_y = start_y
-
-        # Calculation the angle in radians between the start points
-        # and end points. This is the angle the bullet will travel.
-        x_diff = dest_x - start_x
-        y_diff = dest_y - start_y
-        angle = math.atan2(y_diff, x_diff);
-
-        # Taking into account the angle, calculate our change_x
-        # and change_y. Velocity is how fast the bullet travels.
-        velocity = 5
-        self.change_x = math.cos(angle) * velocity
-        self.change_y = math.sin(angle) * velocity
-
-    def update(self):
-        """ Move the bullet. """
-
-        # The floating point x and y hold our more accurate location.
-        self.floating_point_y += self.change_y
-        self.floating_point_x += self.change_x
-
-        # The rect.x and rect.y are converted to integers.
-        self.rect.y = int(self.floating_point_y)
-        self.rect.x = int(self.floating_point_x)
-
-        # If the bullet flies of the screen, get rid of it.
-        if self.rect.x < 0 or self.rect.x > SCREEN_WIDTH or self.rect.y < 0 or self.rect.y > SCREEN_HEIGHT:
-            self.kill()
-
 class Block(pygame.sprite.Sprite):
     """ This class represents the block. """
     def __init__(self, color):
         # Call the parent class (Sprite) constructor
         super().__init__()
 
-        blocks = pygame.image.load("enemy3.png").convert()
-
-        self.image = blocks 
-        self.image.set_colorkey(RED)
+        self.image = load_image(*BLOCK_IMAGE)
 
         self.rect = self.image.get_rect()
 
@@ -197,10 +501,7 @@ class Platform(pygame.sprite.Sprite):
             """
         super().__init__()
 
-        platform = pygame.image.load("platform.png").convert()
-
-        self.image = platform 
-        self.image.set_colorkey(BLACK)
+        self.image = load_image(*PLATFORM_IMAGE)
 
         self.rect = self.image.get_rect()
 
@@ -213,536 +514,1281 @@ class Flag(pygame.sprite.Sprite):
             """
         super().__init__()
 
-        flag = pygame.image.load("flag2.png").convert()
-
-        self.image = flag 
-        self.image.set_colorkey(BLACK)
+        self.image = load_image(*FLAG_IMAGE)
 
         self.rect = self.image.get_rect()
 
 
 class Level():
-    """ This is a generic super-class used to define a level.
-        Create a child class for each level with level-specific
-        info. """
+    """ This is a generic super-class used to define a level. The levels
+        themselves are DataLevels, built from the level files. """
+
+    # Map file and scroll factors for a parallax background, if it has one
+    parallax = None
 
-    def __init__(self, player):
+    def __init__(self, player, seed=None):
         """ Constructor. Pass in a handle to player. Needed for when moving
-            platforms collide with the player. """
-        self.platform_list = pygame.sprite.Group()
+            platforms collide with the player. The level's random numbers
+            come from its own generator, started from seed. """
+        self.random = random.Random(seed)
+        self.platform_list = SpatialGroup()
         self.enemy_list = pygame.sprite.Group()
-        self.blocks_list = pygame.sprite.Group()
+        self.blocks_list = SpatialGroup()
         self.all_sprite_list = pygame.sprite.Group()
         self.bullet_list = pygame.sprite.Group()
-        self.flag_list = pygame.sprite.Group()
+        self.flag_list = SpatialGroup()
         self.player = player
 
+        # Moves the enemies in enemy_list. Without NumPy there isn't one,
+        # and enemies are put in blocks_list and stay still.
+        self.swarm = EnemySwarm(load_image(*BLOCK_IMAGE)) if numpy is not None else None
+
         # How far this world has been scrolled left/right
-        self.world_shift = 0
+        self.camera = Camera()
+
+        # The background is one image, or layers that scroll at different
+        # speeds
+        self.background = None
+        self.parallax_background = None
+        if self.parallax is not None:
+            self.parallax_background = load_parallax(*self.parallax)
 
     # Update everythign on this level
     def update(self):
         """ Update everything in this level."""
         self.platform_list.update()
-        self.enemy_list.update()
+        if self.swarm is not None:
+            self.swarm.update(self.camera, self.player)
         self.blocks_list.update()
         self.all_sprite_list.update()
         self.bullet_list.update()
         self.flag_list.update()
+        self.camera.update(self.player)
 
-    def draw(self, screen):
-        """ Draw everything on this level. """
-
-        # Draw the background
-        screen.fill(BLUE)
-        screen.blit(self.background,(self.world_shift // 3,0))
-
-        # Draw all the sprite lists that we have
-        self.platform_list.draw(screen)
-        self.enemy_list.draw(screen)
-        self.blocks_list.draw(screen)
-        self.all_sprite_list.draw(screen)
-        self.bullet_list.draw(screen)
-        self.flag_list.draw(screen)
-
-    def shift_world(self, shift_x):
-        """ When the user moves left/right and we need to scroll
-        everything: """
-
-        # Keep track of the shift amount
-        self.world_shift += shift_x
-
-        # Go through all the sprite lists and shift
-        for platform in self.platform_list:
-            platform.rect.x += shift_x
-
-        for enemy in self.enemy_list:
-            enemy.rect.x += shift_x
-
-        for blocks in self.blocks_list:
-            blocks.rect.x += shift_x
-            
-        for flag in self.flag_list:
-            flag.rect.x += shift_x
-
-# Create platforms for the level
-class Level_01(Level):
-    """ Definition for level 1. """
+    def draw(self, screen, alpha=1.0):
+        """ Draw everything on this level, the things that move alpha of
+            the way from where they were last tick to where they are. """
+        self.draw_static(screen)
+        self.draw_moving(screen, None, alpha)
 
-    def __init__(self, player):
-        """ Create level 1. """
+    def draw_moving(self, screen, rects=None, alpha=1.0):
+        """ Draw the things on this level that move. """
+        self.camera.draw(screen, self.bullet_list, rects)
+        if self.swarm is not None:
+            self.swarm.draw(screen, self.camera, rects, alpha)
 
-        # Call the parent constructor
-        Level.__init__(self, player)
-
-        self.background = pygame.image.load("background3.jpg").convert()
-        self.background.set_colorkey(RED)        
-        self.level_limit = -1000  
-        
-        flag = Flag()
-        flag.rect.x = (1800)
-        flag.rect.y = (50)
-        
-        # Add the block to the list of objects
-        self.flag_list.add(flag)
-        self.all_sprite_list.add(flag)        
-            
-
-        # Array with width, height, x, and y of platform
-        level = [[210, 70, 500, 500],
-                 [210, 70, 800, 400],
-                 [210, 70, 1000, 500],
-                 [210, 70, 1120, 280],
-                 [210, 70, 1400, 150],
-                 ]
-
-        # Go through the array above and add platforms
-        for platform in level:
-            block = Platform(platform[0], platform[1])
-            block.rect.x = platform[2]
-            block.rect.y = platform[3]
-            block.player = self.player
-            self.platform_list.add(block)
-
-        # Spawns the blocks for level 1
-        for blocks in level:
-            for i in range(10):
-                # This represents a block
-                blocks = Block(BLUE)
-
-                # Set a random location for the block
-                blocks.rect.x = random.randrange(2000)
-                blocks.rect.y = random.randrange(350)
-
-                # Add the block to the list of objects
-                self.blocks_list.add(blocks)
-                self.all_sprite_list.add(blocks)
-                
+    def draw_static(self, screen):
+        """ Draw the background and the sprites that don't move. These
+            only look different when static_key() changes. """
 
-# Create platforms for the level
-class Level_02(Level):
-    """ Definition for level 2. """
+        # Draw the background
+        if self.parallax_background is not None:
+            self.parallax_background.draw(screen, self.camera.camera.x)
+        else:
+            screen.fill(BLUE)
+            if self.background is not None:
+                screen.blit(self.background,(self.camera.camera.x // 3,0))
 
-    def __init__(self, player):
-        """ Create level 1. """
+        # Draw all the sprite lists that we have
+        self.camera.draw(screen, self.platform_list)
+        self.camera.draw(screen, self.blocks_list)
+        self.camera.draw(screen, self.all_sprite_list)
+        self.camera.draw(screen, self.flag_list)
+
+    def static_key(self):
+        """ Something that changes whenever draw_static() would draw
+            something different: the view scrolls, or sprites are added to
+            or removed from the level. """
+        return (self.camera.camera.topleft, self.platform_list.version,
+                self.blocks_list.version, self.flag_list.version,
+                len(self.all_sprite_list))
+
+class LevelFile():
+    """ A level described by a JSON file. The file isn't read until the
+        level is loaded, so having more levels doesn't make the game any
+        slower to start. The file has:
+
+            background  {"image": filename, "colorkey": [r, g, b]}, or
+                        {"parallax": map file, "factors": {layer: factor}}
+            limit       how far left the level goes
+            flags       [x, y] of each flag
+            platforms   [width, height, x, y] of each platform
+            spawns      blocks put down at random, as {"count": how many,
+                        "x": [left, right], "y": [top, bottom]}
+            enemies     enemies put down at random the same way, with
+                        "behaviour" (one of ENEMY_BEHAVIOURS) and
+                        optionally "speed", "range" and "fire", the ticks
+                        between their shots
+
+        LevelStreamer calls load() or preload() to get the level's files
+        ready, then calls this to build the level. """
+
+    def __init__(self, filename):
+        self.filename = filename
+
+        # What's in the file, once it has been read
+        self.definition = None
+
+        # The background image as (filename, colorkey), the parallax
+        # background as (map file, factors), and every image the level uses
+        self.background_image = None
+        self.parallax = None
+        self.images = list(LEVEL_IMAGES)
+
+    def read(self):
+        """ Read the file, only the first time. """
+        if self.definition is None:
+            try:
+                with open(self.filename, "r") as file:
+                    definition = json.load(file)
+            except ValueError as error:
+                raise ValueError("{0}: {1}".format(self.filename, error))
+
+            background = definition.get("background", {})
+            if "image" in background:
+                colorkey = background.get("colorkey")
+                self.background_image = (background["image"],
+                                         tuple(colorkey) if colorkey is not None else None)
+                self.images.insert(0, self.background_image)
+            if "parallax" in background:
+                self.parallax = (background["parallax"], background.get("factors", {}))
+            self.definition = definition
+        return self.definition
+
+    def load(self):
+        """ Read the level file and decode the files the level needs. """
+        self.read()
+        for filename, colorkey in self.images:
+            decode_image(filename, colorkey)
+        if self.parallax is not None:
+            decode_parallax(*self.parallax)
+
+    def preload(self):
+        """ Load all the images the level needs into the image cache. """
+        self.read()
+        preload_images(self.images)
+        if self.parallax is not None:
+            load_parallax(*self.parallax)
+
+    def __call__(self, player, seed=None):
+        """ Build the level. """
+        return DataLevel(player, self, seed)
+
+class DataLevel(Level):
+    """ A level built from a level file. """
+
+    def __init__(self, player, level_file, seed=None):
+        """ Create the level described by a LevelFile. """
+        definition = level_file.read()
+        self.parallax = level_file.parallax
 
         # Call the parent constructor
-        Level.__init__(self, player)
-
-        self.background = pygame.image.load("background3.jpg").convert()
-        self.background.set_colorkey(RED)          
-        self.level_limit = -1000
-        
-        flag = Flag()
-        flag.rect.x = (1800)
-        flag.rect.y = (500)
-    
-        # Add the block to the list of objects
-        self.flag_list.add(flag)
-        self.all_sprite_list.add(flag)              
-
-        # Array with type of platform, and x, y location of the platform.
-        level = [[210, 30, 450, 570],
-                 [210, 30, 850, 420],
-                 [210, 30, 1000, 520],
-                 [210, 30, 1120, 280],
-                 ]
-
-        # Go through the array above and add platforms
-        for platform in level:
-            block = Platform(platform[0], platform[1])
-            block.rect.x = platform[2]
-            block.rect.y = platform[3]
+        Level.__init__(self, player, seed)
+
+        if level_file.background_image is not None:
+            self.background = load_image(*level_file.background_image)
+        self.level_limit = definition.get("limit", -1000)
+
+        for x, y in definition.get("flags", []):
+            flag = Flag()
+            flag.rect.x = x
+            flag.rect.y = y
+
+            # Add the flag to the list of objects
+            self.flag_list.add(flag)
+            self.all_sprite_list.add(flag)
+
+        # Width, height, x, and y of each platform
+        for width, height, x, y in definition.get("platforms", []):
+            block = Platform(width, height)
+            block.rect.x = x
+            block.rect.y = y
             block.player = self.player
             self.platform_list.add(block)
 
-        # Spawns the blocks for level 2
-        for blocks in level:
-            for i in range(25):
+        # Spawn the blocks
+        for spawn in definition.get("spawns", []):
+            left, right = spawn["x"]
+            top, bottom = spawn["y"]
+            for i in range(spawn["count"]):
                 # This represents a block
                 blocks = Block(BLUE)
 
                 # Set a random location for the block
-                blocks.rect.x = random.randrange(2000)
-                blocks.rect.y = random.randrange(350)
+                blocks.rect.x = left + self.random.randrange(right - left)
+                blocks.rect.y = top + self.random.randrange(bottom - top)
 
                 # Add the block to the list of objects
                 self.blocks_list.add(blocks)
                 self.all_sprite_list.add(blocks)
-                
-pygame.init()
-
-# Set the height and width of the screen
-size = [SCREEN_WIDTH, SCREEN_HEIGHT]
-screen = pygame.display.set_mode(size)
-
-pygame.display.set_caption("Instruction Screen")
-
-# Loop until the user clicks the close button.
-done = False
-    
-# This is a font we use to draw text on the screen (size 36)
-font = pygame.font.Font(None, 36)
-
-# This is a font we use to draw text on the screen (size 150)
-font2 = pygame.font.Font(None, 150)
 
-display_instructions = True
-instruction_page = 1
-name = ""    
-
-# Used to manage how fast the screen updates
-clock = pygame.time.Clock()
-
-# -------- Instruction Page Loop -----------
-while not done and display_instructions:
-    for event in pygame.event.get():
+        for spawn in definition.get("enemies", []):
+            self.add_enemies(spawn)
+
+    def add_enemies(self, spawn):
+        """ Put down a group of enemies described like the ones in a level
+            file. """
+        left, right = spawn["x"]
+        top, bottom = spawn["y"]
+        fire_delay = spawn.get("fire", 0)
+        enemies = []
+        directions = []
+        phases = []
+        cooldowns = []
+        for i in range(spawn["count"]):
+            enemy = Block(BLUE)
+            enemy.rect.x = left + self.random.randrange(right - left)
+            enemy.rect.y = top + self.random.randrange(bottom - top)
+            enemies.append(enemy)
+
+            # Don't have them all move in step
+            directions.append(self.random.choice((-1, 1)))
+            phases.append(self.random.uniform(0, 2 * math.pi))
+            if fire_delay:
+                cooldowns.append(self.random.randint(1, fire_delay))
+
+        if self.swarm is None:
+            # They can't move, so they're just blocks
+            self.blocks_list.add(enemies)
+            self.all_sprite_list.add(enemies)
+            return
+        self.enemy_list.add(enemies)
+        self.swarm.add(enemies, spawn["behaviour"], spawn.get("speed", ENEMY_SPEED),
+                       spawn.get("range", ENEMY_RANGE), directions, phases,
+                       fire_delay, cooldowns if fire_delay else None)
+
+class LevelManifest():
+    """ The levels in the order they are played, from the manifest. Only
+        the list of level files is read here; a LevelFile is made for a
+        level the first time it's asked for, and reads its file when the
+        level is loaded. """
+
+    def __init__(self, filename=LEVEL_MANIFEST):
+        with open(filename, "r") as file:
+            manifest = json.load(file)
+        folder = os.path.dirname(filename)
+        self.filenames = [os.path.join(folder, name) for name in manifest["levels"]]
+
+        # LevelFiles made so far, by level number
+        self.level_files = {}
+
+    def __len__(self):
+        return len(self.filenames)
+
+    def __getitem__(self, level_no):
+        level_file = self.level_files.get(level_no)
+        if level_file is None:
+            level_file = self.level_files[level_no] = LevelFile(self.filenames[level_no])
+        return level_file
+
+# The level manifest, read the first time it's needed
+level_manifest = None
+
+def game_levels():
+    """ The levels in the order they are played. """
+    global level_manifest
+    if level_manifest is None:
+        level_manifest = LevelManifest()
+    return level_manifest
+
+class LevelStreamer():
+    """ Builds levels while the game is running, so moving to the next
+        level doesn't stall a frame.
+
+        request() starts reading and decoding a level's files on a loader
+        thread while the current level plays: it runs the level's load()
+        there. Converting the images for the display and making the
+        sprites has to happen on the main thread, in get(), which runs
+        preload() and then builds the level; once the files are decoded
+        that only takes a moment. So load(), and everything it calls like
+        decode_image(), decode_parallax() and CompiledMap.decode_images(),
+        mustn't touch the display.
+
+        At most resident levels are kept built, and the one used longest
+        ago is dropped when another is built. """
+
+    def __init__(self, level_classes, player, seed=None, resident=RESIDENT_LEVELS):
+        """ Constructor. level_classes are the levels in order: anything
+            with load() and preload() that builds a level when called, like
+            the LevelFiles in a LevelManifest or the level classes in
+            test.py.
+            Each level is seeded with seed plus its number, so it comes out
+            the same whatever order the levels are built in. """
+        self.level_classes = level_classes
+        self.player = player
+        self.seed = seed
+        self.resident = resident
+
+        # One loader thread, so levels load in the order they're asked for
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="level-loader")
+
+        # Levels being loaded, by number
+        self.loading = {}
+
+        # Built levels by number, least recently used first
+        self.levels = OrderedDict()
+
+        # How many levels have been built, and how many of those get()
+        # had to wait for
+        self.builds = 0
+        self.stalls = 0
+
+    def __len__(self):
+        return len(self.level_classes)
+
+    def request(self, level_no):
+        """ Start loading a level in the background, if there is one and it
+            isn't loaded or loading already. """
+        if (0 <= level_no < len(self.level_classes) and level_no not in self.levels
+                and level_no not in self.loading):
+            self.loading[level_no] = self.executor.submit(self.level_classes[level_no].load)
+
+    def get(self, level_no):
+        """ A built level. If its files haven't finished loading this
+            waits for them, so request() it well before it's needed. """
+        level = self.levels.get(level_no)
+        if level is not None:
+            self.levels.move_to_end(level_no)
+            return level
+
+        level_class = self.level_classes[level_no]
+        future = self.loading.pop(level_no, None)
+        if future is None:
+            # Nobody asked for it, so there's nothing to wait for
+            level_class.load()
+        else:
+            if not future.done():
+                self.stalls += 1
+            # Errors from the loader thread come out here
+            future.result()
+
+        level_class.preload()
+        if self.seed is None:
+            level = level_class(self.player)
+        else:
+            level = level_class(self.player, self.seed + level_no)
+        self.builds += 1
+
+        self.levels[level_no] = level
+        while len(self.levels) > self.resident:
+            self.levels.popitem(last=False)
+        return level
+
+    def close(self):
+        """ Stop the loader thread once it's finished what it's doing. """
+        self.executor.shutdown(wait=True)
+
+# The high scores, opened the first time they're needed
+high_score_store = None
+
+def high_scores():
+    """ The high score store, read from disk only the first time. """
+    global high_score_store
+    if high_score_store is None:
+        high_score_store = HighScoreStore()
+    return high_score_store
+
+def read_highscore():
+    """ Return the best score saved, or 0 if there isn't one. """
+    return high_scores().best_score()
+
+class InstructionScreen():
+    """ The instruction pages shown before the game starts. The player
+        types their name on page 1 and hits enter to go through the pages.
+
+        Everything that doesn't change is loaded and rendered once, the
+        screen is only redrawn after something changes, and while waiting
+        for input it sleeps instead of redrawing 60 times a second. """
+
+    def __init__(self, screen, font):
+        """ Constructor. Pass in the screen to draw on and the font. """
+        self.screen = screen
+        self.font = font
+
+        self.background = load_image("menu.jpg")
+        self.highscore = read_highscore()
+
+        self.page = 1
+        self.name = ""
+
+        # Set when the player closes the window or gets past the last page
+        self.quit = False
+        self.finished = False
+
+        # Text that never changes, as (text, position) for each page
+        pages = {
+            1: [("Instructions", [10, 10]),
+                ("Enter your name: ", [10, 40]),
+                ("Hit enter to continue", [10, 80]),
+                ("Current Highscore: {0}".format(self.highscore), [10, 100]),
+                ("Page 1", [10, 120])],
+            2: [("Shoot enemy's in the sky to get a hightscore", [10, 10]),
+                ("Use A,D and space for movement and Mouse1 to shoot", [10, 40]),
+                ("Hit enter to continue", [10, 80]),
+                ("Page 2", [10, 120])],
+            }
+        self.pages = {}
+        for page, lines in pages.items():
+            self.pages[page] = [(font.render(text, True, WHITE), position)
+                                for text, position in lines]
+
+        self.name_text = font.render(self.name, True, WHITE)
+
+        # Does the screen need drawing again?
+        self.dirty = True
+
+    def handle_event(self, event):
+        """ Update the menu for one event. """
         if event.type == pygame.QUIT:
-            done = True
+            self.quit = True
+        if event.type in (pygame.VIDEOEXPOSE, pygame.WINDOWEXPOSED, pygame.WINDOWRESTORED):
+            # The window was uncovered or restored, and what was on it may
+            # be gone
+            self.dirty = True
         if event.type == pygame.KEYDOWN:
             if event.unicode.isalpha():
-                name += event.unicode
+                self.name += event.unicode
+                self.name_text = self.font.render(self.name, True, WHITE)
+                self.dirty = True
             elif event.key == pygame.K_BACKSPACE:
-                name = name[:-1]
+                self.name = self.name[:-1]
+                self.name_text = self.font.render(self.name, True, WHITE)
+                self.dirty = True
             elif event.key == pygame.K_RETURN:
-                instruction_page += 1  
-                if instruction_page == 3:
-                    display_instructions = False                
- 
-    # Set the screen background
-    #screen.fill(BLACK)
-    background = pygame.image.load("menu.jpg").convert()
-    screen.blit(background, [0, 0])
-    
-    if instruction_page == 1:
-        # Draw instructions, page 1
-        # This could also load an image created in another program.
-        # That could be both easier and more flexible.
- 
-        text = font.render("Instructions", True, WHITE)
-        screen.blit(text, [10, 10])
-       
-        text = font.render("Enter your name: ", True, WHITE)
-        screen.blit(text, [10, 40])    
-       
-        text = font.render(name, True, WHITE)
-        screen.blit(text, [220, 40])
-        
-        try:
-            file = open('highscores.txt', 'r')
-            lines = file.readlines()
-            prevhighscore = int(lines[0])
-            prevname = lines[1]
-            file.close()
-        except IOError:
-            file = open('highscores.txt', 'w')
-            prevhighscore = str(0) + "\n"
-            file.write(prevhighscore)
-            writename = name + "\n"
-            file.write(writename)
-            file.close()        
-        
-        text = font.render("Current Highscore: {0}".format(prevhighscore), True, WHITE)
-        screen.blit(text, [10, 100])
- 
-        text = font.render("Hit enter to continue", True, WHITE)
-        screen.blit(text, [10, 80])
-       
-        text = font.render("Page 1", True, WHITE)
-        screen.blit(text, [10, 120])
- 
-    if instruction_page == 2:
-        # Draw instructions, page 2
-        text = font.render("Shoot enemy's in the sky to get a hightscore", True, WHITE)
-        screen.blit(text, [10, 10])    
- 
-        text = font.render("Use A,D and space for movement and Mouse1 to shoot", True, WHITE)
-        screen.blit(text, [10, 40])
- 
-        text = font.render("Hit enter to continue", True, WHITE)
-        screen.blit(text, [10, 80])
- 
-        text = font.render("Page 2", True, WHITE)
-        screen.blit(text, [10, 120])
-        
- 
-    # Limit to 60 frames per second
-    clock.tick(60)
- 
-    # Go ahead and update the screen with what we've drawn.
-    pygame.display.flip()
-   
-    score = 0
-
-
-def main():
-    """ Main Program """
+                self.page += 1
+                self.dirty = True
+                if self.page == 3:
+                    self.finished = True
+
+    def draw(self):
+        """ Draw the current page. """
+        self.screen.blit(self.background, [0, 0])
+        for text, position in self.pages[self.page]:
+            self.screen.blit(text, position)
+        if self.page == 1:
+            self.screen.blit(self.name_text, [220, 40])
+
+    def run(self):
+        """ Show the pages until the player gets through them. Returns the
+            name they typed, or None if they closed the window. """
+        while not self.quit and not self.finished:
+            if self.dirty:
+                self.draw()
+                pygame.display.flip()
+                self.dirty = False
+
+            # Sleep until something happens, then handle everything queued
+            self.handle_event(pygame.event.wait())
+            for event in pygame.event.get():
+                self.handle_event(event)
+
+        if self.quit:
+            return None
+        return self.name
+
+class FrameTimer():
+    """ Times each part of a frame. Call start() with the name of each
+        part as it begins and end_frame() when the frame is done. Keeps
+        the last history frames, or all of them if history is None. """
+
+    def __init__(self, history=600):
+        self.history = history
+
+        # Seconds spent in each part, one entry per frame
+        self.phases = {}
+
+        # Seconds for each whole frame
+        self.frames = deque(maxlen=history)
+
+        self.frame_start = None
+        self.phase = None
+        self.phase_start = None
+        self.current = {}
+
+    def start(self, phase):
+        """ Start timing the next part of the frame. """
+        now = time.perf_counter()
+        if self.phase is None:
+            self.frame_start = now
+        else:
+            self.current[self.phase] = self.current.get(self.phase, 0) + now - self.phase_start
+        self.phase = phase
+        self.phase_start = now
+
+    def end_frame(self):
+        """ Finish timing the frame. """
+        now = time.perf_counter()
+        if self.phase is None:
+            return
+        self.current[self.phase] = self.current.get(self.phase, 0) + now - self.phase_start
+        for phase, seconds in self.current.items():
+            if phase not in self.phases:
+                self.phases[phase] = deque(maxlen=self.history)
+            self.phases[phase].append(seconds)
+        self.frames.append(now - self.frame_start)
+        self.current = {}
+        self.phase = None
+
+    def last(self, phase):
+        """ Seconds spent in a part of the last frame. """
+        times = self.phases.get(phase)
+        if not times:
+            return 0
+        return times[-1]
+
+class TextCache():
+    """ Remembers rendered text, so a string that is drawn every frame is
+        only rasterized when it changes. The least recently used strings
+        are thrown away once there are more than size of them. """
+
+    def __init__(self, size=TEXT_CACHE_SIZE):
+        self.size = size
+        self.surfaces = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def render(self, font, text, color):
+        """ Same as font.render(text, True, color), but cached. """
+        key = (font, text, color)
+        surface = self.surfaces.get(key)
+        if surface is not None:
+            self.hits += 1
+            self.surfaces.move_to_end(key)
+            return surface
+
+        self.misses += 1
+        surface = font.render(text, True, color)
+        self.surfaces[key] = surface
+        if len(self.surfaces) > self.size:
+            self.surfaces.popitem(last=False)
+        return surface
+
+class GlyphAtlas():
+    """ Each character of a small set, like the digits, rendered once. Text
+        made only of those characters is drawn by blitting one glyph per
+        character, so counters never need rendering. """
+
+    def __init__(self, font, color, characters="0123456789:-"):
+        self.glyphs = {}
+        for character in characters:
+            self.glyphs[character] = font.render(character, True, color)
+
+    def draw(self, screen, text, position):
+        """ Draw text at a position. Returns the x just after the text. """
+        x, y = position
+        for character in text:
+            glyph = self.glyphs[character]
+            screen.blit(glyph, (x, y))
+            x += glyph.get_width()
+        return x
+
+class DebugOverlay():
+    """ Shows how the game is running: FPS, a histogram of recent frame
+        times, how many sprites are in each group, how many collision
+        tests were done and how long each part of the frame took.
+
+        It can also profile a number of frames with cProfile and save the
+        result to a .prof file, which can be read with pstats or snakeviz. """
+
+    # Frame times shown in the histogram, and the time at the top of it
+    HISTOGRAM_FRAMES = 120
+    HISTOGRAM_MS = 33.3
+
+    # Width of the black panel behind the text
+    PANEL_WIDTH = 300
+
+    def __init__(self, game):
+        """ Constructor. Pass in the game to show. """
+        self.game = game
+        self.visible = False
+        self.font = pygame.font.Font(None, 20)
+
+        # The labels go through the game's text cache and the numbers are
+        # drawn a glyph at a time, so showing the overlay doesn't slow
+        # down the frames it is timing
+        self.digits = GlyphAtlas(self.font, WHITE, "0123456789.")
+
+        # Collision tests done before this frame
+        self.last_checks = 0
+        self.checks = 0
+
+        # The running profile and how many frames it has left
+        self.profiler = None
+        self.profile_frames = 0
+        self.profile_file = None
+
+        # The file the last profile was saved to
+        self.saved_profile = None
+
+    def toggle(self):
+        """ Show or hide the overlay. """
+        self.visible = not self.visible
+
+    def start_profile(self, frames=PROFILE_FRAMES, filename=None):
+        """ Profile the next frames and save them to a file. """
+        if self.profiler is not None:
+            return
+        if filename is None:
+            filename = time.strftime("profile-%Y%m%d-%H%M%S.prof")
+        self.profile_file = filename
+        self.profile_frames = frames
+        self.profiler = cProfile.Profile()
+        self.profiler.enable()
+
+    def end_frame(self):
+        """ Called after every frame. """
+        game = self.game
+        checks = game.collision_checks()
+        # The count starts again on a new level
+        self.checks = max(checks - self.last_checks, 0)
+        self.last_checks = checks
+
+        if self.profiler is not None:
+            self.profile_frames -= 1
+            if self.profile_frames <= 0:
+                self.profiler.disable()
+                self.profiler.dump_stats(self.profile_file)
+                self.saved_profile = self.profile_file
+                self.profiler = None
+
+    def draw(self, screen, rects=None):
+        """ Draw the overlay in the bottom left of the screen. """
+        if not self.visible:
+            return
+        game = self.game
+        level = game.current_level
+        timer = game.timer
+
+        # Each line is a label and a number
+        lines = [("FPS: ", "{0:.1f}".format(game.clock.get_fps()))]
+        if timer.frames:
+            lines.append(("Frame ms: ", "{0:.2f}".format(timer.frames[-1] * 1000)))
+        for phase, times in timer.phases.items():
+            lines.append(("  {0} ms: ".format(phase), "{0:.2f}".format(times[-1] * 1000)))
+        lines.append(("platform_list: ", len(level.platform_list)))
+        lines.append(("blocks_list: ", len(level.blocks_list)))
+        if level.swarm is not None:
+            lines.append(("enemy_list: ", len(level.enemy_list)))
+            lines.append(("Enemies moving: ", int(level.swarm.active.sum())))
+        lines.append(("bullet_list: ", len(game.bullets)))
+        lines.append(("all_sprite_list: ", len(level.all_sprite_list)))
+        lines.append(("Collision checks: ", self.checks))
+        lines.append(("Levels built: ", game.levels.builds))
+        lines.append(("Levels waited for: ", game.levels.stalls))
+        if isinstance(game.bullets, BulletPool):
+            lines.append(("Bullet pool hits: ", game.bullets.hits))
+            lines.append(("Bullet pool misses: ", game.bullets.misses))
+        if game.audio.enabled:
+            lines.append(("Sounds played: ", game.audio.played))
+            lines.append(("Sounds merged: ", game.audio.merged))
+        if game.renderer is not None:
+            lines.append(("Dirty rects: ", len(game.renderer.dirty)))
+            lines.append(("Full redraws: ", game.renderer.full_redraws))
+        if self.profiler is not None:
+            lines.append(("Profiling, frames left: ", self.profile_frames))
+        elif self.saved_profile is not None:
+            lines.append(("Saved profile to {0}".format(self.saved_profile), ""))
+
+        line_height = self.font.get_linesize()
+        top = SCREEN_HEIGHT - 70 - line_height * len(lines)
+        rect = screen.fill(BLACK, [10, top, self.PANEL_WIDTH, line_height * len(lines)])
+        if rects is not None:
+            rects.append(rect)
+        for i, (label, number) in enumerate(lines):
+            y = top + i * line_height
+            text = game.text_cache.render(self.font, label, WHITE)
+            screen.blit(text, [10, y])
+            self.digits.draw(screen, str(number), [10 + text.get_width(), y])
+
+        # Histogram of the last frame times, one bar per frame
+        bottom = SCREEN_HEIGHT - 10
+        height = 50
+        frames = list(timer.frames)[-self.HISTOGRAM_FRAMES:]
+        rect = screen.fill(BLACK, [10, bottom - height, self.HISTOGRAM_FRAMES * 2, height])
+        if rects is not None:
+            rects.append(rect)
+        for i, seconds in enumerate(frames):
+            bar = min(height, int(seconds * 1000 / self.HISTOGRAM_MS * height))
+            color = GREEN if seconds * 1000 <= 1000 / 60 else RED
+            screen.fill(color, [10 + i * 2, bottom - bar, 2, bar])
+
+        # Line at 60 FPS
+        y = bottom - int(1000 / 60 / self.HISTOGRAM_MS * height)
+        pygame.draw.line(screen, WHITE, [10, y], [10 + self.HISTOGRAM_FRAMES * 2, y])
+
+class DirtyRenderer():
+    """ Draws frames by only redrawing what changed since the last one, the
+        way pygame's LayeredDirty does, and updates just those parts of the
+        display.
+
+        The background and the level's sprites (the static part) are drawn
+        to a surface of their own. Each frame the rects the player, the
+        bullets, the enemies and the HUD covered last frame are put back
+        from it, the moving things are drawn again on top and only those
+        rects are sent to the display. While the view is scrolling nearly
+        everything changes anyway, so those frames are drawn whole and
+        flipped, and the static surface is only drawn again once the view
+        stops.
+
+        The draw methods of the moving things take a rects argument for
+        this. Pass a list as rects to collect the screen rects drawn. """
+
+    def __init__(self, game):
+        """ Constructor. """
+        self.game = game
+        self.static = pygame.Surface(game.screen.get_size()).convert()
+
+        # Level.static_key() for what is on the static surface, and for
+        # the last frame
+        self.static_key = None
+        self.last_key = None
+
+        # Screen rects the moving things were drawn to last frame
+        self.dirty = []
+
+        # Frames drawn whole
+        self.full_redraws = 0
+
+    def draw(self, screen):
+        """ Draw a frame. Returns the rects of the screen that changed, or
+            None if all of it did. """
+        game = self.game
+        level = game.current_level
+        key = (level, level.static_key())
+
+        if key != self.last_key:
+            # The view scrolled or the level changed, so draw all of it
+            self.last_key = key
+            self.static_key = None
+            self.dirty = []
+            self.full_redraws += 1
+            level.draw(screen, game.alpha)
+            game.draw_sprites(screen)
+            game.draw_hud(screen)
+            return None
+
+        full = key != self.static_key
+        if full:
+            # The view has stopped, so keep the static part of this frame
+            level.draw_static(self.static)
+            self.static_key = key
+            screen.blit(self.static, (0, 0))
+            self.full_redraws += 1
+        else:
+            # Put back what the moving things were drawn over
+            for rect in self.dirty:
+                screen.blit(self.static, rect, rect)
+
+        rects = []
+        level.draw_moving(screen, rects, game.alpha)
+        game.draw_sprites(screen, rects)
+        game.draw_hud(screen, rects)
+
+        if full:
+            update = None
+        else:
+            update = self.dirty + rects
+        self.dirty = rects
+        return update
+
+def init_display(headless=False):
+    """ Start pygame and open the window. Headless uses SDL's dummy video
+        and audio drivers, so it runs without a display or sound card. """
+    if headless:
+        os.environ["SDL_VIDEODRIVER"] = "dummy"
+        os.environ["SDL_AUDIODRIVER"] = "dummy"
     pygame.init()
-    
-    global score
 
     # Set the height and width of the screen
     size = [SCREEN_WIDTH, SCREEN_HEIGHT]
-    screen = pygame.display.set_mode(size)
+    return pygame.display.set_mode(size)
+
+class Game():
+    """ Everything the main loop needs: the player, the levels, the score
+        and the timer. step() runs one frame, run() keeps stepping.
+
+        The game is simulated in fixed ticks of SIM_DT seconds, however
+        long frames take: each frame runs as many ticks as the time since
+        the last frame holds, and draws things in between where they were
+        on the last two ticks. Slow frames don't slow the game down.
+
+        A headless game reads its input from an input source instead of
+        pygame's event queue, has no sound, doesn't save high scores and
+        doesn't wait between frames, so it can be stepped as fast as the
+        computer allows. Every headless frame is exactly one tick. """
+
+    def __init__(self, screen, name="", headless=False, input_source=None, frame_rate=60,
+                 dirty=DIRTY_RENDERING, seed=None, speed=1.0):
+        """ Constructor. Pass in the screen and the player's name. A
+            frame_rate of 0 runs without a frame cap. dirty turns on
+            DirtyRenderer. The levels are built from seed, or a random one.
+            speed runs the game that many times faster than real time. """
+        self.screen = screen
+        self.name = name
+        self.headless = headless
+        self.input_source = input_source
+        self.frame_rate = frame_rate
+        self.speed = speed
+
+        # Everything random in the game comes from this
+        if seed is None:
+            seed = random.randrange(2 ** 32)
+        self.seed = seed
+
+        # Set to an InputRecorder to record the game
+        self.recorder = None
+
+        # This is a font we use to draw text on the screen (size 36)
+        self.font = pygame.font.Font(None, 36)
+
+        # This is a font we use to draw text on the screen (size 150)
+        self.font2 = pygame.font.Font(None, 150)
+
+        # Text that doesn't change often is only rendered once, and the
+        # score and timer are put together from pre-rendered digits
+        self.text_cache = TextCache()
+        self.digits = GlyphAtlas(self.font, WHITE)
+
+        self.score = 0
+
+        # Create the player
+        self.player = Player()
+
+        # The player's bullets
+        if USE_NUMPY_BULLETS and numpy is not None:
+            self.bullets = BulletArray()
+        else:
+            self.bullets = BulletPool()
+
+        # Levels are built when they're needed, and the next one is loaded
+        # in the background while the current one is played
+        self.levels = LevelStreamer(game_levels(), self.player, seed)
+
+        # Set the current level
+        self.current_level_no = 0
+        self.current_level = self.levels.get(self.current_level_no)
+        self.levels.request(self.current_level_no + 1)
+
+        self.active_sprite_list = pygame.sprite.Group()
+        self.player.level = self.current_level
+
+        self.player.rect.x = 340
+        self.player.rect.y = SCREEN_HEIGHT - self.player.rect.height
+        self.active_sprite_list.add(self.player)
+
+        # Loop until the user clicks the close button.
+        self.done = False
+
+        self.game_over = False
+
+        # Used to manage how fast the screen updates
+        self.clock = pygame.time.Clock()
+
+        # What the player has pressed, kept until the next tick
+        self.input = InputState()
+
+        # Load sounds recorded by me. They're played once a frame, after
+        # the ticks that asked for them.
+        self.audio = AudioService(headless)
+
+        # Seconds played, for the timer and the high score. It counts
+        # ticks rather than real time, so a stall or a faster replay comes
+        # out the same, and it stops when the game is over.
+        self.play_time = 0.0
+
+        # Frames run so far, including after the game is over
+        self.ticks = 0
+
+        # Simulation ticks run so far, and the time that has passed that
+        # hasn't been simulated yet
+        self.sim_ticks = 0
+        self.accumulator = 0.0
+        self.last_time = None
+
+        # How far between the last two ticks the frame being drawn is
+        self.alpha = 1.0
+
+        # How long each part of the frame takes
+        self.timer = FrameTimer()
+
+        # Debug information, shown with F3
+        self.overlay = DebugOverlay(self)
+
+        # Draws only what changed, if it's turned on
+        self.renderer = DirtyRenderer(self) if dirty else None
+
+    def get_events(self):
+        """ The events from pygame for this frame. The input source's
+            events are handled by tick(). """
+        if self.headless:
+            # Nothing real can happen, but keep the queue empty
+            pygame.event.pump()
+            return []
+        events = pygame.event.get()
+        if isinstance(self.input_source, Replay):
+            # Playing along with a replay would change what happens, so
+            # only closing the window and the debug keys get through
+            events = [event for event in events if event.type == pygame.QUIT or
+                      (event.type == pygame.KEYDOWN and
+                       self.input.action(event) in ("overlay", "profile"))]
+        return events
+
+    def handle_event(self, event):
+        """ Deal with one event. Most only go into the input state, which
+            the next tick acts on. """
+        if self.recorder is not None:
+            self.recorder.record(self.sim_ticks, event)
+
+        action = self.input.handle(event)
+        if action == "overlay":
+            self.overlay.toggle()
+        elif action == "profile":
+            self.overlay.start_profile()
 
-    pygame.display.set_caption("My Game")
+        if event.type == pygame.QUIT:
+            self.done = True
+            if not self.headless and not isinstance(self.input_source, Replay):
+                self.save_highscore()
+
+    def apply_input(self):
+        """ Act on what the player did since the last tick. """
+        player = self.player
+        state = self.input
+
+        if not self.game_over:
+            # Fire a bullet for each click of the mouse
+            camera = self.current_level.camera
+            for x, y in state.clicks:
+                self.audio.play("shoot")
+
+                # The mouse is in screen coordinates, the world isn't.
+                mouse_x = x - camera.camera.x
+                mouse_y = y - camera.camera.y
+
+                # Fire a bullet from where we are to where we want to go.
+                self.bullets.fire(player.rect.x + 100, player.rect.y + 10,
+                                  mouse_x, mouse_y, camera.view)
+
+        # Movement, in the order the keys went down and up
+        for action, pressed in state.changes:
+            if pressed:
+                if self.game_over:
+                    continue
+                if action == "left":
+                    player.go_left()
+                elif action == "right":
+                    player.go_right()
+                elif action == "jump":
+                    player.jump()
+                    self.audio.play("jump")
+            elif action == "left" and player.change_x < 0:
+                player.stop()
+            elif action == "right" and player.change_x > 0:
+                player.stop()
+
+        state.clear()
+
+    def change_level(self, level_no):
+        """ Move the player to another level. """
+        # The next level starts unscrolled, so keep the player where
+        # they are on the screen.
+        self.player.rect.x += self.current_level.camera.camera.x
+        self.player.previous = self.player.rect.topleft
+        self.current_level_no = level_no
+        self.current_level = self.levels.get(level_no)
+        self.player.level = self.current_level
+
+        # Shots fired on the old level don't carry over to this one
+        self.bullets.clear()
+
+        # Start on the level after this one
+        self.levels.request(level_no + 1)
+
+    def collision_checks(self):
+        """ How many collision tests have been done: the ones against the
+            current level's groups and every bullet test, including the
+            ones against enemies and the player. """
+        level = self.current_level
+        return (level.platform_list.checks + level.blocks_list.checks +
+                level.flag_list.checks + self.bullets.checks)
+
+    def tick(self):
+        """ Run one tick of the simulation. """
+        if self.input_source is not None:
+            self.timer.start("events")
+            for event in self.input_source.events(self.sim_ticks):
+                self.handle_event(event)
+            if self.done:
+                return
+
+        self.timer.start("update")
+        self.apply_input()
+        self.update()
+
+        self.timer.start("collision")
+        self.collide()
+
+        if not self.game_over:
+            self.play_time += SIM_DT
+        self.sim_ticks += 1
 
-    # Create the player
-    player = Player()
-
-    # List to hold all the sprites
-    all_sprite_list = pygame.sprite.Group()
-
-    # List of each bullet
-    bullet_list = pygame.sprite.Group() 
-    blocks_list = pygame.sprite.Group()
-    flag_list = pygame.sprite.Group()
-
-    # Create all the levels
-    level_list = []
-    level_list.append(Level_01(player))
-    level_list.append(Level_02(player))
-
-    # Set the current level
-    current_level_no = 0
-    current_level = level_list[current_level_no]
-
-    active_sprite_list = pygame.sprite.Group()
-    player.level = current_level
-
-    player.rect.x = 340
-    player.rect.y = SCREEN_HEIGHT - player.rect.height
-    active_sprite_list.add(player)
-
-
-    # Loop until the user clicks the close button.
-    done = False
-    
-    game_over = False
-    
-    # Used to manage how fast the screen updates
-    clock = pygame.time.Clock()
-    
-    # Load sounds recorded by me
-    shoot_sound = pygame.mixer.Sound("shoot2.ogg")
-    death_sound = pygame.mixer.Sound("death.ogg")
-    jump_sound = pygame.mixer.Sound("jump.ogg")
-    
-    # Sets defaults for timer
-    frame_count = 0
-    frame_rate = 60
-    start_time = 90    
-
-    # -------- Main Program Loop -----------
-    while not done:
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT:
-                done = True
-                
-                # Calculation for the displayed highscore
-                scoregg = round(score + frame_count / 60)
-                
-                # Opens the highscore file and reads the lines.
-                try:
-                    file = open('highscores.txt', 'r')
-                    lines = file.readlines()
-                    prevhighscore_new = int(lines[0])
-                    prevname = lines[1]
-                    file.close()                    
-                
-                # If there is no highscore file, make one.
-                except IOError:
-                    file = open('highscores.txt', 'w')
-                    writescore = str(scoregg) + "\n"
-                    file.write(writescore)
-                    writename = name + "\n"
-                    file.write(writename)
-                    file.close()
-        
-                # Check if the new score is better than the highscore.
-                if scoregg > prevhighscore_new:
-                    file = open('highscores.txt', 'w')
-                    writescore = str(scoregg) + "\n"
-                    file.write(writescore)
-                    writename = name + "\n"
-                    file.write(writename)
-                    file.close()                
-
-            elif not game_over: 
-                if event.type == pygame.MOUSEBUTTONDOWN:
-                    shoot_sound.play()
-                # Fire a bullet if the user clicks the mouse button
-            
-                # Get the mouse position
-                    pos = pygame.mouse.get_pos()
-                    
-                    mouse_x = pos[0]
-                    mouse_y = pos[1]
-
-                    # Create the bullet based on where we are, and where we want to go.
-                    bullet = Bullet(player.rect.x + 100, player.rect.y + 10, mouse_x, mouse_y)
-    
-                    # Add the bullet to the lists
-                    all_sprite_list.add(bullet)
-                    bullet_list.add(bullet)
-            
-            # If the player hits the last flag, end game.
-            if pygame.sprite.spritecollide(player, level_list[1].flag_list, True):
-                game_over = True
-            
-            # Settings the keys for movement.
-            if not game_over: 
-                if event.type == pygame.KEYDOWN:
-                    if event.key == pygame.K_a:
-                        player.go_left()
-                    if event.key == pygame.K_d:
-                        player.go_right()
-                    if event.key == pygame.K_SPACE:
-                        player.jump()
-                        jump_sound.play()
-
-            if event.type == pygame.KEYUP:
-                if event.key == pygame.K_a and player.change_x < 0:
-                    player.stop()
-                if event.key == pygame.K_d and player.change_x > 0:
-                    player.stop()
-
-        
+    def update(self):
+        """ Move everything. """
         # Update the player.
-        active_sprite_list.update()
+        self.active_sprite_list.update()
 
         # Update items in the level
-        current_level.update()
+        level = self.current_level
+        level.update()
+
+        # Enemies shoot at the player until the game is over
+        if level.swarm is not None and not self.game_over:
+            level.swarm.fire(self.bullets, self.player, level.camera.view)
+
+        self.bullets.update()
+
+    def collide(self):
+        """ Work out what hit what. """
+        # The flag on every level but the last goes to the next level, and
+        # the one on the last level ends the game
+        if self.current_level.flag_list.spritecollide(self.player, True):
+            if self.current_level_no < len(self.levels) - 1:
+                self.change_level(self.current_level_no + 1)
+            else:
+                self.game_over = True
+
+        # See which blocks the bullets hit. The bullets that hit
+        # something are removed.
+        block_hit_list = self.bullets.collide(self.current_level.blocks_list)
+
+        # For each block hit, add to the score
+        if self.current_level.swarm is not None:
+            block_hit_list += self.current_level.swarm.collide(self.bullets)
+        for blocks in block_hit_list:
+            self.score += 1
+            self.audio.play("death")
+
+        # Enemy shots cost the player points
+        if not self.game_over and self.bullets.hit(self.player, ENEMY_SHOT):
+            self.score = max(self.score - PLAYER_HIT_PENALTY, 0)
+            self.audio.play("death")
+
+    def draw(self, alpha=1.0):
+        """ Draw the frame alpha of the way from the tick before last to
+            the last one, so things move smoothly when frames and ticks
+            don't line up. Returns the rects of the screen that need
+            updating, or None if all of it does. """
+        # Put the player and the view where they'd be in between ticks
+        # while drawing, then back where they really are
+        player = self.player
+        camera = self.current_level.camera
+        position = player.rect.topleft
+        camera_x = camera.camera.x
+        self.alpha = alpha
+        if alpha < 1:
+            player.rect.x = interpolate(player.previous[0], position[0], alpha)
+            player.rect.y = interpolate(player.previous[1], position[1], alpha)
+            camera.scroll_to(interpolate(camera.previous[0], camera_x, alpha))
+
+        # ALL CODE TO DRAW SHOULD GO BELOW THIS COMMENT
+        if self.renderer is not None:
+            rects = self.renderer.draw(self.screen)
+        else:
+            self.current_level.draw(self.screen, alpha)
+            self.draw_sprites(self.screen)
+            self.draw_hud(self.screen)
+            rects = None
+
+        player.rect.topleft = position
+        camera.scroll_to(camera_x)
+        return rects
+
+    def draw_sprites(self, screen, rects=None):
+        """ Draw the player and the bullets. """
+        camera = self.current_level.camera
+        camera.draw(screen, self.active_sprite_list, rects)
+        self.bullets.draw(screen, camera, rects, self.alpha)
+
+    def draw_hud(self, screen, rects=None):
+        """ Draw the score, the timer, Game Over and the overlay. """
+        if rects is None:
+            rects = []
 
-        all_sprite_list.update()
-        
         # --- Timer going up ---
-        # Calculate total seconds
-        total_seconds = frame_count // frame_rate
-     
+        # Calculate total seconds. Rounding first stops adding up
+        # fractions of a second from coming out just under a second.
+        total_seconds = int(round(self.play_time, 6))
+
         # Divide by 60 to get total minutes
         minutes = total_seconds // 60
-     
+
         # Use modulus (remainder) to get seconds
         seconds = total_seconds % 60
-     
+
         # Use python string formatting to format in leading zeros
-        output_string = "Time: {0:02}:{1:02}".format(minutes, seconds)        
-        
-        
-        # If the player gets near the right side, shift the world left (-x)
-        if player.rect.right >= 500:
-            diff = player.rect.right - 500
-            player.rect.right = 500
-            current_level.shift_world(-diff)
-
-        # If the player gets near the left side, shift the world right (+x)
-        if player.rect.left <= 120:
-            diff = 120 - player.rect.left
-            player.rect.left = 120
-            current_level.shift_world(diff)
-        
-        if pygame.sprite.spritecollide(player, level_list[0].flag_list, True):
-            current_level_no += 1
-            current_level = level_list[current_level_no]
-            player.level = current_level 
-            
-        if current_level_no == 0:
-            # Calculate mechanics for each bullet
-            for bullet in bullet_list:
-
-                # See if it hit a block
-                block_hit_list = pygame.sprite.spritecollide(bullet, level_list[0].blocks_list, True)
-
-                # For each block hit, remove the bullet and add to the score
-                for blocks in block_hit_list:
-                    bullet_list.remove(bullet)
-                    all_sprite_list.remove(bullet)
-                    score += 1
-                    death_sound.play()
-            
-                    # Remove the bullet if it flies up off the screen
-                    if bullet.rect.y < -10:
-                        bullet_list.remove(bullet)
-                        all_sprite_list.remove(bullet)
-            
-        if current_level_no == 1:
-            # Calculate mechanics for each bullet
-            for bullet in bullet_list:
-
-                # See if it hit a block
-                block_hit_list = pygame.sprite.spritecollide(bullet, level_list[1].blocks_list, True)
-
-                # For each block hit, remove the bullet and add to the score
-                for blocks in block_hit_list:
-                    bullet_list.remove(bullet)
-                    all_sprite_list.remove(bullet)
-                    score += 1
-                    death_sound.play()
-            
-                    # Remove the bullet if it flies up off the screen
-                    if bullet.rect.y < -10:
-                        bullet_list.remove(bullet)
-                        all_sprite_list.remove(bullet)
+        output_string = "{0:02}:{1:02}".format(minutes, seconds)
 
-        # ALL CODE TO DRAW SHOULD GO BELOW THIS COMMENT
-        current_level.draw(screen)
-        active_sprite_list.draw(screen)
-        all_sprite_list.draw(screen)
-        
-        if game_over:
+        if self.game_over:
             # If game over is true, draw game over
-            text = font2.render("Game Over", True, WHITE)
+            text = self.text_cache.render(self.font2, "Game Over", WHITE)
             text_rect = text.get_rect(center=(SCREEN_WIDTH/2, SCREEN_HEIGHT/2))
-            screen.blit(text, text_rect)
-       
+            rects.append(screen.blit(text, text_rect))
 
         # ALL CODE TO DRAW SHOULD GO ABOVE THIS COMMENT
-        
-        # Blit to the screen    
-        scoretext = "Score: " + str(score)
-        text = font.render(scoretext, True, WHITE)
+
+        # Blit to the screen
+        text = self.text_cache.render(self.font, "Score: ", WHITE)
         screen.blit(text, [10, 10])
-        
+        right = self.digits.draw(screen, str(self.score), [10 + text.get_width(), 10])
+        rects.append(pygame.Rect(10, 10, right - 10, text.get_height()))
+
         # Blit to the screen
-        text = font.render(output_string, True, WHITE)
+        text = self.text_cache.render(self.font, "Time: ", WHITE)
         screen.blit(text, [650, 10])
-        
-        if not game_over:
-            frame_count += 1
-            
-        if game_over:
-            frame_count + 0
-    
-        # Limit to 60 frames per second
-        clock.tick(60)
+        right = self.digits.draw(screen, output_string, [650 + text.get_width(), 10])
+        rects.append(pygame.Rect(650, 10, right - 650, text.get_height()))
+
+        self.overlay.draw(screen, rects)
+
+    def step(self):
+        """ Run one frame. """
+        timer = self.timer
+
+        timer.start("events")
+        for event in self.get_events():
+            self.handle_event(event)
+
+        # How long since the last frame. A headless game always says one
+        # tick, so it plays out the same however fast it runs.
+        if self.headless:
+            elapsed = SIM_DT
+        else:
+            now = time.perf_counter()
+            if self.last_time is None:
+                elapsed = SIM_DT
+            else:
+                elapsed = now - self.last_time
+            self.last_time = now
+
+        # Run as many ticks as that much time holds
+        timer.start("update")
+        self.accumulator += min(elapsed, MAX_FRAME_TIME) * self.speed
+        while self.accumulator >= SIM_DT and not self.done:
+            self.tick()
+            self.accumulator -= SIM_DT
+
+        timer.start("draw")
+        if self.headless:
+            rects = self.draw()
+        else:
+            rects = self.draw(self.accumulator / SIM_DT)
+
+        timer.start("audio")
+        self.audio.update()
+
+        # Limit the frames per second
+        timer.start("wait")
+        self.clock.tick(self.frame_rate)
 
         # Go ahead and update the screen with what we've drawn.
-        pygame.display.flip()
+        timer.start("flip")
+        if rects is None:
+            pygame.display.flip()
+        else:
+            pygame.display.update(rects)
+
+        timer.end_frame()
+        self.overlay.end_frame()
+        self.ticks += 1
+
+    def run(self, ticks=None):
+        """ Step until the window is closed, or for a number of frames. """
+        while not self.done and (ticks is None or self.ticks < ticks):
+            self.step()
+
+    def save_highscore(self):
+        """ Save the score to the high scores. It's written to disk in the
+            background. """
+        # Calculation for the displayed highscore
+        scoregg = round(self.score + self.play_time)
+        high_scores().add(scoregg, self.name, self.current_level_no + 1)
+
+def main(headless=False, ticks=None, input_source=None, profile=None, dirty=DIRTY_RENDERING,
+         record=None, replay=None, speed=1.0):
+    """ Main Program. A headless game skips the instruction pages and runs
+        without a frame cap. Pass profile to profile that many frames from
+        the start. record saves the game to that file, and replay plays
+        one saved with record instead of reading the keyboard and mouse. """
+    screen = init_display(headless)
+
+    seed = None
+    if replay is not None:
+        input_source = Replay(replay)
+        seed = input_source.seed
+
+    if headless or replay is not None:
+        name = ""
+    else:
+        # -------- Instruction Pages -----------
+        pygame.display.set_caption("Instruction Screen")
+        name = InstructionScreen(screen, pygame.font.Font(None, 36)).run()
+        if name is None:
+            pygame.quit()
+            return None
+
+    pygame.display.set_caption("My Game")
+
+    game = Game(screen, name, headless=headless, input_source=input_source,
+                frame_rate=0 if headless else 60, dirty=dirty, seed=seed, speed=speed)
+    if record is not None:
+        game.recorder = InputRecorder()
+    if profile:
+        game.overlay.start_profile(profile)
+
+    start = time.perf_counter()
+    game.run(ticks)
+    elapsed = time.perf_counter() - start
+
+    if record is not None:
+        game.recorder.save(record, game)
+    if game.overlay.saved_profile is not None:
+        print("Saved profile to", game.overlay.saved_profile)
+
+    if headless:
+        print("Ran {0} ticks in {1:.2f}s ({2:.0f} ticks/s), score {3}".format(
+            game.ticks, elapsed, game.ticks / max(elapsed, 1e-9), game.score))
+    if replay is not None:
+        if input_source.matches(game):
+            print("Replay matched the recording")
+        else:
+            print("Replay didn't match the recording: tick {0}, score {1}, player at {2}, "
+                  "recorded tick {3}, score {4}, player at {5}".format(
+                      game.sim_ticks, game.score, game.player.rect.topleft,
+                      input_source.length, input_source.score, input_source.position))
+
+    game.levels.close()
 
     # Be IDLE friendly. If you forget this line, the program will 'hang'
     # on exit.
     pygame.quit()
+    return game
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Play the game.")
+    parser.add_argument("--headless", action="store_true",
+                        help="run with no window or sound and no frame cap")
+    parser.add_argument("--ticks", type=int, default=None,
+                        help="stop after this many frames")
+    parser.add_argument("--profile", type=int, default=None, metavar="FRAMES",
+                        help="profile the first FRAMES frames with cProfile")
+    parser.add_argument("--dirty", action="store_true", default=DIRTY_RENDERING,
+                        help="only redraw the parts of the screen that change")
+    parser.add_argument("--record", metavar="FILE",
+                        help="record the game to FILE so it can be replayed")
+    parser.add_argument("--replay", metavar="FILE",
+                        help="play back a game recorded with --record")
+    parser.add_argument("--speed", type=float, default=1.0,
+                        help="run this many times faster than real time")
+    args = parser.parse_args()
+    main(headless=args.headless, ticks=args.ticks, profile=args.profile, dirty=args.dirty,
+         record=args.record, replay=args.replay, speed=args.speed)
@@ -3,6 +3,8 @@ import random
 import math
 import pytmx
 from os import path
+from Game import InstructionScreen
+from test import ChunkedMapRenderer
 
 # Global constants
 
@@ -350,7 +352,7 @@ class Level():
                 Obstacle(tile_object.x, tile_object.y,
                          tile_object.width, tile_object.height)
                 
-        self.screen.blit(self.map_img,(self.world_shift // 3,0))
+        self.map_renderer.draw(self.screen, (self.world_shift // 3, 0))
         #self.screen.blit(self.map_img, self.world_shift // 3,0(self.map_rect))
         #self.screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
 
@@ -388,8 +390,8 @@ class Level():
         game_folder = path.dirname(__file__)
         map_folder = path.join(game_folder, 'maps')
         self.map = TiledMap(path.join(map_folder, 'test.tmx'))
-        self.map_img = self.map.make_map()
-        self.map_rect = self.map_img.get_rect()    
+        self.map_renderer = ChunkedMapRenderer(self.map)
+        self.map_rect = pygame.Rect(0, 0, self.map.width, self.map.height)    
 
 # Create platforms for the level
 class Level_01(Level):
@@ -404,8 +406,8 @@ class Level_01(Level):
         game_folder = path.dirname(__file__)
         map_folder = path.join(game_folder, 'maps')
         self.map = TiledMap(path.join(map_folder, 'test.tmx'))
-        self.map_img = self.map.make_map()
-        self.map_rect = self.map_img.get_rect()          
+        self.map_renderer = ChunkedMapRenderer(self.map)
+        self.map_rect = pygame.Rect(0, 0, self.map.width, self.map.height)          
  
         self.load_data
         
@@ -438,121 +440,29 @@ class Level_01(Level):
                 #self.all_sprite_list.add(blocks)
                 
                 
-pygame.init()
-
-# Set the height and width of the screen
-size = [SCREEN_WIDTH, SCREEN_HEIGHT]
-screen = pygame.display.set_mode(size)
-
-pygame.display.set_caption("Instruction Screen")
-
-# Loop until the user clicks the close button.
-done = False
-    
-# This is a font we use to draw text on the screen (size 36)
-font = pygame.font.Font(None, 36)
-
-# This is a font we use to draw text on the screen (size 150)
-font2 = pygame.font.Font(None, 150)
-
-display_instructions = True
-instruction_page = 1
-name = ""    
-
-# Used to manage how fast the screen updates
-clock = pygame.time.Clock()
-
-# -------- Instruction Page Loop -----------
-while not done and display_instructions:
-    for event in pygame.event.get():
-        if event.type == pygame.QUIT:
-            done = True
-        if event.type == pygame.KEYDOWN:
-            if event.unicode.isalpha():
-                name += event.unicode
-            elif event.key == pygame.K_BACKSPACE:
-                name = name[:-1]
-            elif event.key == pygame.K_RETURN:
-                instruction_page += 1  
-                if instruction_page == 3:
-                    display_instructions = False                
- 
-    # Set the screen background
-    #screen.fill(BLACK)
-    background = pygame.image.load("menu.jpg").convert()
-    screen.blit(background, [0, 0])
-    
-    if instruction_page == 1:
-        # Draw instructions, page 1
-        # This could also load an image created in another program.
-        # That could be both easier and more flexible.
- 
-        text = font.render("Instructions", True, WHITE)
-        screen.blit(text, [10, 10])
-       
-        text = font.render("Enter your name: ", True, WHITE)
-        screen.blit(text, [10, 40])    
-       
-        text = font.render(name, True, WHITE)
-        screen.blit(text, [220, 40])
-        
-        try:
-            file = open('highscores.txt', 'r')
-            lines = file.readlines()
-            prevhighscore = int(lines[0])
-            prevname = lines[1]
-            file.close()
-        except IOError:
-            file = open('highscores.txt', 'w')
-            prevhighscore = str(0) + "\n"
-            file.write(prevhighscore)
-            writename = name + "\n"
-            file.write(writename)
-            file.close()        
-        
-        text = font.render("Current Highscore: {0}".format(prevhighscore), True, WHITE)
-        screen.blit(text, [10, 100])
- 
-        text = font.render("Hit enter to continue", True, WHITE)
-        screen.blit(text, [10, 80])
-       
-        text = font.render("Page 1", True, WHITE)
-        screen.blit(text, [10, 120])
- 
-    if instruction_page == 2:
-        # Draw instructions, page 2
-        text = font.render("Shoot enemy's in the sky to get a hightscore", True, WHITE)
-        screen.blit(text, [10, 10])    
- 
-        text = font.render("Use A,D and space for movement and Mouse1 to shoot", True, WHITE)
-        screen.blit(text, [10, 40])
- 
-        text = font.render("Hit enter to continue", True, WHITE)
-        screen.blit(text, [10, 80])
- 
-        text = font.render("Page 2", True, WHITE)
-        screen.blit(text, [10, 120])
-        
- 
-    # Limit to 60 frames per second
-    clock.tick(60)
- 
-    # Go ahead and update the screen with what we've drawn.
-    pygame.display.flip()
-   
-    score = 0
-
-
 def main():
     """ Main Program """
     pygame.init()
-    
-    global score
 
     # Set the height and width of the screen
     size = [SCREEN_WIDTH, SCREEN_HEIGHT]
     screen = pygame.display.set_mode(size)
 
+    # This is a font we use to draw text on the screen (size 36)
+    font = pygame.font.Font(None, 36)
+
+    # This is a font we use to draw text on the screen (size 150)
+    font2 = pygame.font.Font(None, 150)
+
+    # -------- Instruction Pages -----------
+    pygame.display.set_caption("Instruction Screen")
+    name = InstructionScreen(screen, font).run()
+    if name is None:
+        pygame.quit()
+        return
+
+    score = 0
+
     pygame.display.set_caption("My Game")
 
     # Create the player
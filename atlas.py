@@ -0,0 +1,130 @@
+""" Packs the sprite images into atlases.
+
+Every sprite image is normally its own surface with its own colorkey. This
+packs them into one or a few big images instead, and writes where each
+sprite ended up to atlas.json. load_image() in Game.py looks there first
+and hands out a piece of the atlas, so every sprite is converted in one go
+and blits come from the same few surfaces.
+
+The sprites have different colorkeys, so the atlas gets one of its own:
+a color none of the sprites use, painted wherever a sprite was see-through.
+The pages stay opaque with a colorkey, which blits faster than per-pixel
+alpha. The game builds the atlas when it starts if there isn't one, or if
+a sprite has changed since it was built. It can also be built by hand
+with:
+
+    python atlas.py
+"""
+import json
+import os
+
+import pygame
+
+# How wide and tall the atlas images can get before another one is
+# started. Each one is only as big as the sprites on it need.
+ATLAS_WIDTH = 1024
+ATLAS_MAX_HEIGHT = 2048
+
+# Space left around each sprite
+ATLAS_PADDING = 1
+
+# Colors the atlas can use as its colorkey, the first one no sprite uses
+ATLAS_COLORKEYS = [(255, 0, 255), (0, 255, 255), (255, 255, 0), (1, 2, 3)]
+
+def opaque(filename):
+    """ The pixels load_image() keeps from an image, with any alpha thrown
+        away the way convert() does. This doesn't need a display. """
+    image = pygame.image.load(filename)
+    return pygame.image.frombytes(pygame.image.tobytes(image, "RGB"), image.get_size(), "RGB")
+
+def pick_colorkey(images):
+    """ A colorkey for the atlas that none of the (surface, colorkey)
+        images has in a pixel that should be drawn. """
+    for atlas_key in ATLAS_COLORKEYS:
+        for image, colorkey in images:
+            if colorkey != atlas_key and pygame.mask.from_threshold(
+                    image, atlas_key, (1, 1, 1, 255)).count():
+                break
+        else:
+            return atlas_key
+    raise ValueError("every atlas colorkey is used by a sprite")
+
+def pack(sizes, width=ATLAS_WIDTH, max_height=ATLAS_MAX_HEIGHT, padding=ATLAS_PADDING):
+    """ Shelf packing. Takes a list of (width, height) and returns a list of
+        (page, x, y) in the same order, and the (width, height) each page
+        needs. """
+    order = sorted(range(len(sizes)), key=lambda i: (-sizes[i][1], -sizes[i][0]))
+    places = [None] * len(sizes)
+    widths = [0]
+    heights = [0]
+    x = y = shelf = 0
+    for i in order:
+        w, h = sizes[i]
+        if w + padding * 2 > width:
+            raise ValueError("a {0}x{1} image doesn't fit in an atlas {2} wide".format(w, h, width))
+        if x + w + padding * 2 > width:
+            # Start a new shelf under this one
+            y += shelf
+            x = shelf = 0
+        if y + h + padding * 2 > max_height:
+            # Start a new page
+            widths.append(0)
+            heights.append(0)
+            x = y = shelf = 0
+        places[i] = (len(heights) - 1, x + padding, y + padding)
+        x += w + padding * 2
+        shelf = max(shelf, h + padding * 2)
+        widths[-1] = max(widths[-1], x)
+        heights[-1] = max(heights[-1], y + shelf)
+    return places, list(zip(widths, heights))
+
+def tightest_pack(sizes, padding=ATLAS_PADDING):
+    """ pack() at whichever width up to ATLAS_WIDTH leaves the pages the
+        least area. Returns the same as pack(). """
+    best = None
+    for width in range(max(w for w, h in sizes) + padding * 2, ATLAS_WIDTH + 1):
+        places, page_sizes = pack(sizes, width, padding=padding)
+        area = sum(w * h for w, h in page_sizes)
+        if best is None or area < best[0]:
+            best = (area, places, page_sizes)
+    return best[1], best[2]
+
+def build(images, filename):
+    """ Pack a list of (filename, colorkey) images into atlas pages and
+        write the index. Returns the page filenames. """
+    surfaces = [opaque(image_file) for image_file, colorkey in images]
+    atlas_key = pick_colorkey(list(zip(surfaces, [colorkey for image_file, colorkey in images])))
+    places, page_sizes = tightest_pack([image.get_size() for image in surfaces])
+
+    folder = os.path.dirname(filename)
+    stem = os.path.splitext(os.path.basename(filename))[0]
+    pages = []
+    for page_size in page_sizes:
+        page = pygame.Surface(page_size, 0, 24)
+        page.fill(atlas_key)
+        pages.append(page)
+    names = ["{0}{1}.png".format(stem, i) for i in range(len(pages))]
+
+    sprites = []
+    for (image_file, colorkey), image, (page, x, y) in zip(images, surfaces, places):
+        # The sprite's see-through pixels aren't copied, so they are left
+        # the atlas colorkey
+        if colorkey is not None:
+            image.set_colorkey(colorkey)
+        pages[page].blit(image, (x, y))
+        sprites.append({"file": image_file,
+                        "colorkey": list(colorkey) if colorkey is not None else None,
+                        "alpha": False,
+                        "page": names[page],
+                        "rect": [x, y, image.get_width(), image.get_height()]})
+
+    for page, name in zip(pages, names):
+        pygame.image.save(page, os.path.join(folder, name))
+    with open(filename, "w") as file:
+        json.dump({"colorkey": list(atlas_key), "sprites": sprites}, file, indent=2)
+    return names
+
+if __name__ == "__main__":
+    import Game
+    names = build(Game.ATLAS_IMAGES, Game.ATLAS_FILE)
+    print("Packed {0} images into {1}".format(len(Game.ATLAS_IMAGES), ", ".join(names)))
@@ -0,0 +1,119 @@
+""" Sound effects.
+
+Every sound is loaded once, when the AudioService is made. play() doesn't
+play anything itself; it puts the sound on a queue, and update() plays
+what was queued once a frame. Asking for the same sound more than once in
+a frame, like when a bullet takes out a row of blocks, only plays it up to
+that sound's limit.
+
+Each category of sound has its own mixer channels, so a burst of one kind
+can't cut off another: shooting never stops the jump sound. When all of a
+category's channels are busy, the one that started longest ago is reused.
+
+With no mixer (headless, or no sound card) play() and update() do
+nothing.
+"""
+import pygame
+
+# Sounds by name, as (filename, category, how many can start in one frame)
+SOUNDS = {
+    "shoot": ("shoot2.ogg", "weapons", 1),
+    "death": ("death.ogg", "hits", 1),
+    "jump": ("jump.ogg", "player", 1),
+    }
+
+# How many mixer channels each category of sound gets
+CHANNEL_POOLS = {
+    "player": 1,
+    "weapons": 3,
+    "hits": 4,
+    }
+
+class ChannelPool():
+    """ Some mixer channels kept for one category of sound. """
+
+    def __init__(self, channels):
+        self.channels = channels
+
+        # Which update() each channel last started a sound in
+        self.started = [0] * len(channels)
+
+    def play(self, sound, frame):
+        """ Play a sound on a free channel, or the one that has been
+            playing longest if none are free. """
+        index = None
+        for i, channel in enumerate(self.channels):
+            if not channel.get_busy():
+                index = i
+                break
+        if index is None:
+            index = self.started.index(min(self.started))
+        self.channels[index].play(sound)
+        self.started[index] = frame
+
+class AudioService():
+    """ Loads the sounds and plays them, at most once a frame. """
+
+    def __init__(self, headless=False, sounds=SOUNDS, pools=CHANNEL_POOLS):
+        self.enabled = not headless and pygame.mixer.get_init() is not None
+
+        # Sound names asked for since the last update(), in order, and how
+        # many times each
+        self.queue = []
+        self.requests = {}
+
+        # Sounds played, and plays dropped because the same sound was
+        # already playing that frame
+        self.played = 0
+        self.merged = 0
+        self.frames = 0
+
+        self.sounds = {}
+        self.limits = {}
+        self.categories = {}
+        self.pools = {}
+        if not self.enabled:
+            return
+
+        for name, (filename, category, limit) in sounds.items():
+            self.sounds[name] = pygame.mixer.Sound(filename)
+            self.categories[name] = category
+            self.limits[name] = limit
+
+        # Reserve the pools' channels, so Sound.play() anywhere else can't
+        # take them
+        total = sum(pools.values())
+        if pygame.mixer.get_num_channels() < total:
+            pygame.mixer.set_num_channels(total)
+        pygame.mixer.set_reserved(total)
+        first = 0
+        for category, count in pools.items():
+            self.pools[category] = ChannelPool(
+                [pygame.mixer.Channel(i) for i in range(first, first + count)])
+            first += count
+
+    def play(self, name):
+        """ Ask for a sound to be played on the next update(). """
+        if not self.enabled:
+            return
+        count = self.requests.get(name, 0)
+        if count == 0:
+            self.queue.append(name)
+        self.requests[name] = count + 1
+
+    def update(self):
+        """ Play the sounds asked for since the last call. Call this once
+            a frame. """
+        if not self.queue:
+            return
+        self.frames += 1
+        for name in self.queue:
+            count = self.requests[name]
+            plays = min(count, self.limits[name])
+            pool = self.pools[self.categories[name]]
+            for i in range(plays):
+                pool.play(self.sounds[name], self.frames)
+            self.played += plays
+            self.merged += count - plays
+        self.queue = []
+        self.requests = {}
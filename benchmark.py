@@ -0,0 +1,315 @@
+""" Frame time benchmarks.
+
+Boots each level headless with a fixed random seed, plays the same
+scripted input every run (walking, jumping, firing) and reports how long
+each part of the frame took as p50/p95/p99 times in milliseconds.
+
+    python benchmark.py
+    python benchmark.py --ticks 1200 --json results.json
+    python benchmark.py --compare results.json
+    python benchmark.py --dirty
+    python benchmark.py --replay laggy.rec
+
+--json saves the results so later runs can be compared with --compare.
+--dirty draws Game.py's levels with DirtyRenderer. --replay times a game
+recorded with Game.py --record, as well as the levels.
+"""
+import argparse
+import json
+import platform
+import random
+import sys
+import time
+
+import pygame
+
+import Game
+from enemies import ENEMY_BEHAVIOURS
+from replay import Replay, ScriptedInput
+
+# Frames at the start of each run that aren't counted, while caches fill
+WARMUP_TICKS = 30
+
+# How many enemies of each kind the Swarm level adds, and how many ticks
+# each waits between shots
+SWARM_ENEMIES = 200
+SWARM_FIRE_DELAY = 30
+
+# The parts of a frame, in the order they happen
+PHASES = ["events", "update", "collision", "draw", "audio", "wait", "flip"]
+
+def key_event(event_type, key):
+    """ A keyboard event like the ones pygame sends. """
+    return pygame.event.Event(event_type, key=key, unicode="", mod=0)
+
+def walk(ticks):
+    """ Walk right, turning around every two seconds. """
+    script = []
+    key = pygame.K_d
+    for tick in range(0, ticks, 120):
+        script.append((tick, key_event(pygame.KEYDOWN, key)))
+        script.append((tick + 119, key_event(pygame.KEYUP, key)))
+        key = pygame.K_a if key == pygame.K_d else pygame.K_d
+    return script
+
+def jump(ticks):
+    """ Walk and jump every 45 frames. """
+    script = walk(ticks)
+    for tick in range(10, ticks, 45):
+        script.append((tick, key_event(pygame.KEYDOWN, pygame.K_SPACE)))
+        script.append((tick + 1, key_event(pygame.KEYUP, pygame.K_SPACE)))
+    return script
+
+def fire(ticks):
+    """ Stand still and fire every other frame, sweeping across the sky. """
+    script = []
+    for tick in range(0, ticks, 2):
+        pos = (100 + (tick * 37) % 700, 50 + (tick * 13) % 300)
+        script.append((tick, pygame.event.Event(pygame.MOUSEBUTTONDOWN, pos=pos, button=1)))
+    return script
+
+def mixed(ticks):
+    """ Walk, jump and fire at the same time. """
+    return jump(ticks) + fire(ticks)
+
+SCENARIOS = {
+    "idle": lambda ticks: [],
+    "walk": walk,
+    "jump": jump,
+    "fire": fire,
+    "mixed": mixed,
+    }
+
+def run_game_level(level_no, script, ticks, seed, dirty=False):
+    """ Play one of Game.py's levels. Returns the frame timer. """
+    screen = pygame.display.get_surface()
+    game = Game.Game(screen, headless=True, input_source=ScriptedInput(script),
+                     frame_rate=0, dirty=dirty, seed=seed)
+    game.timer = Game.FrameTimer(history=None)
+    if level_no != 0:
+        game.change_level(level_no)
+    game.run(ticks)
+    game.levels.close()
+    return game.timer
+
+def run_swarm(script, ticks, seed, dirty=False):
+    """ Play level 1 with SWARM_ENEMIES more enemies of each kind, all of
+        them shooting. Returns the frame timer. """
+    screen = pygame.display.get_surface()
+    game = Game.Game(screen, headless=True, input_source=ScriptedInput(script),
+                     frame_rate=0, dirty=dirty, seed=seed)
+    game.timer = Game.FrameTimer(history=None)
+    for behaviour in ENEMY_BEHAVIOURS:
+        game.current_level.add_enemies({"count": SWARM_ENEMIES, "behaviour": behaviour,
+                                        "x": [0, 2000], "y": [0, 400],
+                                        "fire": SWARM_FIRE_DELAY})
+    game.run(ticks)
+    game.levels.close()
+    return game.timer
+
+def run_tmx_level(level_class, script, ticks, seed):
+    """ Play one of test.py's TMX levels. It has no Game class, so this
+        does what its main loop does. Returns the frame timer. """
+    import test
+
+    random.seed(seed)
+    screen = pygame.display.get_surface()
+    player = test.Player(50, 50)
+    level = level_class(player)
+    player.level = level
+    player.rect.x = 340
+    player.rect.y = Game.SCREEN_HEIGHT - player.rect.height
+    bullet_list = pygame.sprite.Group()
+    input_source = ScriptedInput(script)
+
+    timer = Game.FrameTimer(history=None)
+    for tick in range(ticks):
+        timer.start("events")
+        pygame.event.pump()
+        for event in input_source.events(tick):
+            if event.type == pygame.MOUSEBUTTONDOWN:
+                bullet_list.add(test.Bullet(player.rect.x + 100, player.rect.y + 10,
+                                            event.pos[0], event.pos[1]))
+            elif event.type == pygame.KEYDOWN:
+                if event.key == pygame.K_a:
+                    player.go_left()
+                if event.key == pygame.K_d:
+                    player.go_right()
+                if event.key == pygame.K_SPACE:
+                    player.jump()
+            elif event.type == pygame.KEYUP:
+                player.stop()
+
+        timer.start("update")
+        player.update()
+        level.update()
+        bullet_list.update()
+
+        timer.start("collision")
+        for bullet in bullet_list:
+            if pygame.sprite.spritecollide(bullet, level.blocks_list, True):
+                bullet.kill()
+
+        timer.start("draw")
+        level.draw(screen)
+        screen.blit(player.image, level.camera.apply(player))
+        bullet_list.draw(screen)
+
+        timer.start("flip")
+        pygame.display.flip()
+        timer.end_frame()
+    return timer
+
+def tmx_level(name):
+    """ A runner for a level class in test.py. """
+    def run(script, ticks, seed, dirty=False):
+        import test
+        return run_tmx_level(getattr(test, name), script, ticks, seed)
+    return run
+
+LEVELS = {
+    "Level_01": lambda script, ticks, seed, dirty: run_game_level(0, script, ticks, seed, dirty),
+    "Level_02": lambda script, ticks, seed, dirty: run_game_level(1, script, ticks, seed, dirty),
+    "Swarm": run_swarm,
+    "test.Level_01": tmx_level("Level_01"),
+    }
+
+def percentile(values, percent):
+    """ The value below which percent of the sorted values fall. """
+    if not values:
+        return 0.0
+    index = (len(values) - 1) * percent / 100
+    low = int(index)
+    high = min(low + 1, len(values) - 1)
+    return values[low] + (values[high] - values[low]) * (index - low)
+
+def summarize(times):
+    """ p50/p95/p99, mean and max of a list of seconds, in milliseconds. """
+    values = sorted(seconds * 1000 for seconds in times)
+    if not values:
+        return {"p50": 0.0, "p95": 0.0, "p99": 0.0, "mean": 0.0, "max": 0.0}
+    return {"p50": round(percentile(values, 50), 4),
+            "p95": round(percentile(values, 95), 4),
+            "p99": round(percentile(values, 99), 4),
+            "mean": round(sum(values) / len(values), 4),
+            "max": round(values[-1], 4)}
+
+def run_replay(filename, dirty=False):
+    """ Play a recorded game headless. Returns the frame timer, and
+        whether it played out the same as when it was recorded. """
+    replay = Replay(filename)
+    screen = pygame.display.get_surface()
+    game = Game.Game(screen, headless=True, input_source=replay, frame_rate=0,
+                     dirty=dirty, seed=replay.seed)
+    game.timer = Game.FrameTimer(history=None)
+    game.run()
+    game.levels.close()
+    return game.timer, replay.matches(game)
+
+def run_benchmark(level, scenario, ticks, seed, dirty=False):
+    """ Run one level with one scenario. Returns its results. """
+    script = SCENARIOS[scenario](ticks)
+    start = time.perf_counter()
+    timer = LEVELS[level](script, ticks, seed, dirty)
+    elapsed = time.perf_counter() - start
+    return summarize_run(level, scenario, timer, elapsed)
+
+def summarize_run(level, scenario, timer, elapsed):
+    """ The results of one run, from its frame timer. """
+    frames = list(timer.frames)[WARMUP_TICKS:]
+    result = {"level": level, "scenario": scenario, "ticks": len(timer.frames),
+              "seconds": round(elapsed, 3),
+              "frame": summarize(frames), "phases": {}}
+    for phase in PHASES:
+        if phase in timer.phases:
+            result["phases"][phase] = summarize(list(timer.phases[phase])[WARMUP_TICKS:])
+    return result
+
+def print_results(results, baseline=None):
+    """ Print a table of results, with the change from a baseline run. """
+    old = {}
+    if baseline is not None:
+        for result in baseline["results"]:
+            old[(result["level"], result["scenario"])] = result
+
+    print("{0:<16}{1:<8}{2:>10}{3:>10}{4:>10}  {5}".format(
+        "level", "scenario", "p50 ms", "p95 ms", "p99 ms", "p50 by phase"))
+    for result in results:
+        if "error" in result:
+            print("{0:<16}{1:<8}  failed: {2}".format(result["level"], result["scenario"],
+                                                      result["error"]))
+            continue
+        frame = result["frame"]
+        phases = " ".join("{0}={1:.2f}".format(phase, times["p50"])
+                          for phase, times in result["phases"].items())
+        line = "{0:<16}{1:<8}{2:>10.3f}{3:>10.3f}{4:>10.3f}  {5}".format(
+            result["level"], result["scenario"],
+            frame["p50"], frame["p95"], frame["p99"], phases)
+        before = old.get((result["level"], result["scenario"]))
+        if before is not None and "frame" in before and before["frame"]["p50"]:
+            change = (frame["p50"] - before["frame"]["p50"]) / before["frame"]["p50"] * 100
+            line += "  ({0:+.1f}% p50)".format(change)
+        print(line)
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure frame times.")
+    parser.add_argument("--ticks", type=int, default=600,
+                        help="frames to run for each level and scenario")
+    parser.add_argument("--seed", type=int, default=1234,
+                        help="random seed used to build the levels")
+    parser.add_argument("--level", action="append", choices=sorted(LEVELS),
+                        help="only run this level (can be given more than once)")
+    parser.add_argument("--scenario", action="append", choices=sorted(SCENARIOS),
+                        help="only run this scenario (can be given more than once)")
+    parser.add_argument("--json", help="save the results to this file")
+    parser.add_argument("--compare", help="show the change from results saved with --json")
+    parser.add_argument("--dirty", action="store_true",
+                        help="draw Game.py's levels with DirtyRenderer")
+    parser.add_argument("--replay", action="append", default=[], metavar="FILE",
+                        help="also time a game recorded with Game.py --record")
+    args = parser.parse_args()
+
+    Game.init_display(headless=True)
+
+    results = []
+    for level in args.level or list(LEVELS):
+        for scenario in args.scenario or list(SCENARIOS):
+            try:
+                results.append(run_benchmark(level, scenario, args.ticks, args.seed,
+                                             args.dirty))
+            except Exception as error:
+                results.append({"level": level, "scenario": scenario,
+                                "error": "{0}: {1}".format(type(error).__name__, error)})
+    for filename in args.replay:
+        try:
+            start = time.perf_counter()
+            timer, matched = run_replay(filename, args.dirty)
+            result = summarize_run(filename, "replay", timer, time.perf_counter() - start)
+            if not matched:
+                result["error"] = "the replay didn't play out the way it was recorded"
+            results.append(result)
+        except Exception as error:
+            results.append({"level": filename, "scenario": "replay",
+                            "error": "{0}: {1}".format(type(error).__name__, error)})
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+    print_results(results, baseline)
+
+    if args.json:
+        report = {"created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                  "python": platform.python_version(),
+                  "pygame": pygame.version.ver,
+                  "platform": platform.platform(),
+                  "ticks": args.ticks, "seed": args.seed, "dirty": args.dirty,
+                  "results": results}
+        with open(args.json, "w") as file:
+            json.dump(report, file, indent=2)
+
+    pygame.quit()
+    return 1 if any("error" in result for result in results) else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,485 @@
+""" Bullets.
+
+There are two bullet systems, with the same methods. BulletPool keeps a
+fixed number of Bullet sprites and reuses them, so firing doesn't make a
+new sprite every time. BulletArray keeps the bullets in NumPy arrays and
+moves and tests all of them at once, so thousands of bullets cost about
+the same as a few; it needs NumPy.
+
+The player's and the enemies' shots go in the same system. Each shot
+remembers which side fired it, and a target is only tested against the
+sides that can hit it.
+"""
+import math
+
+import pygame
+
+# NumPy is only needed for the BulletArray bullet system
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Screen dimensions. Bullets are removed when they leave the screen,
+# unless they're fired with bounds of their own.
+SCREEN_WIDTH = 800
+SCREEN_HEIGHT = 600
+
+# How many bullets the bullet pool keeps ready, and what it does when all
+# of them are in the air: "recycle" reuses the oldest one, "grow" makes a
+# new bullet anyway and "drop" doesn't fire.
+BULLET_POOL_SIZE = 64
+BULLET_POOL_OVERFLOW = "recycle"
+
+# How many bullets a BulletArray can have in the air at once
+BULLET_ARRAY_SIZE = 4096
+
+# How fast bullets travel
+BULLET_SPEED = 5
+
+# Who fired a shot. Each side is a bit, so a target can be hit by shots
+# from more than one of them.
+PLAYER_SHOT = 1
+ENEMY_SHOT = 2
+
+# The color of each side's shots: white for the player, red for enemies
+SHOT_COLORS = {PLAYER_SHOT: (255, 255, 255), ENEMY_SHOT: (255, 0, 0)}
+
+class Bullet(pygame.sprite.Sprite):
+    """ This class represents the bullet. """
+
+    # Every bullet from the same side looks the same, so they share one
+    # surface for each side
+    shared_images = {}
+
+    def __init__(self, start_x, start_y, dest_x, dest_y, bounds=None,
+                 faction=PLAYER_SHOT, speed=BULLET_SPEED):
+        """ Constructor.
+        It takes in the starting x and y location.
+        It also takes in the destination x and y position.
+        The bullet is removed when it leaves the bounds rect, which is
+        the screen unless you pass in something else. faction is who
+        fired it, PLAYER_SHOT or ENEMY_SHOT.
+        """
+
+        # Call the parent class (Sprite) constructor
+        super().__init__()
+
+        # Set up the image for the bullet
+        self.image = Bullet.get_image(faction)
+
+        self.rect = self.image.get_rect()
+
+        # The pool this bullet goes back to when it is killed
+        self.pool = None
+
+        self.reset(start_x, start_y, dest_x, dest_y, bounds, faction, speed)
+
+    @staticmethod
+    def get_image(faction=PLAYER_SHOT):
+        """ The surface the bullets fired by a side are drawn with. """
+        image = Bullet.shared_images.get(faction)
+        if image is None:
+            image = Bullet.shared_images[faction] = pygame.Surface([4, 10])
+            image.fill(SHOT_COLORS[faction])
+        return image
+
+    def reset(self, start_x, start_y, dest_x, dest_y, bounds=None,
+              faction=PLAYER_SHOT, speed=BULLET_SPEED):
+        """ Aim the bullet again, so it can be fired another time. """
+        if bounds is None:
+            bounds = pygame.Rect(0, 0, SCREEN_WIDTH, SCREEN_HEIGHT)
+        self.bounds = bounds
+        self.faction = faction
+        self.image = Bullet.get_image(faction)
+
+        # Move the bullet to our starting location
+        self.rect.x = start_x
+        self.rect.y = start_y
+
+        # Because rect.x and rect.y are automatically converted
+        # to integers, we need to create different variables that
+        # store the location as floating point numbers. Integers
+        # are not accurate enough for aiming.
+        self.floating_point_x = start_x
+        self.floating_point_y = start_y
+
+        # Calculation the angle in radians between the start points
+        # and end points. This is the angle the bullet will travel.
+        x_diff = dest_x - start_x
+        y_diff = dest_y - start_y
+        angle = math.atan2(y_diff, x_diff);
+
+        # Taking into account the angle, calculate our change_x
+        # and change_y. Velocity is how fast the bullet travels.
+        velocity = speed
+        self.change_x = math.cos(angle) * velocity
+        self.change_y = math.sin(angle) * velocity
+
+    def update(self):
+        """ Move the bullet. """
+
+        # The floating point x and y hold our more accurate location.
+        self.floating_point_y += self.change_y
+        self.floating_point_x += self.change_x
+
+        # The rect.x and rect.y are converted to integers.
+        self.rect.y = int(self.floating_point_y)
+        self.rect.x = int(self.floating_point_x)
+
+        # If the bullet flies of the screen, get rid of it.
+        bounds = self.bounds
+        if self.rect.x < bounds.left or self.rect.x > bounds.right or self.rect.y < bounds.top or self.rect.y > bounds.bottom:
+            self.kill()
+
+    def kill(self):
+        """ Remove the bullet from its groups and give it back to its pool. """
+        super().kill()
+        if self.pool is not None:
+            self.pool.release(self)
+
+class BulletPool():
+    """ A fixed number of bullets that are reused, so firing doesn't make
+        a new sprite every time. Killed bullets go back to the pool. """
+
+    def __init__(self, capacity=BULLET_POOL_SIZE, overflow=BULLET_POOL_OVERFLOW):
+        """ Constructor. Makes all the bullets up front. """
+        self.capacity = capacity
+        self.overflow = overflow
+
+        # Bullets ready to fire, and bullets in the air (oldest first)
+        self.free = []
+        self.in_use = {}
+
+        # The bullets that have been fired and are still flying
+        self.bullets = pygame.sprite.Group()
+
+        # Bullets handed out from the pool, and ones it couldn't give out
+        # without recycling, growing or dropping the shot
+        self.hits = 0
+        self.misses = 0
+
+        # How many bullet and target pairs have been tested for a hit
+        self.checks = 0
+
+        for i in range(capacity):
+            bullet = Bullet(0, 0, 1, 0)
+            bullet.pool = self
+            self.free.append(bullet)
+
+    def acquire(self, start_x, start_y, dest_x, dest_y, bounds=None,
+                faction=PLAYER_SHOT, speed=BULLET_SPEED):
+        """ Get a bullet aimed from the start to the destination. Returns
+            None if every bullet is in use and the overflow is "drop". """
+        if self.free:
+            self.hits += 1
+            bullet = self.free.pop()
+        else:
+            self.misses += 1
+            if self.overflow == "grow":
+                bullet = Bullet(0, 0, 1, 0)
+                bullet.pool = self
+            elif self.overflow == "recycle" and self.in_use:
+                bullet = next(iter(self.in_use))
+                bullet.kill()
+                self.free.remove(bullet)
+            else:
+                return None
+
+        bullet.reset(start_x, start_y, dest_x, dest_y, bounds, faction, speed)
+        self.in_use[bullet] = None
+        return bullet
+
+    def release(self, bullet):
+        """ Put a bullet back in the pool. """
+        if bullet not in self.in_use:
+            return
+        del self.in_use[bullet]
+
+        # Bullets made because the pool grew aren't kept
+        if len(self.free) + len(self.in_use) < self.capacity:
+            self.free.append(bullet)
+
+    def __len__(self):
+        return len(self.bullets)
+
+    def clear(self):
+        """ Remove every bullet in the air. """
+        for bullet in self.bullets.sprites():
+            bullet.kill()
+
+    def fire(self, start_x, start_y, dest_x, dest_y, bounds=None,
+             faction=PLAYER_SHOT, speed=BULLET_SPEED):
+        """ Fire a bullet from the start towards the destination. """
+        bullet = self.acquire(start_x, start_y, dest_x, dest_y, bounds, faction, speed)
+        if bullet is not None:
+            self.bullets.add(bullet)
+
+    def fire_many(self, start_x, start_y, dest_x, dest_y, bounds=None,
+                  faction=PLAYER_SHOT, speed=BULLET_SPEED):
+        """ Fire a bullet from each of a list of starts towards the
+            destination. """
+        for x, y in zip(start_x, start_y):
+            self.fire(x, y, dest_x, dest_y, bounds, faction, speed)
+
+    def update(self):
+        """ Move all the bullets. """
+        self.bullets.update()
+
+    def collide(self, group, mask=PLAYER_SHOT):
+        """ Kill every sprite in a SpatialGroup that a bullet from the sides
+            in mask hits, and the bullets that hit them. Returns the
+            sprites that were hit. """
+        hit_list = []
+        for bullet in self.bullets:
+            if not bullet.faction & mask:
+                continue
+            candidates = group.query(bullet.rect)
+            self.checks += len(candidates)
+            block_hit_list = [sprite for sprite in candidates
+                              if bullet.rect.colliderect(sprite.rect)]
+            if block_hit_list:
+                for sprite in block_hit_list:
+                    sprite.kill()
+                bullet.kill()
+                hit_list.extend(block_hit_list)
+        return hit_list
+
+    def hit(self, sprite, mask=ENEMY_SHOT):
+        """ Whether a bullet from the sides in mask hit a sprite. The
+            bullets that hit it are removed. """
+        hit = False
+        self.checks += len(self.bullets)
+        for bullet in pygame.sprite.spritecollide(sprite, self.bullets, False):
+            if bullet.faction & mask:
+                bullet.kill()
+                hit = True
+        return hit
+
+    def draw(self, screen, camera, rects=None, alpha=1.0):
+        """ Draw the bullets that are on the screen, alpha of the way from
+            where they were last tick to where they are now. """
+        if alpha >= 1:
+            camera.draw(screen, self.bullets, rects)
+            return
+        behind = 1 - alpha
+        view = camera.view
+        offset_x, offset_y = camera.camera.topleft
+        for bullet in self.bullets:
+            if view.colliderect(bullet.rect):
+                rect = screen.blit(bullet.image, bullet.rect.move(
+                    offset_x - round(bullet.change_x * behind),
+                    offset_y - round(bullet.change_y * behind)))
+                if rects is not None:
+                    rects.append(rect)
+
+class BulletArray():
+    """ Bullets kept in NumPy arrays instead of sprites. Moving them,
+        removing the ones that leave the screen and checking them against
+        the blocks are each done for every bullet at once, so thousands of
+        bullets cost about the same as a few. They are still drawn with
+        pygame. It has the same methods as BulletPool.
+
+        The player's and the enemies' shots share the arrays; each shot
+        remembers who fired it, and a target is only checked against the
+        sides that can hit it.
+
+        The bullets in the air are always the first count slots of the
+        arrays. """
+
+    def __init__(self, capacity=BULLET_ARRAY_SIZE):
+        """ Constructor. Needs NumPy. """
+        self.capacity = capacity
+        self.count = 0
+
+        # Position and speed of each bullet
+        self.x = numpy.zeros(capacity)
+        self.y = numpy.zeros(capacity)
+        self.change_x = numpy.zeros(capacity)
+        self.change_y = numpy.zeros(capacity)
+
+        # Who fired each bullet
+        self.faction = numpy.zeros(capacity, dtype=numpy.int8)
+
+        # The image for each side's bullets, by faction
+        self.images = [None] * (max(SHOT_COLORS) + 1)
+        for faction in SHOT_COLORS:
+            self.images[faction] = Bullet.get_image(faction)
+        self.width, self.height = self.images[PLAYER_SHOT].get_size()
+
+        # Bullets are removed when they leave this rect
+        self.bounds = pygame.Rect(0, 0, SCREEN_WIDTH, SCREEN_HEIGHT)
+
+        # Shots that didn't fit because every slot was in use
+        self.dropped = 0
+
+        # How many bullet and target pairs have been tested for a hit
+        self.checks = 0
+
+        # Edges of the blocks we last collided with, and the version of
+        # their group they were read from
+        self.block_group = None
+        self.block_version = None
+        self.blocks = []
+        self.block_edges = None
+
+    def __len__(self):
+        return self.count
+
+    def clear(self):
+        """ Remove every bullet in the air. """
+        self.count = 0
+
+    def fire(self, start_x, start_y, dest_x, dest_y, bounds=None,
+             faction=PLAYER_SHOT, speed=BULLET_SPEED):
+        """ Fire a bullet from the start towards the destination. """
+        if bounds is not None:
+            self.bounds = bounds
+        if self.count == self.capacity:
+            self.dropped += 1
+            return
+
+        # Same aiming as Bullet
+        angle = math.atan2(dest_y - start_y, dest_x - start_x)
+        i = self.count
+        self.x[i] = start_x
+        self.y[i] = start_y
+        self.change_x[i] = math.cos(angle) * speed
+        self.change_y[i] = math.sin(angle) * speed
+        self.faction[i] = faction
+        self.count += 1
+
+    def fire_many(self, start_x, start_y, dest_x, dest_y, bounds=None,
+                  faction=PLAYER_SHOT, speed=BULLET_SPEED):
+        """ Fire a bullet from each of arrays of starts towards the
+            destination, all at once. """
+        if bounds is not None:
+            self.bounds = bounds
+        start_x = numpy.asarray(start_x, dtype=float)
+        start_y = numpy.asarray(start_y, dtype=float)
+        room = self.capacity - self.count
+        if len(start_x) > room:
+            self.dropped += len(start_x) - room
+            start_x = start_x[:room]
+            start_y = start_y[:room]
+        first = self.count
+        last = first + len(start_x)
+        angle = numpy.arctan2(dest_y - start_y, dest_x - start_x)
+        self.x[first:last] = start_x
+        self.y[first:last] = start_y
+        self.change_x[first:last] = numpy.cos(angle) * speed
+        self.change_y[first:last] = numpy.sin(angle) * speed
+        self.faction[first:last] = faction
+        self.count = last
+
+    def keep(self, mask):
+        """ Keep only the bullets where mask is True, packed at the front. """
+        n = self.count
+        kept = int(mask.sum())
+        for array in (self.x, self.y, self.change_x, self.change_y, self.faction):
+            array[:kept] = array[:n][mask]
+        self.count = kept
+
+    def update(self):
+        """ Move all the bullets and remove the ones that left the bounds. """
+        n = self.count
+        if n == 0:
+            return
+        self.x[:n] += self.change_x[:n]
+        self.y[:n] += self.change_y[:n]
+
+        # Bullet.update tests the rect, which is the position as an int
+        x = self.x[:n].astype(int)
+        y = self.y[:n].astype(int)
+        bounds = self.bounds
+        inside = ((x >= bounds.left) & (x <= bounds.right) &
+                  (y >= bounds.top) & (y <= bounds.bottom))
+        if not inside.all():
+            self.keep(inside)
+
+    def collide(self, group, mask=PLAYER_SHOT):
+        """ Kill every sprite in a group that a bullet from the sides in
+            mask hits, and the bullets that hit them. Returns the sprites
+            that were hit. """
+        n = self.count
+        if n == 0 or len(group) == 0:
+            return []
+
+        # Only read the block rects again when the group has changed
+        if group is not self.block_group or group.version != self.block_version:
+            self.blocks = group.sprites()
+            self.block_edges = numpy.array([(block.rect.left, block.rect.top,
+                                             block.rect.right, block.rect.bottom)
+                                            for block in self.blocks]).T
+            self.block_group = group
+            self.block_version = group.version
+
+        block_hit = self.hits(*self.block_edges, mask=mask)
+        if block_hit is None:
+            return []
+
+        hit_list = [self.blocks[i] for i in numpy.flatnonzero(block_hit)]
+        for block in hit_list:
+            block.kill()
+        return hit_list
+
+    def hits(self, left, top, right, bottom, mask=PLAYER_SHOT):
+        """ Which of some rects, given as arrays of their edges, a bullet
+            from the sides in mask hits. The bullets that hit one are
+            removed. Returns an array with True for each rect that was hit,
+            or None if none were. """
+        n = self.count
+        if n == 0 or len(left) == 0:
+            return None
+        shots = (self.faction[:n] & mask) != 0
+        if not shots.all():
+            shots = numpy.flatnonzero(shots)
+            if len(shots) == 0:
+                return None
+        else:
+            shots = slice(0, n)
+
+        # One row per bullet and one column per rect
+        x = self.x[shots].astype(int)[:, None]
+        y = self.y[shots].astype(int)[:, None]
+        self.checks += len(x) * len(left)
+        overlap = ((x < right) & (x + self.width > left) &
+                   (y < bottom) & (y + self.height > top))
+
+        bullet_hit = overlap.any(axis=1)
+        if not bullet_hit.any():
+            return None
+        kept = numpy.ones(n, dtype=bool)
+        kept[shots] = ~bullet_hit
+        self.keep(kept)
+        return overlap.any(axis=0)
+
+    def hit(self, sprite, mask=ENEMY_SHOT):
+        """ Whether a bullet from the sides in mask hit a sprite. The
+            bullets that hit it are removed. """
+        rect = sprite.rect
+        return self.hits(numpy.array([rect.left]), numpy.array([rect.top]),
+                         numpy.array([rect.right]), numpy.array([rect.bottom]),
+                         mask) is not None
+
+    def draw(self, screen, camera, rects=None, alpha=1.0):
+        """ Draw all the bullets, alpha of the way from where they were
+            last tick to where they are now. """
+        n = self.count
+        if n == 0:
+            return
+        offset_x, offset_y = camera.camera.topleft
+        x = self.x[:n]
+        y = self.y[:n]
+        if alpha < 1:
+            x = x - self.change_x[:n] * (1 - alpha)
+            y = y - self.change_y[:n] * (1 - alpha)
+        x = x.astype(int) + offset_x
+        y = y.astype(int) + offset_y
+        images = self.images
+        blits = [(images[faction], position) for faction, position in
+                 zip(self.faction[:n].tolist(), zip(x.tolist(), y.tolist()))]
+        if rects is None:
+            screen.blits(blits, False)
+        else:
+            rects.extend(screen.blits(blits))
@@ -0,0 +1,103 @@
+""" Controls.
+
+Events from pygame are turned into actions, like "left" or "jump", by the
+key bindings. InputState collects the actions that happen between two
+ticks, so the game looks at them once a tick however many events came in;
+something like a fast mouse only moves the remembered mouse position.
+
+The bindings are KEY_BINDINGS, with any actions in keybindings.json put
+in their place. That file maps actions to lists of key names, the names
+pygame.key.name() gives:
+
+    {"left": ["a", "left"], "right": ["d", "right"], "jump": ["space", "w"]}
+"""
+import json
+import os
+
+import pygame
+
+# Keys for each action
+KEY_BINDINGS = {
+    "left": [pygame.K_a],
+    "right": [pygame.K_d],
+    "jump": [pygame.K_SPACE],
+    "overlay": [pygame.K_F3],    # show the debug overlay
+    "profile": [pygame.K_F4],    # profile the next few hundred frames
+    }
+
+# Where the player's own key bindings are, if they have any
+KEYBINDINGS_FILE = "keybindings.json"
+
+def read_bindings(filename=KEYBINDINGS_FILE, defaults=KEY_BINDINGS):
+    """ The key bindings, with the actions in filename replacing the
+        defaults. Returns the defaults if there's no such file. """
+    bindings = dict(defaults)
+    if not os.path.exists(filename):
+        return bindings
+    with open(filename, "r") as file:
+        for action, names in json.load(file).items():
+            try:
+                bindings[action] = [pygame.key.key_code(name) for name in names]
+            except ValueError:
+                raise ValueError("{0}: unknown key in {1}".format(filename, names))
+    return bindings
+
+class InputState():
+    """ What the player did since the last tick. handle() takes each event
+        as it comes; the game reads the state once a tick and calls
+        clear().
+
+        changes is every action pressed or released, in order, as
+        (action, pressed). held is the actions whose keys are down, and
+        clicks the positions the mouse buttons were pressed at. """
+
+    def __init__(self, bindings=None):
+        if bindings is None:
+            bindings = read_bindings()
+        self.bindings = bindings
+
+        # The action for each key
+        self.actions = {}
+        for action, keys in bindings.items():
+            for key in keys:
+                self.actions[key] = action
+
+        self.changes = []
+        self.held = set()
+        self.clicks = []
+
+        # Where the mouse was last seen
+        self.mouse = (0, 0)
+
+    def action(self, event):
+        """ The action a key event is bound to, or None. """
+        if event.type in (pygame.KEYDOWN, pygame.KEYUP):
+            return self.actions.get(event.key)
+        return None
+
+    def handle(self, event):
+        """ Take one event. Returns the action it pressed, if any. """
+        if event.type == pygame.KEYDOWN:
+            action = self.actions.get(event.key)
+            if action is not None:
+                self.changes.append((action, True))
+                self.held.add(action)
+            return action
+        if event.type == pygame.KEYUP:
+            action = self.actions.get(event.key)
+            if action is not None:
+                self.changes.append((action, False))
+                self.held.discard(action)
+        elif event.type == pygame.MOUSEBUTTONDOWN:
+            self.clicks.append(event.pos)
+            self.mouse = event.pos
+        elif event.type == pygame.MOUSEMOTION:
+            self.mouse = event.pos
+        return None
+
+    def clear(self):
+        """ Forget what happened since the last tick. Held keys stay held. """
+        if self.changes:
+            self.changes = []
+        if self.clicks:
+            self.clicks = []
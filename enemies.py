@@ -0,0 +1,243 @@
+""" Enemies.
+
+An EnemySwarm moves all of a level's enemies at once with NumPy, and has
+the ones near the player shoot at them. Each level's file says how many
+enemies there are, where, and how each of them moves and shoots.
+"""
+from bullets import BulletArray, ENEMY_SHOT
+from spatial import SpatialGroup
+
+# NumPy is needed to move the enemies. Without it they stay still.
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Enemies only move while they are this close to the part of the world on
+# the screen
+ENEMY_ACTIVE_RADIUS = 400
+
+# How enemies move. Patrolling enemies go back and forth across their
+# range. Chasing ones fly at the player once the player is within their
+# range. Swooping ones sweep across their range and dive
+# ENEMY_SWOOP_DEPTH pixels on the way.
+ENEMY_BEHAVIOURS = ["patrol", "chase", "swoop"]
+ENEMY_SPEED = 2
+ENEMY_RANGE = 150
+ENEMY_SWOOP_DEPTH = 200
+
+# How fast enemy shots travel, and how close the player has to be before
+# an enemy on the screen shoots at them. How often each enemy shoots is
+# set in the level file.
+ENEMY_SHOT_SPEED = 3
+ENEMY_FIRE_RANGE = 500
+
+class EnemySwarm():
+    """ Enemies that move. Where they are and what they're doing is kept
+        in NumPy arrays, one slot per enemy, and every enemy near the view
+        is moved at once each tick instead of by its own update(). The
+        ones further away wait where they are.
+
+        Each enemy is also a Block sprite in the level's enemy_list, which
+        is what gets killed and scored when a bullet hits it. Only the
+        arrays move, so the sprite's rect is only brought up to date when
+        something needs it. """
+
+    def __init__(self, image):
+        """ Constructor. Pass in the image the enemies are drawn with.
+            Needs NumPy. """
+        self.sprites = []
+
+        # Slot of each sprite
+        self.index = {}
+
+        # Position now and last tick, where each enemy started, how fast
+        # it goes, how far it goes (its ENEMY_RANGE) and which way it's
+        # heading. behaviour is an index into ENEMY_BEHAVIOURS and phase is
+        # how far along its sweep a swooping enemy is.
+        self.x = numpy.zeros(0)
+        self.y = numpy.zeros(0)
+        self.previous_x = numpy.zeros(0)
+        self.previous_y = numpy.zeros(0)
+        self.home_x = numpy.zeros(0)
+        self.home_y = numpy.zeros(0)
+        self.speed = numpy.zeros(0)
+        self.reach = numpy.zeros(0)
+        self.direction = numpy.zeros(0)
+        self.phase = numpy.zeros(0)
+        self.behaviour = numpy.zeros(0, dtype=numpy.int8)
+        self.alive = numpy.zeros(0, dtype=bool)
+
+        # Ticks each enemy waits between shots, 0 for one that doesn't
+        # shoot, and ticks until it can shoot again
+        self.fire_delay = numpy.zeros(0, dtype=int)
+        self.cooldown = numpy.zeros(0, dtype=int)
+
+        # Enemies close enough to the view to move, as of the last update
+        self.active = numpy.zeros(0, dtype=bool)
+
+        self.image = image
+        self.width, self.height = image.get_size()
+
+    def __len__(self):
+        return len(self.sprites)
+
+    def add(self, sprites, behaviour, speed=ENEMY_SPEED, reach=ENEMY_RANGE,
+            direction=None, phase=None, fire_delay=0, cooldown=None):
+        """ Add Block sprites as enemies with a behaviour from
+            ENEMY_BEHAVIOURS, starting where their rects are. They shoot
+            every fire_delay ticks, if it isn't 0. direction (1 or -1),
+            phase and cooldown (ticks until the first shot) can be lists
+            with one value per sprite. """
+        count = len(sprites)
+        if count == 0:
+            return
+        kind = ENEMY_BEHAVIOURS.index(behaviour)
+        first = len(self.sprites)
+        for i, sprite in enumerate(sprites):
+            self.index[sprite] = first + i
+        self.sprites.extend(sprites)
+
+        x = numpy.array([sprite.rect.x for sprite in sprites], dtype=float)
+        y = numpy.array([sprite.rect.y for sprite in sprites], dtype=float)
+        if direction is None:
+            direction = numpy.ones(count)
+        if phase is None:
+            phase = numpy.zeros(count)
+        if cooldown is None:
+            cooldown = numpy.full(count, fire_delay)
+        new = {"x": x, "y": y, "previous_x": x, "previous_y": y,
+               "home_x": x, "home_y": y,
+               "speed": numpy.full(count, float(speed)),
+               "reach": numpy.full(count, float(reach)),
+               "direction": numpy.asarray(direction, dtype=float),
+               "phase": numpy.asarray(phase, dtype=float),
+               "behaviour": numpy.full(count, kind, dtype=numpy.int8),
+               "alive": numpy.ones(count, dtype=bool),
+               "active": numpy.zeros(count, dtype=bool),
+               "fire_delay": numpy.full(count, int(fire_delay)),
+               "cooldown": numpy.asarray(cooldown, dtype=int)}
+        for name, values in new.items():
+            setattr(self, name, numpy.concatenate((getattr(self, name), values)))
+
+    def update(self, camera, player):
+        """ Move every living enemy near the view one tick. """
+        if not self.sprites:
+            return
+        x = self.x
+        y = self.y
+        self.previous_x = x.copy()
+        self.previous_y = y.copy()
+
+        area = camera.view.inflate(ENEMY_ACTIVE_RADIUS * 2, ENEMY_ACTIVE_RADIUS * 2)
+        active = (self.alive & (x + self.width > area.left) & (x < area.right) &
+                  (y + self.height > area.top) & (y < area.bottom))
+        self.active = active
+        if not active.any():
+            return
+        behaviour = self.behaviour
+        speed = self.speed
+
+        # Patrol: back and forth, turning at either end of the range
+        patrol = active & (behaviour == 0)
+        x[patrol] += self.direction[patrol] * speed[patrol]
+        turn = patrol & ((x - self.home_x) * self.direction >= self.reach)
+        self.direction[turn] = -self.direction[turn]
+
+        # Chase: straight at the middle of the player, once close enough
+        chase = active & (behaviour == 1)
+        if chase.any():
+            dx = player.rect.centerx - (x + self.width / 2)
+            dy = player.rect.centery - (y + self.height / 2)
+            distance = numpy.hypot(dx, dy)
+            chase &= (distance < self.reach) & (distance > speed)
+            step = numpy.divide(speed, distance, out=numpy.zeros_like(distance),
+                                where=chase)
+            x += dx * step
+            y += dy * step
+
+        # Swoop: sweep across the range, diving lowest in the middle
+        swoop = active & (behaviour == 2)
+        if swoop.any():
+            self.phase[swoop] += speed[swoop] / numpy.maximum(self.reach[swoop], 1)
+            phase = self.phase[swoop]
+            x[swoop] = self.home_x[swoop] + self.reach[swoop] * numpy.sin(phase)
+            y[swoop] = self.home_y[swoop] + ENEMY_SWOOP_DEPTH * numpy.cos(phase) ** 2
+
+    def fire(self, bullets, player, view):
+        """ Count down to each enemy's next shot. The enemies on the screen
+            that are ready and close enough to the player all shoot at the
+            player at once. """
+        armed = self.active & (self.fire_delay > 0)
+        if not armed.any():
+            return
+        self.cooldown[armed] -= 1
+
+        x = self.x + self.width / 2
+        y = self.y + self.height / 2
+        target_x, target_y = player.rect.center
+        ready = (armed & (self.cooldown <= 0) &
+                 (x > view.left) & (x < view.right) & (y > view.top) & (y < view.bottom) &
+                 (numpy.hypot(target_x - x, target_y - y) < ENEMY_FIRE_RANGE))
+        if not ready.any():
+            return
+        self.cooldown[ready] = self.fire_delay[ready]
+        bullets.fire_many(x[ready], y[ready], target_x, target_y, view,
+                          ENEMY_SHOT, ENEMY_SHOT_SPEED)
+
+    def sync(self, slots):
+        """ Move the sprites in some slots to where their enemies are. """
+        for i, x, y in zip(slots.tolist(), self.x[slots].astype(int).tolist(),
+                           self.y[slots].astype(int).tolist()):
+            self.sprites[i].rect.topleft = (x, y)
+
+    def collide(self, bullets):
+        """ Kill every enemy the bullets hit, and the bullets that hit
+            them. Returns the sprites that were hit. """
+        slots = numpy.flatnonzero(self.active)
+        if len(slots) == 0 or len(bullets) == 0:
+            return []
+        if isinstance(bullets, BulletArray):
+            left = self.x[slots].astype(int)
+            top = self.y[slots].astype(int)
+            hit = bullets.hits(left, top, left + self.width, top + self.height)
+            if hit is None:
+                return []
+            slots = slots[hit]
+            self.sync(slots)
+            hit_list = [self.sprites[i] for i in slots.tolist()]
+            for sprite in hit_list:
+                sprite.kill()
+        else:
+            # Sprite bullets need sprites to hit
+            self.sync(slots)
+            group = SpatialGroup([self.sprites[i] for i in slots.tolist()])
+            hit_list = bullets.collide(group)
+            group.empty()
+            slots = numpy.array([self.index[sprite] for sprite in hit_list], dtype=int)
+        self.alive[slots] = False
+        self.active[slots] = False
+        return hit_list
+
+    def draw(self, screen, camera, rects=None, alpha=1.0):
+        """ Draw the living enemies that are on the screen, alpha of the way
+            from where they were last tick to where they are now. """
+        if not self.sprites:
+            return
+        x = self.x
+        y = self.y
+        if alpha < 1:
+            x = self.previous_x + (x - self.previous_x) * alpha
+            y = self.previous_y + (y - self.previous_y) * alpha
+        view = camera.view
+        shown = (self.alive & (x + self.width > view.left) & (x < view.right) &
+                 (y + self.height > view.top) & (y < view.bottom))
+        offset_x, offset_y = camera.camera.topleft
+        x = x[shown].astype(int) + offset_x
+        y = y[shown].astype(int) + offset_y
+        image = self.image
+        blits = [(image, position) for position in zip(x.tolist(), y.tolist())]
+        if rects is None:
+            screen.blits(blits, False)
+        else:
+            rects.extend(screen.blits(blits))
@@ -0,0 +1,249 @@
+""" High scores.
+
+Every score is one line appended to a log file, so saving a score never
+rewrites anything and a crash can at worst lose the line being written.
+The log is read once when the store is opened, into leaderboards kept in
+memory: the best scores overall, for each player name and for each level.
+
+Lines are written by a background thread, so add() returns straight away.
+When the log has grown well past what the leaderboards keep, the thread
+rewrites it with just those scores, to a temporary file that then replaces
+the log in one step.
+
+The old highscores.txt, with one score and one name, is read into a new
+log the first time.
+"""
+import atexit
+import bisect
+import json
+import os
+import queue
+import threading
+import time
+
+# The log, and the file the game used to keep its one high score in
+HIGHSCORE_LOG = "highscores.log"
+LEGACY_HIGHSCORE_FILE = "highscores.txt"
+
+# How many scores each leaderboard keeps
+HIGHSCORES_KEPT = 10
+
+# Rewrite the log once it has this many times more lines than the
+# leaderboards keep
+COMPACT_RATIO = 4
+
+class HighScore():
+    """ One score. level is None for scores from before levels were kept. """
+
+    def __init__(self, score, name, level=None, when=None):
+        self.score = score
+        self.name = name
+        self.level = level
+        self.when = time.time() if when is None else when
+
+    def line(self):
+        """ The score as a line of the log. """
+        return json.dumps([self.score, self.name, self.level, self.when]) + "\n"
+
+    @classmethod
+    def from_line(cls, line):
+        """ A score from a line of the log, or None if the line is broken. """
+        if not line.endswith("\n"):
+            # Cut off part way through writing it
+            return None
+        try:
+            score, name, level, when = json.loads(line)
+            return cls(int(score), str(name), level, float(when))
+        except (ValueError, TypeError):
+            return None
+
+class Leaderboard():
+    """ The best few scores, best first. Ties keep the older score first. """
+
+    def __init__(self, size=HIGHSCORES_KEPT):
+        self.size = size
+        self.entries = []
+
+        # Sort keys for entries, lowest first, for bisect
+        self.keys = []
+
+    def add(self, entry):
+        """ Add a score if it's good enough. Returns the score it pushed off
+            the bottom, or None. """
+        key = (-entry.score, entry.when)
+        index = bisect.bisect_right(self.keys, key)
+        if index >= self.size:
+            return entry
+        self.keys.insert(index, key)
+        self.entries.insert(index, entry)
+        if len(self.entries) > self.size:
+            self.keys.pop()
+            return self.entries.pop()
+        return None
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    def __len__(self):
+        return len(self.entries)
+
+class HighScoreStore():
+    """ The high scores, from a log file that scores are appended to. """
+
+    def __init__(self, filename=HIGHSCORE_LOG, legacy_file=LEGACY_HIGHSCORE_FILE,
+                 size=HIGHSCORES_KEPT):
+        self.filename = filename
+        self.size = size
+
+        # Guards the leaderboards, which the writer thread reads to compact
+        self.lock = threading.Lock()
+        self.overall = Leaderboard(size)
+        self.by_name = {}
+        self.by_level = {}
+
+        # Lines in the log, kept or not
+        self.lines = 0
+
+        if os.path.exists(filename):
+            broken = False
+            with open(filename, "r", encoding="utf-8", newline="\n") as file:
+                for line in file:
+                    self.lines += 1
+                    entry = HighScore.from_line(line)
+                    if entry is None:
+                        broken = True
+                    else:
+                        self.remember(entry)
+            if broken:
+                # Don't append after half a line
+                self.rewrite()
+        else:
+            self.migrate(legacy_file)
+
+        # Lines waiting for the writer thread, and the thread
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self.write_lines, name="high-scores",
+                                       daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+
+    def migrate(self, legacy_file):
+        """ Start the log with the score from the old high score file. """
+        try:
+            with open(legacy_file, "r") as file:
+                lines = file.readlines()
+            entry = HighScore(int(lines[0]), lines[1].strip() if len(lines) > 1 else "",
+                              when=os.path.getmtime(legacy_file))
+        except (IOError, ValueError, IndexError):
+            return
+        self.remember(entry)
+        self.rewrite()
+
+    def remember(self, entry):
+        """ Put a score on the leaderboards it belongs on. """
+        with self.lock:
+            self.overall.add(entry)
+            board = self.by_name.get(entry.name)
+            if board is None:
+                board = self.by_name[entry.name] = Leaderboard(self.size)
+            board.add(entry)
+            if entry.level is not None:
+                board = self.by_level.get(entry.level)
+                if board is None:
+                    board = self.by_level[entry.level] = Leaderboard(self.size)
+                board.add(entry)
+
+    def add(self, score, name, level=None):
+        """ Save a score. The leaderboards change straight away; the line
+            is written to the log in the background. """
+        entry = HighScore(score, name, level)
+        self.remember(entry)
+        self.queue.put(entry.line())
+        return entry
+
+    def best(self, name=None, level=None):
+        """ The best scores, best first: overall, for a player or for a
+            level. """
+        with self.lock:
+            if name is not None:
+                board = self.by_name.get(name, ())
+            elif level is not None:
+                board = self.by_level.get(level, ())
+            else:
+                board = self.overall
+            return list(board)
+
+    def best_score(self):
+        """ The best score of all, or 0 if there are none. """
+        with self.lock:
+            if not self.overall.entries:
+                return 0
+            return self.overall.entries[0].score
+
+    def kept(self):
+        """ Every score on a leaderboard, oldest first. """
+        with self.lock:
+            entries = set(self.overall)
+            for board in self.by_name.values():
+                entries.update(board)
+            for board in self.by_level.values():
+                entries.update(board)
+        return sorted(entries, key=lambda entry: entry.when)
+
+    def write_lines(self):
+        """ The writer thread: append lines to the log as they come in. """
+        while True:
+            line = self.queue.get()
+            if line is None:
+                self.queue.task_done()
+                return
+            count = 1
+            try:
+                with open(self.filename, "a", encoding="utf-8", newline="\n") as file:
+                    file.write(line)
+                    # Any more that came in go in the same write
+                    while True:
+                        try:
+                            more = self.queue.get_nowait()
+                        except queue.Empty:
+                            break
+                        if more is None:
+                            self.queue.put(None)
+                            self.queue.task_done()
+                            break
+                        file.write(more)
+                        count += 1
+                    file.flush()
+                    os.fsync(file.fileno())
+                self.lines += count
+                if (self.lines > self.size * COMPACT_RATIO and
+                        self.lines > len(self.kept()) * COMPACT_RATIO):
+                    self.rewrite()
+            except OSError as error:
+                print("Couldn't save high score:", error)
+            for i in range(count):
+                self.queue.task_done()
+
+    def rewrite(self):
+        """ Replace the log with just the scores on the leaderboards. The
+            new log is written to a temporary file first, so the log is
+            always either the old one or the new one. """
+        entries = self.kept()
+        temp = self.filename + ".tmp"
+        with open(temp, "w", encoding="utf-8", newline="\n") as file:
+            for entry in entries:
+                file.write(entry.line())
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp, self.filename)
+        self.lines = len(entries)
+
+    def flush(self):
+        """ Wait until every score added so far is in the log. """
+        self.queue.join()
+
+    def close(self):
+        """ Write what's left and stop the writer thread. """
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
@@ -0,0 +1,424 @@
+""" Pre-compiled Tiled maps.
+
+Loading a .tmx with pytmx parses the XML, splits the CSV tile data and
+resolves every tileset each time the game starts. This compiles a map and
+its .tsx tilesets into one binary file instead: the tile layers as packed
+arrays of gids, a table of objects, and where each tileset's image is. The
+file starts with a hash of the .tmx and .tsx files it came from, so it is
+compiled again whenever one of them changes.
+
+Loading a compiled map memory-maps the file, and the tile rows are read
+straight out of the mapping, so loading costs about as much as reading the
+file. Compile every map ahead of time with:
+
+    python level_cache.py maps/*.tmx
+"""
+import base64
+import gzip
+import hashlib
+import mmap
+import os
+import struct
+import sys
+import zlib
+import xml.etree.ElementTree as ElementTree
+
+import pygame
+
+# Compiled maps are kept here, next to the maps
+CACHE_FOLDER = "cache"
+
+MAGIC = b"LVLC"
+VERSION = 2
+
+# Tiled keeps tile flips in the top bits of a gid
+FLIPPED_HORIZONTALLY = 0x80000000
+FLIPPED_VERTICALLY = 0x40000000
+FLIPPED_DIAGONALLY = 0x20000000
+GID_MASK = 0x1FFFFFFF
+
+# magic, version, hash, map width, height, tile width, tile height. The
+# .tsx files the hash covers come straight after it, so the hash can be
+# checked without reading the rest.
+HEADER = struct.Struct("<4sH20s4I")
+# first gid, tile width, tile height, spacing, margin, columns, tile count, image
+TILESET = struct.Struct("<I5HII")
+# name, visible, width, height, offset of the gids in the file
+LAYER = struct.Struct("<IB3xIIQ")
+# name, type, x, y, width, height, gid
+OBJECT = struct.Struct("<II4fI")
+
+class UnsupportedMap(Exception):
+    """ The map uses something the compiler doesn't handle. """
+
+def cache_path(filename):
+    """ Where the compiled version of a map goes. """
+    folder, name = os.path.split(filename)
+    return os.path.join(folder, CACHE_FOLDER, os.path.splitext(name)[0] + ".lvl")
+
+def tileset_sources(root, folder):
+    """ The .tsx files a map uses. """
+    return [os.path.join(folder, tileset.get("source"))
+            for tileset in root.findall("tileset") if tileset.get("source")]
+
+def find_image(filename, folder):
+    """ Where an image a tileset points at really is. The tilesets point
+        at their images one folder up from maps/, but the images are kept
+        in folder, next to the maps. """
+    if not os.path.exists(filename):
+        filename = os.path.join(folder, os.path.basename(filename))
+    return filename
+
+def read_tilesets(root, folder):
+    """ The tilesets of a parsed map in folder, as (first gid, tileset
+        element, image file). Tilesets kept in .tsx files are read from
+        them. The image file is None for tilesets made of separate
+        images. """
+    tilesets = []
+    for tileset in root.findall("tileset"):
+        first_gid = int(tileset.get("firstgid"))
+        source_folder = folder
+        if tileset.get("source"):
+            source = os.path.join(folder, tileset.get("source"))
+            source_folder = os.path.dirname(source)
+            tileset = ElementTree.parse(source).getroot()
+        image = tileset.find("image")
+        image_file = None
+        if image is not None:
+            image_file = find_image(os.path.join(source_folder, image.get("source")), folder)
+        tilesets.append((first_gid, tileset, image_file))
+    return tilesets
+
+def content_hash(files):
+    """ Hash of the contents of a list of files, in order. """
+    digest = hashlib.sha1(struct.pack("<H", VERSION))
+    for filename in files:
+        with open(filename, "rb") as file:
+            digest.update(file.read())
+    return digest.digest()
+
+def read_gids(data, count):
+    """ The gids in a layer's <data>, in any of Tiled's encodings. """
+    encoding = data.get("encoding")
+    if encoding == "csv":
+        gids = [int(gid) for gid in data.text.split(",") if gid.strip()]
+    elif encoding == "base64":
+        raw = base64.b64decode(data.text.strip())
+        compression = data.get("compression")
+        if compression == "zlib":
+            raw = zlib.decompress(raw)
+        elif compression == "gzip":
+            raw = gzip.decompress(raw)
+        elif compression:
+            raise UnsupportedMap("{0} compressed tile data".format(compression))
+        gids = list(struct.unpack("<{0}I".format(len(raw) // 4), raw))
+    elif encoding is None:
+        gids = [int(tile.get("gid", 0)) for tile in data.findall("tile")]
+    else:
+        raise UnsupportedMap("{0} encoded tile data".format(encoding))
+    if len(gids) != count:
+        raise UnsupportedMap("layer has {0} tiles, expected {1}".format(len(gids), count))
+    return gids
+
+def compile_bytes(filename):
+    """ Compile a .tmx file. Returns the compiled map. """
+    folder = os.path.dirname(filename)
+    root = ElementTree.parse(filename).getroot()
+    if root.get("orientation", "orthogonal") != "orthogonal":
+        raise UnsupportedMap("only orthogonal maps are supported")
+    if root.get("infinite") == "1":
+        raise UnsupportedMap("infinite maps are not supported")
+
+    strings = []
+    string_index = {}
+    def string(text):
+        text = text or ""
+        if text not in string_index:
+            string_index[text] = len(strings)
+            strings.append(text)
+        return string_index[text]
+
+    tilesets = []
+    for first_gid, tileset, image_file in read_tilesets(root, folder):
+        if image_file is None:
+            raise UnsupportedMap("tilesets made of separate images are not supported")
+        image_file = os.path.relpath(image_file, folder)
+        tilesets.append(TILESET.pack(
+            first_gid, int(tileset.get("tilewidth")), int(tileset.get("tileheight")),
+            int(tileset.get("spacing", 0)), int(tileset.get("margin", 0)),
+            int(tileset.get("columns", 1)), int(tileset.get("tilecount", 1)),
+            string(image_file)))
+
+    layers = []
+    for layer in root.iter("layer"):
+        width = int(layer.get("width"))
+        height = int(layer.get("height"))
+        gids = read_gids(layer.find("data"), width * height)
+        layers.append((string(layer.get("name")), layer.get("visible", "1") != "0",
+                       width, height, struct.pack("<{0}I".format(len(gids)), *gids)))
+
+    objects = []
+    for group in root.iter("objectgroup"):
+        for obj in group.findall("object"):
+            objects.append(OBJECT.pack(
+                string(obj.get("name")), string(obj.get("type")),
+                float(obj.get("x", 0)), float(obj.get("y", 0)),
+                float(obj.get("width", 0)), float(obj.get("height", 0)),
+                int(obj.get("gid", 0))))
+
+    sources = tileset_sources(root, folder)
+    digest = content_hash([filename] + sources)
+
+    # Everything before the tile data
+    table = [struct.pack("<I", len(sources))]
+    for source in sources:
+        encoded = os.path.relpath(source, folder).encode("utf-8")
+        table.append(struct.pack("<H", len(encoded)) + encoded)
+    table.append(struct.pack("<I", len(tilesets)))
+    table.extend(tilesets)
+    layer_table_at = sum(len(part) for part in table)
+    table.append(struct.pack("<I", len(layers)))
+    table.append(b"\0" * (LAYER.size * len(layers)))
+    table.append(struct.pack("<I", len(objects)))
+    table.extend(objects)
+    table.append(struct.pack("<I", len(strings)))
+    for text in strings:
+        encoded = text.encode("utf-8")
+        table.append(struct.pack("<H", len(encoded)) + encoded)
+    body = b"".join(table)
+
+    # Tile data goes after the table, each layer lined up on 4 bytes
+    offset = HEADER.size + len(body)
+    offset += -offset % 4
+    layer_table = []
+    data = []
+    for name, visible, width, height, gids in layers:
+        layer_table.append(LAYER.pack(name, visible, width, height, offset))
+        data.append(gids)
+        offset += len(gids)
+    start = layer_table_at + 4
+    body = body[:start] + b"".join(layer_table) + body[start + LAYER.size * len(layers):]
+
+    header = HEADER.pack(MAGIC, VERSION, digest,
+                         int(root.get("width")), int(root.get("height")),
+                         int(root.get("tilewidth")), int(root.get("tileheight")))
+    padding = b"\0" * (-(HEADER.size + len(body)) % 4)
+    return header + body + padding + b"".join(data)
+
+def compile_map(filename, output=None):
+    """ Compile a .tmx file to a file. Returns the compiled file's name. """
+    if output is None:
+        output = cache_path(filename)
+    data = compile_bytes(filename)
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    temp = output + ".tmp"
+    with open(temp, "wb") as file:
+        file.write(data)
+    os.replace(temp, output)
+    return output
+
+class CompiledTileLayer:
+    """ A tile layer read from a compiled map. data[y][x] is the gid at a
+        tile, the same as a pytmx layer. """
+
+    def __init__(self, name, visible, width, height, gids):
+        self.name = name
+        self.visible = visible
+        self.width = width
+        self.height = height
+        self.data = [gids[y * width:(y + 1) * width] for y in range(height)]
+
+    def __iter__(self):
+        for y, row in enumerate(self.data):
+            for x, gid in enumerate(row):
+                yield x, y, gid
+
+class CompiledObject:
+    """ An object from a compiled map. """
+
+    def __init__(self, name, type, x, y, width, height, gid):
+        self.name = name or None
+        self.type = type or None
+        self.x = x
+        self.y = y
+        self.width = width
+        self.height = height
+        self.gid = gid
+
+class CompiledMap:
+    """ A map loaded from a compiled file. It has the parts of pytmx's
+        TiledMap the game uses: the size, tile layers, objects and
+        get_tile_image_by_gid(). Tile images are cut from the tileset
+        images the first time they are needed.
+
+        compiled is the compiled file, which is memory-mapped, or the
+        compiled map itself as bytes from compile_bytes(). """
+
+    def __init__(self, filename, compiled):
+        self.filename = filename
+        folder = os.path.dirname(filename)
+
+        if isinstance(compiled, bytes):
+            self.mapping = None
+            buffer = memoryview(compiled)
+        else:
+            with open(compiled, "rb") as file:
+                self.mapping = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            buffer = memoryview(self.mapping)
+
+        (magic, version, self.hash, self.width, self.height,
+         self.tilewidth, self.tileheight) = HEADER.unpack_from(buffer, 0)
+        if magic != MAGIC or version != VERSION:
+            raise UnsupportedMap("not a compiled map")
+        at = HEADER.size
+
+        def count():
+            nonlocal at
+            value = struct.unpack_from("<I", buffer, at)[0]
+            at += 4
+            return value
+
+        sources = []
+        for i in range(count()):
+            length = struct.unpack_from("<H", buffer, at)[0]
+            sources.append(bytes(buffer[at + 2:at + 2 + length]).decode("utf-8"))
+            at += 2 + length
+
+        tilesets = []
+        for i in range(count()):
+            tilesets.append(TILESET.unpack_from(buffer, at))
+            at += TILESET.size
+
+        layers = []
+        for i in range(count()):
+            layers.append(LAYER.unpack_from(buffer, at))
+            at += LAYER.size
+
+        objects = []
+        for i in range(count()):
+            objects.append(OBJECT.unpack_from(buffer, at))
+            at += OBJECT.size
+
+        strings = []
+        for i in range(count()):
+            length = struct.unpack_from("<H", buffer, at)[0]
+            strings.append(bytes(buffer[at + 2:at + 2 + length]).decode("utf-8"))
+            at += 2 + length
+
+        self.sources = [os.path.join(folder, source) for source in sources]
+
+        # (first gid, tile width, tile height, spacing, margin, columns,
+        # tile count, image file), highest first gid first
+        self.tilesets = sorted(((first_gid, width, height, spacing, margin, columns, tiles,
+                                 os.path.join(folder, strings[image]))
+                                for first_gid, width, height, spacing, margin, columns, tiles, image
+                                in tilesets), reverse=True)
+
+        self.layers = []
+        for name, visible, width, height, offset in layers:
+            gids = buffer[offset:offset + width * height * 4]
+            if sys.byteorder == "little":
+                gids = gids.cast("I")
+            else:
+                gids = struct.unpack("<{0}I".format(width * height), gids)
+            self.layers.append(CompiledTileLayer(strings[name], bool(visible), width, height, gids))
+
+        self.objects = [CompiledObject(strings[name], strings[type], x, y, width, height, gid)
+                        for name, type, x, y, width, height, gid in objects]
+
+        # Tileset images and tile images, loaded when first used
+        self.images = {}
+        self.tiles = {}
+
+        # Tileset images read by decode_images() that haven't been
+        # converted for the display yet
+        self.decoded = {}
+
+    def decode_images(self):
+        """ Read and decode the tileset images now, rather than when the
+            first tile is drawn. """
+        for tileset in self.tilesets:
+            image_file = tileset[-1]
+            if image_file not in self.images and image_file not in self.decoded:
+                self.decoded[image_file] = pygame.image.load(image_file)
+
+    @property
+    def visible_layers(self):
+        return [layer for layer in self.layers if layer.visible]
+
+    def get_tile_image_by_gid(self, gid):
+        """ The image for a gid, or None for an empty tile. """
+        tile = self.tiles.get(gid)
+        if tile is not None or gid in self.tiles:
+            return tile
+
+        tile = None
+        local_gid = gid & GID_MASK
+        for first_gid, width, height, spacing, margin, columns, tiles, image_file in self.tilesets:
+            if first_gid <= local_gid:
+                index = local_gid - first_gid
+                if index < tiles:
+                    image = self.images.get(image_file)
+                    if image is None:
+                        image = self.decoded.pop(image_file, None)
+                        if image is None:
+                            image = pygame.image.load(image_file)
+                        image = image.convert_alpha()
+                        self.images[image_file] = image
+                    x = margin + (index % columns) * (width + spacing)
+                    y = margin + (index // columns) * (height + spacing)
+                    tile = image.subsurface((x, y, width, height))
+                    if gid & FLIPPED_DIAGONALLY:
+                        tile = pygame.transform.flip(pygame.transform.rotate(tile, 270), True, False)
+                    if gid & (FLIPPED_HORIZONTALLY | FLIPPED_VERTICALLY):
+                        tile = pygame.transform.flip(tile, bool(gid & FLIPPED_HORIZONTALLY),
+                                                     bool(gid & FLIPPED_VERTICALLY))
+                break
+        self.tiles[gid] = tile
+        return tile
+
+def read_stamp(filename, compiled):
+    """ The hash in a compiled map and the hash of the files it says it
+        was compiled from, read with plain reads so the file isn't mapped
+        while it might be replaced. None if it isn't a compiled map this
+        version can read. """
+    folder = os.path.dirname(filename)
+    with open(compiled, "rb") as file:
+        magic, version, digest = HEADER.unpack(file.read(HEADER.size))[:3]
+        if magic != MAGIC or version != VERSION:
+            return None
+        sources = []
+        for i in range(struct.unpack("<I", file.read(4))[0]):
+            length = struct.unpack("<H", file.read(2))[0]
+            sources.append(os.path.join(folder, file.read(length).decode("utf-8")))
+    return digest, content_hash([filename] + sources)
+
+def load_map(filename):
+    """ Load a map from its compiled file, compiling it first if there
+        isn't one or the .tmx or .tsx files have changed since. If the
+        compiled file can't be written, the map is compiled in memory
+        and loaded from there, so the game still runs from a folder it
+        can only read. """
+    compiled = cache_path(filename)
+    if os.path.exists(compiled):
+        try:
+            stamp = read_stamp(filename, compiled)
+        except (struct.error, ValueError, OSError):
+            stamp = None
+        if stamp is not None and stamp[0] == stamp[1]:
+            try:
+                return CompiledMap(filename, compiled)
+            except (UnsupportedMap, struct.error, ValueError, OSError):
+                pass
+    try:
+        compile_map(filename, compiled)
+    except OSError:
+        return CompiledMap(filename, compile_bytes(filename))
+    return CompiledMap(filename, compiled)
+
+if __name__ == "__main__":
+    for name in sys.argv[1:]:
+        try:
+            print("{0} -> {1}".format(name, compile_map(name)))
+        except UnsupportedMap as error:
+            print("{0}: {1}".format(name, error))
@@ -0,0 +1,121 @@
+""" Recording and replaying games.
+
+A game records the events it handles with InputRecorder and saves them,
+with the tick each was handled on, to a small file. Replay reads one back
+as a script of events; fed to a game started from the same seed, it
+plays out exactly the same, at any frame rate:
+
+    python Game.py --record game.rec
+    python Game.py --replay game.rec
+
+ScriptedInput is the same thing for scripts written by hand, like the
+ones the benchmarks play.
+"""
+import struct
+import zlib
+
+import pygame
+
+class ScriptedInput():
+    """ Input read from a script instead of the keyboard and mouse, for
+        running the game without anyone playing it. The script is a list
+        of (tick, event) pairs; each event is given to the game on that
+        tick. """
+
+    def __init__(self, script):
+        self.script = {}
+        for tick, event in script:
+            self.script.setdefault(tick, []).append(event)
+
+    def events(self, tick):
+        """ The events for a tick. """
+        return self.script.get(tick, [])
+
+class InputRecorder():
+    """ Keeps the events a game handles, and the tick each one was handled
+        on, so the game can be played again exactly with Replay. Only the
+        events that change the game are kept. """
+
+    # Magic bytes and version at the start of a recording. The version
+    # goes up when the game changes so that old recordings would play out
+    # differently; version 2 levels have moving enemies, in version 3
+    # they shoot, and in version 4 shots are cleared between levels.
+    MAGIC = b"RPLY"
+    VERSION = 4
+
+    # Version, seed, ticks, final score, final player x and y, events
+    HEADER = struct.Struct("<HQIIiiI")
+
+    # Tick, kind, key or button, key modifiers, mouse x and y
+    EVENT = struct.Struct("<IBiHhh")
+
+    # The event types that are kept, in the order they are numbered in the
+    # file
+    EVENT_TYPES = [pygame.KEYDOWN, pygame.KEYUP, pygame.MOUSEBUTTONDOWN, pygame.QUIT]
+
+    def __init__(self):
+        # (tick, kind, key or button, modifiers, x, y) for each event
+        self.events = []
+
+    def record(self, tick, event):
+        """ Keep an event that was handled before a tick. """
+        if event.type not in self.EVENT_TYPES:
+            return
+        kind = self.EVENT_TYPES.index(event.type)
+        if event.type == pygame.MOUSEBUTTONDOWN:
+            x, y = event.pos
+            self.events.append((tick, kind, event.button, 0, x, y))
+        elif event.type == pygame.QUIT:
+            self.events.append((tick, kind, 0, 0, 0, 0))
+        else:
+            self.events.append((tick, kind, event.key, getattr(event, "mod", 0) & 0xFFFF, 0, 0))
+
+    def save(self, filename, game):
+        """ Write the recording of a game to a file. The events are packed
+            and compressed, so a recording is a few bytes a second. """
+        body = b"".join(self.EVENT.pack(*event) for event in self.events)
+        header = self.HEADER.pack(self.VERSION, game.seed, game.sim_ticks, game.score,
+                                  game.player.rect.x, game.player.rect.y, len(self.events))
+        with open(filename, "wb") as file:
+            file.write(self.MAGIC + header + zlib.compress(body, 9))
+
+class Replay(ScriptedInput):
+    """ A recording made by InputRecorder, played back as a script. Every
+        event is handed to the game on the same tick it was first handled,
+        and the levels are built from the same seed, so the game plays
+        out the same way at any frame rate. The game quits on the tick the
+        recording ended. """
+
+    def __init__(self, filename):
+        with open(filename, "rb") as file:
+            data = file.read()
+        magic_size = len(InputRecorder.MAGIC)
+        if data[:magic_size] != InputRecorder.MAGIC:
+            raise ValueError("{0} isn't a recording".format(filename))
+        (version, self.seed, self.length, self.score, x, y,
+         count) = InputRecorder.HEADER.unpack_from(data, magic_size)
+        if version != InputRecorder.VERSION:
+            raise ValueError("{0} is a version {1} recording".format(filename, version))
+        self.position = (x, y)
+        body = zlib.decompress(data[magic_size + InputRecorder.HEADER.size:])
+
+        script = []
+        quits = False
+        for tick, kind, code, mod, x, y in InputRecorder.EVENT.iter_unpack(body):
+            event_type = InputRecorder.EVENT_TYPES[kind]
+            if event_type == pygame.MOUSEBUTTONDOWN:
+                event = pygame.event.Event(event_type, pos=(x, y), button=code)
+            elif event_type == pygame.QUIT:
+                event = pygame.event.Event(event_type)
+                quits = True
+            else:
+                event = pygame.event.Event(event_type, key=code, mod=mod, unicode="")
+            script.append((tick, event))
+        if not quits:
+            script.append((self.length, pygame.event.Event(pygame.QUIT)))
+        ScriptedInput.__init__(self, script)
+
+    def matches(self, game):
+        """ Whether a game ended the way the recording did. """
+        return (game.sim_ticks == self.length and game.score == self.score and
+                game.player.rect.topleft == self.position)
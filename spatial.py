@@ -0,0 +1,103 @@
+""" Finding sprites near each other.
+
+A SpatialGroup is a sprite group that also keeps its sprites in a grid,
+so a collision test only has to look at the sprites in the cells around
+a rect instead of every sprite in the group.
+"""
+import pygame
+
+# Size of the grid cells used to find sprites near each other
+CELL_SIZE = 128
+
+class SpatialGroup(pygame.sprite.Group):
+    """ A sprite group that also sorts its sprites into a grid of cells,
+        so it can find the sprites near a rect without checking all of
+        them.
+
+        Sprites go into the grid when they are added to the group and come
+        out when they are removed or killed. If a sprite in the group
+        moves, call move() so it ends up in the right cells. """
+
+    def __init__(self, *sprites, cell_size=CELL_SIZE):
+        # The grid has to exist before Group adds any sprites
+        self.cell_size = cell_size
+
+        # Sprites in each (column, row) cell. Dicts keep the order the
+        # sprites were added in, the same as a plain Group.
+        self.cells = {}
+
+        # The cells each sprite is in
+        self.sprite_cells = {}
+
+        # How many sprite pairs have been tested for a hit. Reset it
+        # whenever you want to start counting again.
+        self.checks = 0
+
+        # Goes up every time a sprite is added, removed or moved
+        self.version = 0
+
+        super().__init__(*sprites)
+
+    def cells_for(self, rect):
+        """ The (column, row) of every cell a rect touches. """
+        size = self.cell_size
+        left = rect.left // size
+        right = (rect.right - 1) // size
+        top = rect.top // size
+        bottom = (rect.bottom - 1) // size
+        return [(column, row) for column in range(left, right + 1)
+                for row in range(top, bottom + 1)]
+
+    def add_internal(self, sprite, layer=None):
+        super().add_internal(sprite, layer)
+        self.version += 1
+        cells = self.cells_for(sprite.rect)
+        self.sprite_cells[sprite] = cells
+        for cell in cells:
+            self.cells.setdefault(cell, {})[sprite] = None
+
+    def remove_internal(self, sprite):
+        super().remove_internal(sprite)
+        self.version += 1
+        for cell in self.sprite_cells.pop(sprite, ()):
+            bucket = self.cells[cell]
+            del bucket[sprite]
+            if not bucket:
+                del self.cells[cell]
+
+    def move(self, sprite):
+        """ Put a sprite that has moved into the cells it is in now. """
+        old_cells = self.sprite_cells.get(sprite)
+        if old_cells is None:
+            return
+        cells = self.cells_for(sprite.rect)
+        if cells == old_cells:
+            return
+        self.remove_internal(sprite)
+        self.add_internal(sprite)
+
+    def query(self, rect):
+        """ Every sprite in the cells a rect touches. These are only the
+            sprites that might hit the rect, use collide() to check. """
+        found = {}
+        cells = self.cells
+        for cell in self.cells_for(rect):
+            bucket = cells.get(cell)
+            if bucket:
+                found.update(bucket)
+        return list(found)
+
+    def collide(self, rect):
+        """ Every sprite whose rect overlaps a rect. """
+        candidates = self.query(rect)
+        self.checks += len(candidates)
+        return [sprite for sprite in candidates if rect.colliderect(sprite.rect)]
+
+    def spritecollide(self, sprite, dokill=False):
+        """ Same as pygame.sprite.spritecollide(sprite, group, dokill),
+            but only checks the sprites near it. """
+        hit_list = self.collide(sprite.rect)
+        if dokill:
+            for hit in hit_list:
+                hit.kill()
+        return hit_list
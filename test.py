@@ -2,7 +2,13 @@ import pygame
 import random
 import math
 import pytmx
+from pytmx.util_pygame import pygame_image_loader
+import level_cache
+from audio import AudioService
+from controls import InputState
+from collections import OrderedDict
 from os import path
+from Game import InstructionScreen, LevelStreamer, high_scores
 vec = pygame.math.Vector2
 
 # Global constants
@@ -20,24 +26,32 @@ SCREEN_HEIGHT = 600
 
 TILESIZE = 70
 
+# Tiles along each side of a map chunk, and how many bytes of chunks the
+# chunked map renderer keeps before it throws the farthest ones away
+CHUNK_TILES = 8
+CHUNK_MEMORY_BUDGET = 32 * 1024 * 1024
 
-def collide_with_walls(sprite, group, dir):
+# Most walls in one leaf of the StaticGeometry tree
+GEOMETRY_LEAF_SIZE = 4
+
+
+def collide_with_walls(sprite, walls, dir):
     if dir == 'x':
-        hits = pygame.sprite.spritecollide(sprite, group, False, collide_hit_rect)
+        hits = walls.collide(sprite.hit_rect)
         if hits:
-            if hits[0].rect.centerx > sprite.hit_rect.centerx:
-                sprite.pos.x = hits[0].rect.left - sprite.hit_rect.width / 2
-            if hits[0].rect.centerx < sprite.hit_rect.centerx:
-                sprite.pos.x = hits[0].rect.right + sprite.hit_rect.width / 2
+            if hits[0].centerx > sprite.hit_rect.centerx:
+                sprite.pos.x = hits[0].left - sprite.hit_rect.width / 2
+            if hits[0].centerx < sprite.hit_rect.centerx:
+                sprite.pos.x = hits[0].right + sprite.hit_rect.width / 2
             sprite.vel.x = 0
             sprite.hit_rect.centerx = sprite.pos.x
     if dir == 'y':
-        hits = pygame.sprite.spritecollide(sprite, group, False, collide_hit_rect)
+        hits = walls.collide(sprite.hit_rect)
         if hits:
-            if hits[0].rect.centery > sprite.hit_rect.centery:
-                sprite.pos.y = hits[0].rect.top - sprite.hit_rect.height / 2
-            if hits[0].rect.centery < sprite.hit_rect.centery:
-                sprite.pos.y = hits[0].rect.bottom + sprite.hit_rect.height / 2
+            if hits[0].centery > sprite.hit_rect.centery:
+                sprite.pos.y = hits[0].top - sprite.hit_rect.height / 2
+            if hits[0].centery < sprite.hit_rect.centery:
+                sprite.pos.y = hits[0].bottom + sprite.hit_rect.height / 2
             sprite.vel.y = 0
             sprite.hit_rect.centery = sprite.pos.y
             
@@ -82,10 +96,7 @@ class Player(pygame.sprite.Sprite):
         player = pygame.image.load("aaa.png").convert()
         player.set_colorkey(BLUE)
         self.image = player
-        
-        self.walls = pygame.sprite.Group()
- 
-        
+
         # Set a referance to the image rect.
         self.rect = self.image.get_rect()
 
@@ -114,9 +125,9 @@ class Player(pygame.sprite.Sprite):
         self.rect.center = self.pos
         #self.pos += self.vel * self.dt
         self.hit_rect.centerx = self.pos.x
-        collide_with_walls(self, self.walls, 'x')
+        collide_with_walls(self, self.level.walls, 'x')
         self.hit_rect.centery = self.pos.y
-        collide_with_walls(self, self.walls, 'y')
+        collide_with_walls(self, self.level.walls, 'y')
         self.rect.center = self.hit_rect.center
         
         # See if we hit anything
@@ -301,25 +312,103 @@ class Wall(pygame.sprite.Sprite):
         self.rect.x = x * TILESIZE
         self.rect.y = y * TILESIZE
 
-class Obstacle(pygame.sprite.Sprite):
-    def __init__(self, game, x, y, w, h):
-        self.groups = game.walls
-        pygame.sprite.Sprite.__init__(self, self.groups)
-        self.game = game
-        self.rect = pygame.Rect(x, y, w, h)
-        self.hit_rect = self.rect
-        self.x = x
-        self.y = y
-        self.rect.x = x
-        self.rect.y = y
-
-def collide_hit_rect(one, two):
-    return one.hit_rect.colliderect(two.rect)
+class StaticGeometry:
+    """ The walls in a map. Walls never move, so this is built once when
+        the map is loaded and never changes after that.
+
+        The walls are kept in a tree of bounding boxes. Each node has the
+        box around every wall under it, and its walls are split in half
+        along whichever way they're spread out more. collide() only goes
+        into nodes whose box overlaps the rect, so a few long walls don't
+        make every search look at everything. """
+
+    def __init__(self, rects):
+        self.rects = tuple(sorted((pygame.Rect(rect) for rect in rects),
+                                  key=lambda rect: rect.left))
+        self.root = self.build(list(range(len(self.rects)))) if self.rects else None
+
+    def build(self, indexes):
+        """ A node for some walls, as (box, children, walls). Leaves have
+            no children, other nodes have no walls. """
+        rects = [self.rects[i] for i in indexes]
+        box = rects[0].unionall(rects[1:])
+        if len(indexes) <= GEOMETRY_LEAF_SIZE:
+            return (box, None, indexes)
+        if box.width >= box.height:
+            indexes.sort(key=lambda i: self.rects[i].centerx)
+        else:
+            indexes.sort(key=lambda i: self.rects[i].centery)
+        half = len(indexes) // 2
+        return (box, (self.build(indexes[:half]), self.build(indexes[half:])), None)
+
+    @classmethod
+    def from_tmx(cls, tmxdata, name='wall'):
+        """ Build the walls from the objects with this name in a map. """
+        return cls(pygame.Rect(int(obj.x), int(obj.y), int(obj.width), int(obj.height))
+                   for obj in tmxdata.objects if obj.name == name)
+
+    def collide(self, rect):
+        """ Every wall that overlaps a rect, left to right. """
+        found = []
+        stack = [self.root] if self.root else []
+        while stack:
+            box, children, walls = stack.pop()
+            if not box.colliderect(rect):
+                continue
+            if children is None:
+                found.extend(i for i in walls if self.rects[i].colliderect(rect))
+            else:
+                stack.extend(children)
+        found.sort()
+        return [self.rects[i] for i in found]
+
+    def __len__(self):
+        return len(self.rects)
 
         
+def map_image_loader(map_folder):
+    """ Makes a pytmx image loader that also looks in the map's folder.
+        The tilesets point at their images one folder up from maps/, but
+        the images are kept in maps/ with the maps. """
+    def load(filename, colorkey, **kwargs):
+        return pygame_image_loader(level_cache.find_image(filename, map_folder),
+                                   colorkey, **kwargs)
+    return load
+
+# Tile layer classes, from pytmx or from a compiled map
+TILE_LAYERS = (pytmx.TiledTileLayer, level_cache.CompiledTileLayer)
+
+# Maps that have been read, by filename, and the ones read with pytmx
+# whose tile images have been loaded
+loaded_maps = {}
+loaded_map_images = set()
+
+def read_map(filename):
+    """ Read a map, only the first time. The compiled map is used unless
+        the map uses something the compiler doesn't handle; then pytmx
+        reads it without its images, and load_map_images() loads them. """
+    tm = loaded_maps.get(filename)
+    if tm is None:
+        try:
+            tm = level_cache.load_map(filename)
+        except level_cache.UnsupportedMap:
+            tm = pytmx.TiledMap(filename)
+        loaded_maps[filename] = tm
+    return tm
+
+def load_map_images(filename):
+    """ Load the tile images of a map pytmx read, only the first time.
+        Compiled maps convert their tiles when they're first drawn. """
+    tm = read_map(filename)
+    if isinstance(tm, pytmx.TiledMap) and filename not in loaded_map_images:
+        tm.image_loader = map_image_loader(path.dirname(filename))
+        tm.reload_images()
+        loaded_map_images.add(filename)
+    return tm
+
 class TiledMap:
     def __init__(self, filename):
-        tm = pytmx.load_pygame(filename, pixelalpha=True)
+        tm = load_map_images(filename)
         self.width = tm.width * tm.tilewidth
         self.height = tm.height * tm.tileheight
         self.tmxdata = tm
@@ -327,7 +416,7 @@ class TiledMap:
     def render(self, surface):
         ti = self.tmxdata.get_tile_image_by_gid
         for layer in self.tmxdata.visible_layers:
-            if isinstance(layer, pytmx.TiledTileLayer):
+            if isinstance(layer, TILE_LAYERS):
                 for x, y, gid, in layer:
                     tile = ti(gid)
                     if tile:
@@ -339,6 +428,128 @@ class TiledMap:
         self.render(temp_surface)
         return temp_surface    
 
+class ChunkedMapRenderer:
+    """ Draws a TiledMap without rendering the whole map into one surface.
+
+        The map is split into square chunks of CHUNK_TILES tiles. A chunk
+        is only rendered the first time it is on the screen, and then kept
+        so later frames just blit it. When the chunks kept go over the
+        memory budget, the ones farthest from the view are thrown away;
+        they are rendered again if they come back on screen. """
+
+    def __init__(self, tiled_map, chunk_tiles=CHUNK_TILES, memory_budget=CHUNK_MEMORY_BUDGET):
+        tm = tiled_map.tmxdata
+        self.tmxdata = tm
+        self.width = tiled_map.width
+        self.height = tiled_map.height
+        self.chunk_width = chunk_tiles * tm.tilewidth
+        self.chunk_height = chunk_tiles * tm.tileheight
+        self.memory_budget = memory_budget
+
+        # Rendered chunks by (column, row), least recently drawn first
+        self.chunks = OrderedDict()
+        self.memory = 0
+
+        # Chunks rendered so far, including ones rendered again
+        self.renders = 0
+
+        # The tile layers, and for each the biggest tile image in it.
+        # Tiles bigger than a tile cell spill into the cells right and
+        # below, so they can show up in chunks next to their own.
+        self.layers = []
+        for layer in tm.visible_layers:
+            if isinstance(layer, TILE_LAYERS):
+                gids = set()
+                for row in layer.data:
+                    gids.update(row)
+                widest = tm.tilewidth
+                tallest = tm.tileheight
+                for gid in gids:
+                    tile = tm.get_tile_image_by_gid(gid) if gid else None
+                    if tile:
+                        widest = max(widest, tile.get_width())
+                        tallest = max(tallest, tile.get_height())
+                self.layers.append((layer, widest, tallest))
+
+    def render_chunk(self, column, row):
+        """ Render one chunk of the map to a new surface. """
+        tm = self.tmxdata
+        ti = tm.get_tile_image_by_gid
+        tw = tm.tilewidth
+        th = tm.tileheight
+        left = column * self.chunk_width
+        top = row * self.chunk_height
+        width = min(self.chunk_width, self.width - left)
+        height = min(self.chunk_height, self.height - top)
+        surface = pygame.Surface((width, height))
+
+        for layer, widest, tallest in self.layers:
+            # The tiles in this chunk, plus ones to the left and above
+            # that are big enough to reach into it
+            first_x = max(0, (left - widest) // tw + 1)
+            first_y = max(0, (top - tallest) // th + 1)
+            last_x = min(layer.width, (left + width - 1) // tw + 1)
+            last_y = min(layer.height, (top + height - 1) // th + 1)
+            for y in range(first_y, last_y):
+                data = layer.data[y]
+                for x in range(first_x, last_x):
+                    gid = data[x]
+                    if gid:
+                        tile = ti(gid)
+                        if tile:
+                            surface.blit(tile, (x * tw - left, y * th - top))
+
+        self.renders += 1
+        return surface
+
+    def evict(self, center_x, center_y, keep):
+        """ Throw away the chunks farthest from the center until the
+            chunks fit the memory budget. Chunks in keep are never thrown
+            away. """
+        if self.memory <= self.memory_budget:
+            return
+        def distance(key):
+            column, row = key
+            x = (column + 0.5) * self.chunk_width - center_x
+            y = (row + 0.5) * self.chunk_height - center_y
+            return x * x + y * y
+        for key in sorted(self.chunks, key=distance, reverse=True):
+            if self.memory <= self.memory_budget:
+                break
+            if key not in keep:
+                surface = self.chunks.pop(key)
+                self.memory -= surface.get_width() * surface.get_height() * surface.get_bytesize()
+
+    def draw(self, screen, offset):
+        """ Draw the map onto the screen, moved by an (x, y) offset. """
+        offset_x, offset_y = offset
+        screen_width, screen_height = screen.get_size()
+
+        # The part of the map that is on the screen
+        left = max(0, -offset_x)
+        top = max(0, -offset_y)
+        right = min(self.width, screen_width - offset_x)
+        bottom = min(self.height, screen_height - offset_y)
+        if right <= left or bottom <= top:
+            return
+
+        visible = []
+        for row in range(top // self.chunk_height, (bottom - 1) // self.chunk_height + 1):
+            for column in range(left // self.chunk_width, (right - 1) // self.chunk_width + 1):
+                key = (column, row)
+                chunk = self.chunks.get(key)
+                if chunk is None:
+                    chunk = self.render_chunk(column, row)
+                    self.chunks[key] = chunk
+                    self.memory += chunk.get_width() * chunk.get_height() * chunk.get_bytesize()
+                else:
+                    self.chunks.move_to_end(key)
+                visible.append(key)
+                screen.blit(chunk, (column * self.chunk_width + offset_x,
+                                    row * self.chunk_height + offset_y))
+
+        self.evict((left + right) / 2, (top + bottom) / 2, visible)
+
         
 
 class Level():
@@ -346,7 +557,7 @@ class Level():
         Create a child class for each level with level-specific
         info. """
 
-    def __init__(self, player):
+    def __init__(self, player, seed=None):
         """ Constructor. Pass in a handle to player. Needed for when moving
             platforms collide with the player. """
         self.platform_list = pygame.sprite.Group()
@@ -356,12 +567,20 @@ class Level():
         self.bullet_list = pygame.sprite.Group()
         self.flag_list = pygame.sprite.Group()
         self.player = player
-        self.walls = pygame.sprite.Group()
-        self.wall = pygame.sprite.Group()
+        # The map's walls, filled in when the map is loaded
+        self.walls = StaticGeometry([])
 
         # How far this world has been scrolled left/right
         self.camera = Camera(4060, 1540)
 
+    @classmethod
+    def load(cls):
+        """ Read the files this level needs. """
+
+    @classmethod
+    def preload(cls):
+        """ Get this level's images ready for the display. """
+
     # Update everythign on this level
     def update(self):
         """ Update everything in this level."""
@@ -377,15 +596,7 @@ class Level():
         """ Draw everything on this level. """
 
         # Draw the background
-        for tile_object in self.map.tmxdata.objects:
-            #if tile_object.name == 'player':
-                #self.player = Player(self, tile_object.x, tile_object.y)
-            if tile_object.name == 'enemy':
-                Block(self, tile_object.x, tile_object.y)
-            if tile_object.name == 'wall':
-                Obstacle(self, tile_object.x, tile_object.y, tile_object.width, tile_object.height)
-                
-        self.screen.blit(self.map_img, self.camera.apply_rect(self.map_rect))
+        self.map_renderer.draw(self.screen, self.camera.camera.topleft)
         #self.screen.blit(self.map_img,(self.world_shift // 3,0))
         
 
@@ -403,24 +614,32 @@ class Level():
         game_folder = path.dirname(__file__)
         map_folder = path.join(game_folder, 'maps')
         self.map = TiledMap(path.join(map_folder, 'levelg.tmx'))
-        self.map_img = self.map.make_map()
-        self.map_rect = self.map_img.get_rect()    
+        self.map_renderer = ChunkedMapRenderer(self.map)
+        self.map_rect = pygame.Rect(0, 0, self.map.width, self.map.height)    
 
 # Create platforms for the level
 class Level_01(Level):
     """ Definition for level 1. """
 
-    def __init__(self, player):
+    map_file = path.join(path.dirname(__file__), 'maps', 'levelg.tmx')
+
+    @classmethod
+    def load(cls):
+        """ Read the map, and decode its tilesets if it was compiled. A map
+            pytmx reads gets its images when the level is built. """
+        tm = read_map(cls.map_file)
+        if isinstance(tm, level_cache.CompiledMap):
+            tm.decode_images()
+
+    def __init__(self, player, seed=None):
         """ Create level 1. """
 
         # Call the parent constructor
-        Level.__init__(self, player)
+        Level.__init__(self, player, seed)
         
-        game_folder = path.dirname(__file__)
-        map_folder = path.join(game_folder, 'maps')
-        self.map = TiledMap(path.join(map_folder, 'levelg.tmx'))
-        self.map_img = self.map.make_map()
-        self.map_rect = self.map_img.get_rect()          
+        self.map = TiledMap(self.map_file)
+        self.map_renderer = ChunkedMapRenderer(self.map)
+        self.map_rect = pygame.Rect(0, 0, self.map.width, self.map.height)          
  
         self.camera = Camera(4060, 1540)
         self.load_data
@@ -428,12 +647,15 @@ class Level_01(Level):
         self.screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
         
         
+        # The walls and enemies never change, so set them up once here
+        self.walls = StaticGeometry.from_tmx(self.map.tmxdata)
         for tile_object in self.map.tmxdata.objects:
-            #if tile_object.name == 'player':
-                #self.player = Player(self, tile_object.x, tile_object.y)
-                if tile_object.name == 'wall':
-                    Obstacle(self, tile_object.x, tile_object.y, tile_object.width, tile_object.height)
-                    
+            if tile_object.name == 'enemy':
+                blocks = Block(BLUE)
+                blocks.rect.x = tile_object.x
+                blocks.rect.y = tile_object.y
+                self.blocks_list.add(blocks)
+                self.all_sprite_list.add(blocks)
         
         
             
@@ -453,126 +675,39 @@ class Level_01(Level):
                 #self.all_sprite_list.add(blocks)
                 
                 
-pygame.init()
-
-# Set the height and width of the screen
-size = [SCREEN_WIDTH, SCREEN_HEIGHT]
-screen = pygame.display.set_mode(size)
-
-pygame.display.set_caption("Instruction Screen")
-
-# Loop until the user clicks the close button.
-done = False
-    
-# This is a font we use to draw text on the screen (size 36)
-font = pygame.font.Font(None, 36)
-
-# This is a font we use to draw text on the screen (size 150)
-font2 = pygame.font.Font(None, 150)
-
-display_instructions = True
-instruction_page = 1
-name = ""    
-
-# Used to manage how fast the screen updates
-clock = pygame.time.Clock()
-
-# -------- Instruction Page Loop -----------
-while not done and display_instructions:
-    for event in pygame.event.get():
-        if event.type == pygame.QUIT:
-            done = True
-        if event.type == pygame.KEYDOWN:
-            if event.unicode.isalpha():
-                name += event.unicode
-            elif event.key == pygame.K_BACKSPACE:
-                name = name[:-1]
-            elif event.key == pygame.K_RETURN:
-                instruction_page += 1  
-                if instruction_page == 3:
-                    display_instructions = False                
- 
-    # Set the screen background
-    #screen.fill(BLACK)
-    background = pygame.image.load("menu.jpg").convert()
-    screen.blit(background, [0, 0])
-    
-    if instruction_page == 1:
-        # Draw instructions, page 1
-        # This could also load an image created in another program.
-        # That could be both easier and more flexible.
- 
-        text = font.render("Instructions", True, WHITE)
-        screen.blit(text, [10, 10])
-       
-        text = font.render("Enter your name: ", True, WHITE)
-        screen.blit(text, [10, 40])    
-       
-        text = font.render(name, True, WHITE)
-        screen.blit(text, [220, 40])
-        
-        try:
-            file = open('highscores.txt', 'r')
-            lines = file.readlines()
-            prevhighscore = int(lines[0])
-            prevname = lines[1]
-            file.close()
-        except IOError:
-            file = open('highscores.txt', 'w')
-            prevhighscore = str(0) + "\n"
-            file.write(prevhighscore)
-            writename = name + "\n"
-            file.write(writename)
-            file.close()        
-        
-        text = font.render("Current Highscore: {0}".format(prevhighscore), True, WHITE)
-        screen.blit(text, [10, 100])
- 
-        text = font.render("Hit enter to continue", True, WHITE)
-        screen.blit(text, [10, 80])
-       
-        text = font.render("Page 1", True, WHITE)
-        screen.blit(text, [10, 120])
- 
-    if instruction_page == 2:
-        # Draw instructions, page 2
-        text = font.render("Shoot enemy's in the sky to get a hightscore", True, WHITE)
-        screen.blit(text, [10, 10])    
- 
-        text = font.render("Use A,D and space for movement and Mouse1 to shoot", True, WHITE)
-        screen.blit(text, [10, 40])
- 
-        text = font.render("Hit enter to continue", True, WHITE)
-        screen.blit(text, [10, 80])
- 
-        text = font.render("Page 2", True, WHITE)
-        screen.blit(text, [10, 120])
-        
- 
-    # Limit to 60 frames per second
-    clock.tick(60)
- 
-    # Go ahead and update the screen with what we've drawn.
-    pygame.display.flip()
-   
-    score = 0
-
-
 def main():
     """ Main Program """
     pygame.init()
-    
-    global score
 
     # Set the height and width of the screen
     size = [SCREEN_WIDTH, SCREEN_HEIGHT]
     screen = pygame.display.set_mode(size)
 
-    pygame.display.set_caption("My Game")
+    # This is a font we use to draw text on the screen (size 36)
+    font = pygame.font.Font(None, 36)
+
+    # This is a font we use to draw text on the screen (size 150)
+    font2 = pygame.font.Font(None, 150)
 
     # Create the player
     player = Player(50, 50)
 
+    # Load the level while the instruction pages are up
+    levels = LevelStreamer([Level_01], player)
+    levels.request(0)
+
+    # -------- Instruction Pages -----------
+    pygame.display.set_caption("Instruction Screen")
+    name = InstructionScreen(screen, font).run()
+    if name is None:
+        levels.close()
+        pygame.quit()
+        return
+
+    score = 0
+
+    pygame.display.set_caption("My Game")
+
     # List to hold all the sprites
     all_sprite_list = pygame.sprite.Group()
 
@@ -583,7 +718,7 @@ def main():
 
     # Create all the levels
     level_list = []
-    level_list.append(Level_01(player))
+    level_list.append(levels.get(0))
 
     # Set the current level
     current_level_no = 0
@@ -606,9 +741,10 @@ def main():
     clock = pygame.time.Clock()
     
     # Load sounds recorded by me
-    shoot_sound = pygame.mixer.Sound("shoot2.ogg")
-    death_sound = pygame.mixer.Sound("death.ogg")
-    jump_sound = pygame.mixer.Sound("jump.ogg")
+    audio = AudioService()
+
+    # What the player has pressed since the last frame
+    controls = InputState()
     
     # Sets defaults for timer
     frame_count = 0
@@ -618,78 +754,47 @@ def main():
     # -------- Main Program Loop -----------
     while not done:
         for event in pygame.event.get():
+            controls.handle(event)
             if event.type == pygame.QUIT:
                 done = True
                 
                 # Calculation for the displayed highscore
                 scoregg = round(score + frame_count / 60)
-                
-                # Opens the highscore file and reads the lines.
-                try:
-                    file = open('highscores.txt', 'r')
-                    lines = file.readlines()
-                    prevhighscore_new = int(lines[0])
-                    prevname = lines[1]
-                    file.close()                    
-                
-                # If there is no highscore file, make one.
-                except IOError:
-                    file = open('highscores.txt', 'w')
-                    writescore = str(scoregg) + "\n"
-                    file.write(writescore)
-                    writename = name + "\n"
-                    file.write(writename)
-                    file.close()
-        
-                # Check if the new score is better than the highscore.
-                if scoregg > prevhighscore_new:
-                    file = open('highscores.txt', 'w')
-                    writescore = str(scoregg) + "\n"
-                    file.write(writescore)
-                    writename = name + "\n"
-                    file.write(writename)
-                    file.close()                
-
-            elif not game_over: 
-                if event.type == pygame.MOUSEBUTTONDOWN:
-                    shoot_sound.play()
-                # Fire a bullet if the user clicks the mouse button
-            
-                # Get the mouse position
-                    pos = pygame.mouse.get_pos()
-                    
-                    mouse_x = pos[0]
-                    mouse_y = pos[1]
-
-                    # Create the bullet based on where we are, and where we want to go.
-                    bullet = Bullet(player.rect.x + 100, player.rect.y + 10, mouse_x, mouse_y)
-    
-                    # Add the bullet to the lists
-                    all_sprite_list.add(bullet)
-                    bullet_list.add(bullet)
-            
-            # If the player hits the last flag, end game.
-            if pygame.sprite.spritecollide(player, level_list[0].flag_list, True):
-                game_over = True
-                
-
-            # Settings the keys for movement.
-            if not game_over: 
-                if event.type == pygame.KEYDOWN:
-                    if event.key == pygame.K_a:
-                        player.go_left()
-                    if event.key == pygame.K_d:
-                        player.go_right()
-                    if event.key == pygame.K_SPACE:
-                        player.jump()
-                        jump_sound.play()
-
-            if event.type == pygame.KEYUP:
-                if event.key == pygame.K_a and player.change_x < 0:
-                    player.stop()
-                if event.key == pygame.K_d and player.change_x > 0:
-                    player.stop()
+                high_scores().add(scoregg, name, current_level_no + 1)
 
+        if not game_over:
+            # Fire a bullet for each click of the mouse
+            for mouse_x, mouse_y in controls.clicks:
+                audio.play("shoot")
+
+                # Create the bullet based on where we are, and where we want to go.
+                bullet = Bullet(player.rect.x + 100, player.rect.y + 10, mouse_x, mouse_y)
+
+                # Add the bullet to the lists
+                all_sprite_list.add(bullet)
+                bullet_list.add(bullet)
+
+        # Settings the keys for movement.
+        for action, pressed in controls.changes:
+            if pressed:
+                if game_over:
+                    continue
+                if action == "left":
+                    player.go_left()
+                elif action == "right":
+                    player.go_right()
+                elif action == "jump":
+                    player.jump()
+                    audio.play("jump")
+            elif action == "left" and player.change_x < 0:
+                player.stop()
+            elif action == "right" and player.change_x > 0:
+                player.stop()
+        controls.clear()
+
+        # If the player hits the last flag, end game.
+        if pygame.sprite.spritecollide(player, level_list[0].flag_list, True):
+            game_over = True
         
         # Update the player.
         active_sprite_list.update()
@@ -737,7 +842,7 @@ def main():
                     bullet_list.remove(bullet)
                     all_sprite_list.remove(bullet)
                     score += 1
-                    death_sound.play()
+                    audio.play("death")
             
                     # Remove the bullet if it flies up off the screen
                     if bullet.rect.y < -10:
@@ -775,12 +880,17 @@ def main():
         if game_over:
             frame_count + 0
     
+        # Play the sounds asked for this frame
+        audio.update()
+
         # Limit to 60 frames per second
         clock.tick(60)
 
         # Go ahead and update the screen with what we've drawn.
         pygame.display.flip()
 
+    levels.close()
+
     # Be IDLE friendly. If you forget this line, the program will 'hang'
     # on exit.
     pygame.quit()
@@ -0,0 +1,414 @@
+""" Tests for the parts of the game that can be checked on their own,
+against a simple brute force version of the same thing or against pytmx.
+Run them with:
+
+    python -m pytest test_systems.py
+"""
+import math
+import os
+import random
+import shutil
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+
+import pygame
+import pytest
+import pytmx
+
+import bullets
+import level_cache
+from bullets import BulletArray, BulletPool, ENEMY_SHOT, PLAYER_SHOT
+from enemies import ENEMY_ACTIVE_RADIUS, ENEMY_SWOOP_DEPTH, EnemySwarm
+from highscores import COMPACT_RATIO, HighScore, HighScoreStore
+from spatial import SpatialGroup
+# test.py, the version of the game that plays Tiled maps
+import test as tmx_game
+
+# The maps pytmx can load; test.tmx points at an image that isn't there
+MAPS = ["level1.tmx", "level2.tmx", "levelg.tmx", "kms.tmx"]
+
+@pytest.fixture(scope="module")
+def display():
+    """ A display, for the tests that convert images. """
+    pygame.display.init()
+    yield pygame.display.set_mode((800, 600))
+    pygame.display.quit()
+
+def same_pixels(a, b):
+    """ Whether two surfaces show the same picture. """
+    return a.get_size() == b.get_size() and (
+        pygame.image.tobytes(a, "RGB") == pygame.image.tobytes(b, "RGB"))
+
+def random_rects(rng, count, widths, heights, area=(20000, 3000)):
+    """ Rects put down at random, with sizes from widths and heights. """
+    return [pygame.Rect(rng.randrange(-100, area[0]), rng.randrange(-100, area[1]),
+                        rng.choice(widths), rng.choice(heights))
+            for i in range(count)]
+
+def test_static_geometry_matches_brute_force():
+    rng = random.Random(1)
+    # Some walls much longer than the rest
+    walls = random_rects(rng, 800, [70, 140, 5000, 15000], [70, 700])
+    geometry = tmx_game.StaticGeometry(walls)
+    ordered = sorted(walls, key=lambda wall: wall.left)
+    for rect in random_rects(rng, 2000, range(0, 200), range(0, 200)):
+        assert geometry.collide(rect) == [wall for wall in ordered if wall.colliderect(rect)]
+
+def test_static_geometry_from_map():
+    tm = tmx_game.read_map(os.path.join("maps", "level1.tmx"))
+    walls = [pygame.Rect(int(obj.x), int(obj.y), int(obj.width), int(obj.height))
+             for obj in tm.objects if obj.name == "wall"]
+    geometry = tmx_game.StaticGeometry.from_tmx(tm)
+    assert len(geometry) == len(walls) > 0
+    rng = random.Random(2)
+    size = (tm.width * tm.tilewidth, tm.height * tm.tileheight)
+    for rect in random_rects(rng, 500, range(10, 300), range(10, 300), size):
+        assert sorted(map(tuple, geometry.collide(rect))) == sorted(
+            tuple(wall) for wall in walls if wall.colliderect(rect))
+
+def test_static_geometry_empty():
+    assert tmx_game.StaticGeometry([]).collide(pygame.Rect(0, 0, 10, 10)) == []
+
+def write_big_tile_map(folder):
+    """ A small map with solid tiles bigger than a tile cell, which reach
+        into the chunks right and below their own. """
+    rng = random.Random(4)
+    tiles = []
+    for gid, size in enumerate([(32, 32), (100, 80), (70, 150)], 1):
+        image = pygame.Surface(size)
+        image.fill((rng.randrange(256), rng.randrange(256), rng.randrange(256)))
+        pygame.image.save(image, str(folder / "tile{}.png".format(gid)))
+        tiles.append('<tile id="{}"><image width="{}" height="{}" source="tile{}.png"/>'
+                     '</tile>'.format(gid - 1, size[0], size[1], gid))
+    rows = [",".join(str(rng.choice([0, 0, 1, 2, 3])) for x in range(12)) for y in range(8)]
+    filename = folder / "big_tiles.tmx"
+    filename.write_text(
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        '<map version="1.0" orientation="orthogonal" renderorder="right-down" width="12" '
+        'height="8" tilewidth="32" tileheight="32">\n'
+        '<tileset firstgid="1" name="tiles" tilewidth="100" tileheight="150" tilecount="3" '
+        'columns="0">\n' + "\n".join(tiles) + '\n</tileset>\n'
+        '<layer name="ground" width="12" height="8"><data encoding="csv">\n'
+        + ",\n".join(rows) + '\n</data></layer>\n</map>\n')
+    return str(filename)
+
+@pytest.mark.parametrize("map_file", ["level1.tmx", "levelg.tmx", None])
+def test_chunked_renderer_matches_whole_map(display, tmp_path, map_file):
+    if map_file is None:
+        tiled_map = tmx_game.TiledMap(write_big_tile_map(tmp_path))
+    else:
+        tiled_map = tmx_game.TiledMap(os.path.join("maps", map_file))
+    whole = tiled_map.make_map()
+    # Room for only four chunks, so some are thrown away and drawn again
+    tm = tiled_map.tmxdata
+    renderer = tmx_game.ChunkedMapRenderer(
+        tiled_map, chunk_tiles=4, memory_budget=4 * (4 * tm.tilewidth) * (4 * tm.tileheight) * 4)
+    rng = random.Random(3)
+    chunked = pygame.Surface(display.get_size())
+    expected = pygame.Surface(display.get_size())
+    for i in range(40):
+        offset = (-rng.randrange(-100, tiled_map.width), -rng.randrange(-100, tiled_map.height))
+        chunked.fill((0, 0, 0))
+        renderer.draw(chunked, offset)
+        expected.fill((0, 0, 0))
+        expected.blit(whole, offset)
+        assert same_pixels(chunked, expected)
+    assert renderer.renders > len(renderer.chunks)
+    # Every chunk on its own, including the ones that big tiles reach into
+    for row in range(-(-tiled_map.height // renderer.chunk_height)):
+        for column in range(-(-tiled_map.width // renderer.chunk_width)):
+            chunk = renderer.render_chunk(column, row)
+            area = pygame.Rect((column * renderer.chunk_width, row * renderer.chunk_height),
+                               chunk.get_size())
+            assert same_pixels(chunk, whole.subsurface(area))
+
+def render_layer(tm, layer):
+    """ One tile layer of a map drawn on its own. """
+    surface = pygame.Surface((tm.width * tm.tilewidth, tm.height * tm.tileheight))
+    for x, y, gid in layer:
+        tile = tm.get_tile_image_by_gid(gid) if gid else None
+        if tile:
+            surface.blit(tile, (x * tm.tilewidth, y * tm.tileheight))
+    return surface
+
+@pytest.mark.parametrize("map_file", MAPS)
+def test_compiled_map_matches_pytmx(display, tmp_path, map_file):
+    filename = os.path.join("maps", map_file)
+    expected = pytmx.TiledMap(filename, image_loader=tmx_game.map_image_loader("maps"))
+    expected_layers = [layer for layer in expected.visible_layers
+                       if isinstance(layer, pytmx.TiledTileLayer)]
+    # Compiled in memory, and written out and memory-mapped
+    compiled_file = level_cache.compile_map(filename, str(tmp_path / "map.lvl"))
+    for tm in [level_cache.CompiledMap(filename, level_cache.compile_bytes(filename)),
+               level_cache.CompiledMap(filename, compiled_file)]:
+        assert (tm.width, tm.height, tm.tilewidth, tm.tileheight) == (
+            expected.width, expected.height, expected.tilewidth, expected.tileheight)
+        assert [(obj.name, obj.type, obj.x, obj.y, obj.width, obj.height)
+                for obj in tm.objects] == [
+            (obj.name, obj.type, obj.x, obj.y, obj.width, obj.height)
+            for obj in expected.objects]
+        assert [layer.name for layer in tm.visible_layers] == [
+            layer.name for layer in expected_layers]
+        for layer, expected_layer in zip(tm.visible_layers, expected_layers):
+            assert same_pixels(render_layer(tm, layer), render_layer(expected, expected_layer))
+
+def test_compiled_map_goes_stale(tmp_path):
+    filename = str(tmp_path / "level1.tmx")
+    shutil.copy(os.path.join("maps", "level1.tmx"), filename)
+    for source in level_cache.tileset_sources(
+            level_cache.ElementTree.parse(filename).getroot(), "maps"):
+        shutil.copy(source, str(tmp_path))
+    compiled = level_cache.cache_path(filename)
+
+    def up_to_date():
+        digest, current = level_cache.read_stamp(filename, compiled)
+        return digest == current
+
+    level_cache.load_map(filename)
+    assert up_to_date()
+    # Loading again uses the compiled file as it is
+    written = os.stat(compiled).st_mtime_ns
+    level_cache.load_map(filename)
+    assert os.stat(compiled).st_mtime_ns == written
+
+    # Changing the map or one of its tilesets makes it compile again
+    for changed in [filename, str(tmp_path / "bb.tsx")]:
+        with open(changed, "a") as file:
+            file.write("\n")
+        assert not up_to_date()
+        level_cache.load_map(filename)
+        assert up_to_date()
+
+def best_scores(entries, size):
+    """ The best few scores of a list, the slow way. """
+    return sorted(entries, key=lambda entry: (-entry.score, entry.when))[:size]
+
+def check_leaderboards(store, entries, size):
+    def scores(board):
+        return [(entry.score, entry.name, entry.level) for entry in board]
+    assert scores(store.best()) == scores(best_scores(entries, size))
+    for name in set(entry.name for entry in entries):
+        assert scores(store.best(name=name)) == scores(
+            best_scores([entry for entry in entries if entry.name == name], size))
+    for level in set(entry.level for entry in entries):
+        assert scores(store.best(level=level)) == scores(
+            best_scores([entry for entry in entries if entry.level == level], size))
+
+def test_high_scores_match_brute_force(tmp_path):
+    filename = str(tmp_path / "scores.log")
+    size = 3
+    store = HighScoreStore(filename, str(tmp_path / "none.txt"), size)
+    rng = random.Random(5)
+    entries = []
+    # Different scores, so ties can't put them in a different order
+    for score in rng.sample(range(100000), 300):
+        entries.append(store.add(score, rng.choice(["Ann", "Bob", "Cy"]), rng.choice([1, 2, 3, 4])))
+    check_leaderboards(store, entries, size)
+    store.flush()
+    store.close()
+
+    # The log was compacted as it grew
+    with open(filename, encoding="utf-8") as file:
+        lines = file.readlines()
+    assert len(lines) == store.lines
+    assert len(lines) <= COMPACT_RATIO * max(size, len(store.kept()))
+
+    reopened = HighScoreStore(filename, str(tmp_path / "none.txt"), size)
+    check_leaderboards(reopened, entries, size)
+    reopened.close()
+
+def test_high_scores_skip_broken_lines(tmp_path):
+    filename = str(tmp_path / "scores.log")
+    entries = [HighScore(300, "Ann", 1, 1.0), HighScore(500, "Bob", 2, 2.0)]
+    with open(filename, "w", encoding="utf-8", newline="\n") as file:
+        file.write(entries[0].line())
+        file.write("not a score\n")
+        file.write(entries[1].line())
+        # Cut off part way through writing it
+        file.write(HighScore(900, "Cy", 1, 3.0).line()[:-5])
+    store = HighScoreStore(filename, str(tmp_path / "none.txt"))
+    check_leaderboards(store, entries, 10)
+
+    # The broken lines are gone, so new scores go on lines of their own
+    with open(filename, encoding="utf-8", newline="\n") as file:
+        assert all(HighScore.from_line(line) for line in file)
+    entries.append(store.add(700, "Cy", 1))
+    store.close()
+    reopened = HighScoreStore(filename, str(tmp_path / "none.txt"))
+    check_leaderboards(reopened, entries, 10)
+    reopened.close()
+
+def test_high_scores_read_legacy_file(tmp_path):
+    legacy_file = tmp_path / "highscores.txt"
+    legacy_file.write_text("1234\nAnn\n")
+    store = HighScoreStore(str(tmp_path / "scores.log"), str(legacy_file))
+    assert [(entry.score, entry.name) for entry in store.best()] == [(1234, "Ann")]
+    assert os.path.exists(store.filename)
+    store.close()
+
+    legacy_file.write_text("no score here\n")
+    store = HighScoreStore(str(tmp_path / "other.log"), str(legacy_file))
+    assert store.best() == [] and store.best_score() == 0
+    store.close()
+
+def make_bullets(kind):
+    """ An empty bullet system of a kind, big enough not to drop shots. """
+    if kind == "array":
+        if bullets.numpy is None:
+            pytest.skip("BulletArray needs NumPy")
+        return BulletArray(1000)
+    return BulletPool(1000)
+
+def bullet_rects(system):
+    """ The rect and side of every bullet in the air. """
+    if isinstance(system, BulletArray):
+        return [(pygame.Rect(int(x), int(y), system.width, system.height), int(faction))
+                for x, y, faction in zip(system.x[:system.count], system.y[:system.count],
+                                         system.faction[:system.count])]
+    return [(bullet.rect.copy(), bullet.faction) for bullet in system.bullets]
+
+class Block(pygame.sprite.Sprite):
+    """ A sprite that is only a rect, for bullets to hit. """
+
+    def __init__(self, rect):
+        super().__init__()
+        self.rect = rect
+
+@pytest.mark.parametrize("kind", ["pool", "array"])
+@pytest.mark.parametrize("mask", [PLAYER_SHOT, ENEMY_SHOT, PLAYER_SHOT | ENEMY_SHOT])
+def test_bullets_hit_blocks_like_brute_force(kind, mask):
+    rng = random.Random(6)
+    system = make_bullets(kind)
+    for i in range(400):
+        system.fire(rng.randrange(800), rng.randrange(600), rng.randrange(800), rng.randrange(600),
+                    faction=rng.choice([PLAYER_SHOT, ENEMY_SHOT]))
+    shots = bullet_rects(system)
+    blocks = [Block(rect) for rect in random_rects(rng, 150, [20, 40], [20, 40], (800, 600))]
+    group = SpatialGroup(blocks)
+
+    hit = system.collide(group, mask)
+    expected = [block for block in blocks
+                if any(faction & mask and rect.colliderect(block.rect) for rect, faction in shots)]
+    assert set(hit) == set(expected) and len(hit) == len(expected)
+    assert all(block.alive() == (block not in expected) for block in blocks)
+
+    # Shots from the other side are all still there, and none of the
+    # shots left hit a block that's still there
+    left = bullet_rects(system)
+    assert ([shot for shot in left if not shot[1] & mask] ==
+            [shot for shot in shots if not shot[1] & mask])
+    assert not any(rect.colliderect(block.rect) for rect, faction in left if faction & mask
+                   for block in group)
+    if kind == "array":
+        # Every shot that hit something is gone
+        assert len(left) == len([shot for shot in shots if not shot[1] & mask or not any(
+            shot[0].colliderect(block.rect) for block in blocks)])
+
+@pytest.mark.parametrize("kind", ["pool", "array"])
+def test_bullets_hit_sprite_by_side(kind):
+    system = make_bullets(kind)
+    target = Block(pygame.Rect(100, 100, 40, 40))
+    system.fire(110, 110, 200, 110, faction=PLAYER_SHOT)
+    system.fire(120, 120, 200, 120, faction=ENEMY_SHOT)
+    system.fire(500, 500, 600, 500, faction=ENEMY_SHOT)
+
+    # Only the enemy shot on the target hits it, and only it is removed
+    assert system.hit(target, ENEMY_SHOT)
+    assert sorted(bullet_rects(system)) == [((110, 110, 4, 10), PLAYER_SHOT),
+                                            ((500, 500, 4, 10), ENEMY_SHOT)]
+    assert not system.hit(target, ENEMY_SHOT)
+    assert system.hit(target, PLAYER_SHOT | ENEMY_SHOT)
+    assert len(system) == 1
+    system.clear()
+    assert len(system) == 0 and bullet_rects(system) == []
+
+# The enemies only move with NumPy
+needs_numpy = pytest.mark.skipif(bullets.numpy is None, reason="EnemySwarm needs NumPy")
+
+class View():
+    """ The part of a camera the enemies look at. """
+
+    def __init__(self, rect):
+        self.view = rect
+
+def add_enemies(swarm, rects, behaviour, **options):
+    """ Enemies at some rects. Returns their sprites. """
+    sprites = [Block(rect) for rect in rects]
+    swarm.add(sprites, behaviour, **options)
+    return sprites
+
+@needs_numpy
+def test_enemy_swarm_behaviours():
+    rng = random.Random(7)
+    camera = View(pygame.Rect(0, 0, 800, 600))
+    player = Block(pygame.Rect(390, 290, 20, 20))
+    swarm = EnemySwarm(pygame.Surface((20, 20)))
+    patrol = add_enemies(swarm, random_rects(rng, 20, [20], [20], (700, 500)), "patrol",
+                         speed=3, reach=50, direction=[rng.choice([1, -1]) for i in range(20)])
+    swoop = add_enemies(swarm, random_rects(rng, 20, [20], [20], (700, 300)), "swoop",
+                        speed=3, reach=80)
+    # Close enough to the player to chase, and too far
+    chase = add_enemies(swarm, [pygame.Rect(390 + 200 * math.cos(angle), 290 + 200 * math.sin(angle),
+                                            20, 20) for angle in range(6)], "chase", reach=250)
+    idle = add_enemies(swarm, [pygame.Rect(50, 50, 20, 20)], "chase", reach=250)
+    # Too far from the view to move at all
+    far = add_enemies(swarm, [pygame.Rect(800 + ENEMY_ACTIVE_RADIUS + 10, 100, 20, 20)], "patrol")
+
+    def where(sprite):
+        i = swarm.index[sprite]
+        return (float(swarm.x[i]), float(swarm.y[i]),
+                float(swarm.home_x[i]), float(swarm.home_y[i]))
+
+    def distance(sprite):
+        x, y = where(sprite)[:2]
+        return math.hypot(player.rect.centerx - (x + 10), player.rect.centery - (y + 10))
+
+    reached = {sprite: [0, 0] for sprite in patrol}
+    for tick in range(200):
+        before = [distance(sprite) for sprite in chase]
+        swarm.update(camera, player)
+        for sprite in patrol:
+            x, y, home_x, home_y = where(sprite)
+            assert abs(x - home_x) <= 50 + 3 and y == home_y
+            reached[sprite][x > home_x] = max(reached[sprite][x > home_x], abs(x - home_x))
+        for sprite in swoop:
+            x, y, home_x, home_y = where(sprite)
+            assert abs(x - home_x) <= 80 and home_y <= y <= home_y + ENEMY_SWOOP_DEPTH
+        for sprite, old in zip(chase, before):
+            assert distance(sprite) <= max(old, 2)
+        for sprite in idle + far:
+            assert where(sprite)[:2] == where(sprite)[2:]
+    # The patrols went to both ends of their range, and the chasers caught up
+    assert all(low >= 50 and high >= 50 for low, high in reached.values())
+    assert all(distance(sprite) <= 2 for sprite in chase)
+
+@needs_numpy
+@pytest.mark.parametrize("kind", ["pool", "array"])
+def test_enemy_swarm_shot_down(kind):
+    rng = random.Random(8)
+    camera = View(pygame.Rect(0, 0, 800, 600))
+    swarm = EnemySwarm(pygame.Surface((20, 20)))
+    near = add_enemies(swarm, random_rects(rng, 100, [20], [20], (800, 600)), "patrol", speed=0)
+    far = add_enemies(swarm, [rect.move(2000, 0) for rect in
+                              random_rects(rng, 20, [20], [20], (800, 600))], "patrol", speed=0)
+    swarm.update(camera, Block(pygame.Rect(0, 0, 20, 20)))
+    group = pygame.sprite.Group(near + far)
+
+    system = make_bullets(kind)
+    bounds = pygame.Rect(-100, -100, 3000, 800)
+    for i in range(300):
+        system.fire(rng.randrange(-100, 2900), rng.randrange(-100, 700), 0, 0, bounds,
+                    faction=rng.choice([PLAYER_SHOT, ENEMY_SHOT]))
+    for sprite in far:
+        system.fire(sprite.rect.x + 5, sprite.rect.y + 5, 0, 0, bounds)
+    shots = bullet_rects(system)
+
+    hit = swarm.collide(system)
+    # Only the player's shots hit enemies, and only ones near the view
+    expected = [sprite for sprite in near if any(
+        faction == PLAYER_SHOT and rect.colliderect(sprite.rect) for rect, faction in shots)]
+    assert expected and set(hit) == set(expected) and len(hit) == len(expected)
+    assert set(group) == set(near + far) - set(expected)
+    assert [bool(swarm.alive[swarm.index[sprite]]) for sprite in near + far] == [
+        sprite not in expected for sprite in near + far]